@@ -0,0 +1,237 @@
+import ast
+import asyncio
+import builtins
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, NamedTuple, Optional
+
+import metrics
+
+# --- Configuration ---
+#
+#  A quick ast pass over Python code before it goes to the model. What it
+#  finds is added to the prompt (undefined names, loop nesting, recursion,
+#  missing docstrings, depending on the review type), and code that
+#  doesn't parse or is empty gets an answer right away with no model call.
+#
+#  Anything but short snippets is analysed on a small pool so parsing a
+#  big file doesn't stall the event loop. ANALYSIS_EXECUTOR=process
+#  analyses the files of a batch on several cores at once.
+#
+ANALYSIS_ENABLED = os.getenv("ANALYSIS_ENABLED", "1") != "0"
+ANALYSIS_EXECUTOR = os.getenv("ANALYSIS_EXECUTOR", "thread")
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Code shorter than this is analysed inline: parsing it costs less than
+# the hop to the pool.
+ANALYSIS_INLINE_CHARS = 4000
+# At most this many findings go into one prompt.
+ANALYSIS_MAX_FINDINGS = 20
+# Loops nested this deep are worth a mention in a general review.
+DEEP_LOOP_DEPTH = 3
+
+# Syntax errors only stop the review types that can't do anything useful
+# with broken code; a refactor may fix it and an explanation may still help.
+SHORT_CIRCUIT_TYPES = {"general", "documentation", "competitive"}
+
+_KNOWN_NAMES = set(dir(builtins)) | {
+    "__file__", "__name__", "__doc__", "__builtins__", "__spec__", "__loader__",
+    "__package__", "__path__", "__annotations__", "__class__", "__module__", "__qualname__",
+}
+_SCOPES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)
+_LOOPS = (ast.For, ast.AsyncFor, ast.While)
+_COMPREHENSIONS = (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)
+
+_executor = None
+
+SHORT_CIRCUITS = metrics.Counter(
+    "analysis_short_circuits_total", "Reviews answered by static analysis without a model call.", ("reason",)
+)
+
+EMPTY_CODE_ANSWER = "There's no code to review yet. Paste or upload some code and try again."
+
+
+class Finding(NamedTuple):
+    line: int  # 1-based
+    message: str
+
+    def __str__(self):
+        return f"Line {self.line}: {self.message}"
+
+class Report(NamedTuple):
+    findings: List[Finding]  # Notes for the prompt, in line order.
+    answer: Optional[str]    # The whole review, if no model call is needed.
+
+
+NO_REPORT = Report([], None)
+
+
+# --- Checks ---
+
+def _syntax_error_answer(code: str, error: SyntaxError) -> str:
+    line = error.lineno or 1
+    where = f"Line {line}" + (f", column {error.offset}" if error.offset else "")
+    lines = code.replace("\r\n", "\n").split("\n")
+    source = lines[line - 1] if 0 < line <= len(lines) else ""
+    caret = " " * max(0, (error.offset or 1) - 1) + "^"
+    return (
+        "### Syntax Error\n\n"
+        "This code doesn't parse, so it wasn't sent for review.\n\n"
+        f"- **{where}:** {error.msg}\n\n"
+        f"```\n{source}\n{caret}\n```\n\n"
+        "Fix this and submit the code again."
+    )
+
+def _undefined_names(nodes) -> List[Finding]:
+    """
+    Names that are read but never bound anywhere in the file. Scopes are
+    ignored on purpose: a name bound anywhere counts as defined, so what
+    is reported is almost certainly a typo or a missing import.
+    """
+    bound = set()
+    loads = []
+    for node in nodes:
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, ast.Load):
+                loads.append(node)
+            else:
+                bound.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            bound.add(node.name)
+        elif isinstance(node, ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                if alias.name == "*":
+                    return []  # Anything could come from a star import.
+                bound.add((alias.asname or alias.name).split(".")[0])
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            bound.update(node.names)
+        elif getattr(node, "name", None) and isinstance(node, (ast.ExceptHandler, ast.MatchAs, ast.MatchStar)):
+            bound.add(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            bound.add(node.rest)
+    first_use = {}
+    for node in loads:
+        if node.id not in bound and node.id not in _KNOWN_NAMES:
+            first_use[node.id] = min(node.lineno, first_use.get(node.id, node.lineno))
+    return [Finding(line, f"`{name}` is used but never defined or imported.") for name, line in first_use.items()]
+
+def _loop_depth(node, depth: int = 0) -> int:
+    """Deepest loop nesting inside node, not counting nested functions/classes."""
+    deepest = depth
+    for child in ast.iter_child_nodes(node):
+        if isinstance(child, _SCOPES):
+            continue
+        if isinstance(child, _LOOPS):
+            child_depth = depth + 1
+        elif isinstance(child, _COMPREHENSIONS):
+            child_depth = depth + len(child.generators)
+        else:
+            child_depth = depth
+        deepest = max(deepest, _loop_depth(child, child_depth))
+    return deepest
+
+def _functions(nodes):
+    return [n for n in nodes if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef))]
+
+def _loop_findings(tree, nodes, min_depth: int) -> List[Finding]:
+    findings = []
+    for statement in tree.body:
+        if isinstance(statement, _SCOPES):
+            continue
+        depth = _loop_depth(ast.Module(body=[statement], type_ignores=[]))
+        if depth >= min_depth:
+            findings.append(Finding(statement.lineno, f"top-level loops nested {depth} deep."))
+    for function in _functions(nodes):
+        depth = _loop_depth(function)
+        if depth >= min_depth:
+            findings.append(Finding(function.lineno, f"`{function.name}` has loops nested {depth} deep."))
+    return findings
+
+def _recursion_findings(nodes) -> List[Finding]:
+    findings = []
+    for function in _functions(nodes):
+        calls_itself = any(
+            isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == function.name
+            for node in ast.walk(function)
+        )
+        if calls_itself:
+            findings.append(Finding(function.lineno, f"`{function.name}` is recursive."))
+    return findings
+
+def _docstring_findings(tree, nodes) -> List[Finding]:
+    findings = []
+    definitions = [n for n in nodes if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))]
+    if definitions and ast.get_docstring(tree) is None:
+        findings.append(Finding(1, "the module has no docstring."))
+    for node in definitions:
+        if node.name.startswith("_") or ast.get_docstring(node) is not None:
+            continue
+        kind = "class" if isinstance(node, ast.ClassDef) else "function"
+        findings.append(Finding(node.lineno, f"{kind} `{node.name}` has no docstring."))
+    return findings
+
+
+# --- Analysis ---
+
+def analyze(code: str, review_type: str, language: Optional[str] = None) -> Report:
+    """
+    Static findings for the prompt and, for empty or unparseable code, a
+    ready answer. Only Python (language "python") is parsed.
+    """
+    if not code.strip():
+        return Report([], EMPTY_CODE_ANSWER)
+    if language != "python":
+        return NO_REPORT
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        if review_type in SHORT_CIRCUIT_TYPES:
+            return Report([], _syntax_error_answer(code, e))
+        return Report([Finding(e.lineno or 1, f"syntax error: {e.msg}.")], None)
+    except (ValueError, RecursionError, MemoryError):
+        return NO_REPORT  # Null bytes, or nesting too deep to analyse.
+    try:
+        findings = _findings(tree, review_type)
+    except RecursionError:
+        return NO_REPORT
+    findings.sort(key=lambda f: f.line)
+    return Report(findings[:ANALYSIS_MAX_FINDINGS], None)
+
+def _findings(tree, review_type: str) -> List[Finding]:
+    if review_type == "explain":
+        return []
+    nodes = list(ast.walk(tree))
+    if review_type == "documentation":
+        return _docstring_findings(tree, nodes)
+    if review_type == "competitive":
+        return _loop_findings(tree, nodes, 1) + _recursion_findings(nodes)
+    if review_type == "general":
+        return _undefined_names(nodes) + _loop_findings(tree, nodes, DEEP_LOOP_DEPTH)
+    if review_type == "refactor":
+        return _undefined_names(nodes)
+    return []
+
+def _get_executor():
+    # Created on first use so importing this module never forks.
+    global _executor
+    if _executor is None:
+        if ANALYSIS_EXECUTOR == "process":
+            _executor = ProcessPoolExecutor(max_workers=ANALYSIS_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix="analysis")
+    return _executor
+
+async def analyze_async(code: str, review_type: str, language: Optional[str] = None) -> Report:
+    """analyze, on the analysis pool unless the code is short."""
+    if not ANALYSIS_ENABLED:
+        return NO_REPORT
+    with metrics.time_stage("static_analysis"):
+        if len(code) < ANALYSIS_INLINE_CHARS:
+            report = analyze(code, review_type, language)
+        else:
+            loop = asyncio.get_running_loop()
+            report = await loop.run_in_executor(_get_executor(), analyze, code, review_type, language)
+    if report.answer is not None:
+        SHORT_CIRCUITS.labels("empty" if report.answer == EMPTY_CODE_ANSWER else "syntax_error").inc()
+    return report
\ No newline at end of file
@@ -0,0 +1,419 @@
+"""
+Micro-benchmarks for the backend, run against a fake local model so no
+API key or network is needed.
+
+Usage (from the Backend folder):
+    python benchmark.py review_concurrency --requests 50 --latency 0.5
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+import database
+import gemini_client
+import llm_backends
+import history
+import review_cache
+import similarity
+
+
+# --- Fake Model ---
+
+def use_fake_model(latency: float, **kwargs):
+    """
+    Switches gemini_client to the fake backend, with `latency` seconds to
+    the first token (see llm_backends.FakeBackend for the other knobs).
+    """
+    llm_backends.set_backend(llm_backends.FakeBackend(latency_ms=latency * 1000, seed=0, **kwargs))
+
+def load_app():
+    """
+    Imports main with its databases in a scratch directory and the fake
+    model, so benchmarks never touch the real code_reviewer.db.
+    """
+    scratch = tempfile.mkdtemp()
+    database.DATABASE_URL = os.path.join(scratch, "code_reviewer.db")
+    review_cache.CACHE_DATABASE_URL = os.path.join(scratch, "review_cache.db")
+    use_fake_model(0)
+    import main
+    return main
+
+
+# --- Scenarios ---
+
+SAMPLE_CODE = "def add(a, b):\n    return a + b\n"
+
+def unique_code(i: int) -> str:
+    # Distinct per request, so neither the cache nor coalescing kicks in.
+    return f"{SAMPLE_CODE}x = {i}\n"
+
+async def _run_overlapping(handler, n: int) -> float:
+    start = time.perf_counter()
+    await asyncio.gather(*(handler(i) for i in range(n)))
+    return time.perf_counter() - start
+
+def bench_review_concurrency(args):
+    """
+    Fires N overlapping /review-style handlers on one event loop, first
+    with the old blocking call and then with the async path.
+    """
+    use_fake_model(args.latency)
+    # Measure upstream calls only (and keep the run off disk).
+    review_cache.CACHE_ENABLED = False
+
+    async def blocking_handler(i):
+        return gemini_client.get_code_review(unique_code(i), "general")
+
+    async def async_handler(i):
+        return await gemini_client.get_code_review_async(unique_code(i), "general")
+
+    blocking = asyncio.run(_run_overlapping(blocking_handler, args.requests))
+    concurrent = asyncio.run(_run_overlapping(async_handler, args.requests))
+
+    print(f"{args.requests} overlapping reviews, {args.latency:.2f}s model latency, "
+          f"limit={gemini_client.MAX_CONCURRENT_MODEL_CALLS}")
+    print(f"  blocking: {blocking:8.2f}s  {args.requests / blocking:8.1f} req/s")
+    print(f"  async:    {concurrent:8.2f}s  {args.requests / concurrent:8.1f} req/s")
+    print(f"  speedup:  {blocking / concurrent:8.1f}x")
+
+
+def bench_review_cache(args):
+    """
+    Repeats the same review N times (with whitespace/comment edits) and
+    reports cold, in-memory and SQLite-tier latencies.
+    """
+    use_fake_model(args.latency)
+    review_cache.CACHE_DATABASE_URL = os.path.join(tempfile.mkdtemp(), "review_cache.db")
+    review_cache.init_cache()
+
+    variants = [SAMPLE_CODE, "# add two numbers\n" + SAMPLE_CODE, SAMPLE_CODE.replace("\n", "  \n\n")]
+
+    def timed_review(code):
+        start = time.perf_counter()
+        asyncio.run(gemini_client.get_code_review_async(code, "general", "python"))
+        return time.perf_counter() - start
+
+    cold = timed_review(SAMPLE_CODE)
+    warm = [timed_review(variants[i % len(variants)]) for i in range(args.requests)]
+    review_cache.clear_memory()
+    disk = timed_review(SAMPLE_CODE)
+
+    print(f"Repeat reviews, {args.latency:.2f}s model latency")
+    print(f"  cold (model call):  {cold * 1000:9.3f} ms")
+    print(f"  memory hit (mean):  {sum(warm) / len(warm) * 1000:9.3f} ms")
+    print(f"  sqlite hit:         {disk * 1000:9.3f} ms")
+    print(f"  stats: {review_cache.get_stats()}")
+
+
+def bench_review_stream(args):
+    """
+    Time-to-first-chunk vs. full generation time for streamed reviews.
+    The fake model spends 5% of --latency before the first token and
+    generates the rest of its 200 tokens over the remaining 95%.
+    """
+    use_fake_model(args.latency * 0.05, output_tokens=200, tokens_per_sec=200 / (args.latency * 0.95))
+    review_cache.CACHE_ENABLED = False
+
+    async def one_review(i):
+        start = time.perf_counter()
+        first = None
+        async for event, _ in gemini_client.stream_code_review(unique_code(i), "general"):
+            if first is None and event == "chunk":
+                first = time.perf_counter() - start
+        return first, time.perf_counter() - start
+
+    async def run():
+        return await asyncio.gather(*(one_review(i) for i in range(args.requests)))
+
+    results = asyncio.run(run())
+    ttfb = sorted(r[0] for r in results)
+    total = sorted(r[1] for r in results)
+    print(f"{args.requests} streamed reviews, {args.latency:.2f}s model latency")
+    print(f"  first chunk (median): {ttfb[len(ttfb) // 2] * 1000:9.1f} ms")
+    print(f"  complete (median):    {total[len(total) // 2] * 1000:9.1f} ms")
+
+
+def bench_auth(args):
+    """Per-request cost of the get_current_user dependency, cold vs. cached."""
+    main = load_app()
+    import token_cache
+
+    database.create_user("bench", "bench-password")
+    token = main.create_access_token({"sub": "bench"}, timedelta(minutes=30))
+
+    def per_call_us(n):
+        async def run():
+            start = time.perf_counter()
+            for _ in range(n):
+                await main.get_current_user(token)
+            return (time.perf_counter() - start) / n * 1e6
+        return asyncio.run(run())
+
+    token_cache.TOKEN_CACHE_ENABLED = False
+    uncached = per_call_us(args.requests)
+    token_cache.TOKEN_CACHE_ENABLED = True
+    cached = per_call_us(args.requests)
+
+    print(f"get_current_user over {args.requests} calls")
+    print(f"  decode + DB lookup: {uncached:9.1f} us/call")
+    print(f"  token cache hit:    {cached:9.1f} us/call")
+
+
+def _legacy_get_user(username):
+    # The pre-pool code path: fresh connection, default journal mode.
+    conn = sqlite3.connect(database.DATABASE_URL)
+    conn.row_factory = sqlite3.Row
+    try:
+        row = conn.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+def _legacy_create_user(username, password):
+    conn = sqlite3.connect(database.DATABASE_URL)
+    try:
+        conn.execute(
+            "INSERT INTO users (username, hashed_password) VALUES (?, ?)",
+            (username, database.get_password_hash(password))
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    return _legacy_get_user(username)
+
+def bench_db(args):
+    """
+    Register/login/auth mix (1 write : 9 reads) from --clients threads,
+    per-call connections vs. the pooled WAL connections. Password hashing
+    is stubbed out so only database cost is measured.
+    """
+    load_app()
+    database.get_password_hash = lambda password: "not-a-real-hash"
+
+    def run(get_user, create_user, label):
+        database.DATABASE_URL = os.path.join(tempfile.mkdtemp(), "code_reviewer.db")
+        database.init_db()
+        for i in range(100):
+            create_user(f"seed{i}", "pw")
+        latencies, errors = [], []
+        lock = threading.Lock()
+
+        def client(cid):
+            rng = random.Random(cid)
+            for i in range(args.requests):
+                start = time.perf_counter()
+                try:
+                    if i % 10 == 0:
+                        create_user(f"c{cid}-{i}", "pw")
+                    else:
+                        get_user(f"seed{rng.randrange(100)}")
+                except sqlite3.Error as e:
+                    with lock:
+                        errors.append(e)
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+
+        threads = [threading.Thread(target=client, args=(c,)) for c in range(args.clients)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+        print(f"  {label:8} {len(latencies) / elapsed:9.0f} ops/s  p99 {p99:7.2f} ms  errors {len(errors)}")
+
+    print(f"{args.clients} clients x {args.requests} ops")
+    run(_legacy_get_user, _legacy_create_user, "legacy")
+    run(database.get_user, database.create_user, "pooled")
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def bench_login_burst(args):
+    """
+    --requests concurrent password verifications on one event loop while
+    a probe coroutine stands in for /review traffic, first verifying
+    inline (the old /token path) and then on the hashing pool.
+    """
+    hashed = database.get_password_hash("bench-password")
+
+    async def inline_verify():
+        return database.verify_password("bench-password", hashed)
+
+    async def pooled_verify():
+        return await database.verify_password_async("bench-password", hashed)
+
+    async def run(verify):
+        lags, logins, rejected = [], [], 0
+        done = asyncio.Event()
+
+        async def probe():
+            while not done.is_set():
+                start = time.perf_counter()
+                await asyncio.sleep(0.01)
+                lags.append(time.perf_counter() - start - 0.01)
+
+        async def login(arrived):
+            # Latency counts from when the burst arrived, queueing included.
+            nonlocal rejected
+            try:
+                await verify()
+                logins.append(time.perf_counter() - arrived)
+            except database.PasswordHashingBusy:
+                rejected += 1
+
+        probe_task = asyncio.create_task(probe())
+        await asyncio.sleep(0.05)
+        arrived = time.perf_counter()
+        await asyncio.gather(*(login(arrived) for _ in range(args.requests)))
+        done.set()
+        await probe_task
+        return logins, lags, rejected
+
+    print(f"Burst of {args.requests} logins, {database.HASH_EXECUTOR} pool "
+          f"x{database.HASH_WORKERS}, queue limit {database.HASH_QUEUE_LIMIT}")
+    for label, verify in (("inline", inline_verify), ("pooled", pooled_verify)):
+        logins, lags, rejected = asyncio.run(run(verify))
+        login_p99 = _percentile(logins, 99) * 1000 if logins else float("nan")
+        print(f"  {label}: login p99 {login_p99:8.1f} ms, review-loop lag p99 "
+              f"{_percentile(lags, 99) * 1000:8.1f} ms, rejected {rejected}")
+
+
+def bench_setup(args):
+    """
+    Per-request setup before the network call: building the model handle
+    and the prompt. "legacy" is the original path (a GenerativeModel and
+    an if/elif chain over the templates); "current" is get_gemini_model
+    and build_review_prompt, which also times the prompt_build stage.
+    Nothing is sent upstream.
+    """
+    import google.generativeai as genai
+    code = SAMPLE_CODE * 1000
+    templates = {
+        "general": gemini_client.GENERAL_REVIEW_PROMPT,
+        "documentation": gemini_client.DOC_REVIEW_PROMPT,
+        "competitive": gemini_client.CP_REVIEW_PROMPT,
+        "refactor": gemini_client.REFACTOR_REVIEW_PROMPT,
+        "explain": gemini_client.EXPLAIN_REVIEW_PROMPT,
+    }
+
+    def legacy(review_type):
+        model = genai.GenerativeModel(gemini_client.MODEL_NAME)
+        for name, template in templates.items():
+            if review_type == name:
+                return model, template.format(code=code)
+
+    def current(review_type):
+        return gemini_client.get_gemini_model(), gemini_client.build_review_prompt(code, review_type)
+
+    print(f"Request setup over {args.requests} calls ({len(code)} chars of code)")
+    for label, setup in (("legacy", legacy), ("current", current)):
+        start = time.perf_counter()
+        for i in range(args.requests):
+            setup("explain" if i % 2 else "general")
+        per_call = (time.perf_counter() - start) / args.requests * 1e6
+        print(f"  {label:8} {per_call:9.1f} us/request")
+
+
+def bench_coalescing(args):
+    """--requests identical reviews arriving together, with the cache cold."""
+    use_fake_model(args.latency)
+    review_cache.CACHE_ENABLED = False
+
+    async def run():
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            gemini_client.get_code_review_async(SAMPLE_CODE, "general") for _ in range(args.requests)
+        ))
+        return time.perf_counter() - start
+
+    elapsed = asyncio.run(run())
+    stats = gemini_client.get_coalescing_stats()
+    print(f"{args.requests} identical concurrent reviews in {elapsed:.2f}s")
+    print(f"  upstream calls: {stats['upstream_calls']}, collapsed: {stats['collapsed']}")
+
+
+def _similar_code(i: int, rng) -> str:
+    # A 60-line file; files with the same i are near-duplicates.
+    lines = [f"def step_{i}_{n}(values, limit):\n    total = {i * 100 + n}\n"
+             f"    for v in values:\n        if v > limit:\n            total += v * {n}\n    return total\n"
+             for n in range(10)]
+    lines[rng.randrange(10)] = "def changed(values, limit):\n    return sorted(values)[:limit]\n"
+    return "\n".join(lines)
+
+def bench_similarity(args):
+    """
+    Near-duplicate lookups against an index of --entries reviews: the
+    index lookup alone and with signing the submitted code. Most entries
+    get random signatures, so filling the index doesn't sign every file.
+    """
+    database.DATABASE_URL = os.path.join(tempfile.mkdtemp(), "code_reviewer.db")
+    history.init_history()
+    similarity.init_similarity()
+    rng = random.Random(0)
+    conn = database.get_db_connection()
+    size = similarity.SIGNATURE_SIZE
+    start = time.perf_counter()
+    with conn:
+        for review_id in range(1, args.entries + 1):
+            sig = tuple(rng.getrandbits(32) for _ in range(size))
+            similarity.index_review(conn, review_id, sig, "bench", "general", "fake")
+    print(f"Indexed {args.entries} reviews in {time.perf_counter() - start:.1f}s")
+    # Real reviews to find, stored after the filler so their ids are newest.
+    history.save_reviews([
+        {"username": "bench", "code": _similar_code(i, rng), "review_type": "general",
+         "result": "ok", "model": "fake"}
+        for i in range(100)
+    ])
+
+    queries = [_similar_code(i % 100, rng) for i in range(args.requests)]
+    signatures = [similarity.signature(code) for code in queries]
+    misses = [tuple(rng.getrandbits(32) for _ in range(size)) for _ in range(args.requests)]
+    for label, sigs in (("hit", signatures), ("miss", misses)):
+        latencies, found = [], 0
+        for sig in sigs:
+            start = time.perf_counter()
+            found += similarity.nearest(sig, "bench", "general", "fake") is not None
+            latencies.append(time.perf_counter() - start)
+        print(f"  lookup ({label}):   p50 {_percentile(latencies, 50) * 1e6:7.1f} us  "
+              f"p99 {_percentile(latencies, 99) * 1e6:7.1f} us  found {found}/{len(sigs)}")
+    latencies = []
+    for code in queries:
+        start = time.perf_counter()
+        similarity.find_similar(code, "bench", "general", model="fake")
+        latencies.append(time.perf_counter() - start)
+    print(f"  sign + lookup:   p50 {_percentile(latencies, 50) * 1e6:7.1f} us  "
+          f"p99 {_percentile(latencies, 99) * 1e6:7.1f} us  ({len(queries[0])} chars of code)")
+
+
+SCENARIOS = {
+    "review_concurrency": bench_review_concurrency,
+    "review_cache": bench_review_cache,
+    "review_stream": bench_review_stream,
+    "auth": bench_auth,
+    "db": bench_db,
+    "login_burst": bench_login_burst,
+    "setup": bench_setup,
+    "coalescing": bench_coalescing,
+    "similarity": bench_similarity,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backend micro-benchmarks")
+    parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=50, help="Number of requests to issue")
+    parser.add_argument("--latency", type=float, default=0.5, help="Injected model latency in seconds")
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent clients (threads)")
+    parser.add_argument("--entries", type=int, default=200000, help="Reviews in the similarity index")
+    args = parser.parse_args()
+    SCENARIOS[args.scenario](args)
\ No newline at end of file
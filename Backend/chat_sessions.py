@@ -0,0 +1,340 @@
+import asyncio
+import os
+import sqlite3
+import time
+import uuid
+from typing import NamedTuple, Optional
+
+import chunking
+import compaction
+import database
+import gemini_client
+import history
+import llm_backends
+import metrics
+import resilience
+
+# --- Configuration ---
+#
+#  Chat sessions keep a conversation on the server, so a client sends
+#  each question on its own instead of the whole transcript. The code
+#  being discussed (and optionally its review) is attached once, when
+#  the session is created or its context replaced.
+#
+#  Every prompt holds that context, a rolling summary of older turns and
+#  the newest turns that fit in CHAT_HISTORY_TOKENS. Once the unsummarized
+#  turns outgrow that budget, the oldest are folded into the summary in
+#  the background until half the budget is left. Until that's done they
+#  are simply left out, so the prompt stays bounded either way.
+#
+CHAT_HISTORY_TOKENS = int(os.getenv("CHAT_HISTORY_TOKENS", "1500"))
+CHAT_CODE_TOKENS = int(os.getenv("CHAT_CODE_TOKENS", "6000"))
+CHAT_REVIEW_TOKENS = int(os.getenv("CHAT_REVIEW_TOKENS", "1500"))
+CHAT_SESSION_TTL_SECONDS = float(os.getenv("CHAT_SESSION_TTL_SECONDS", str(7 * 24 * 3600)))
+# Hard cap on the stored summary, whatever the model returns.
+CHAT_SUMMARY_MAX_CHARS = 2000
+# Longest stretch of one message that goes into a summary prompt.
+_SUMMARY_MESSAGE_CHARS = 2000
+# Unsummarized messages read per turn. Far more than fit the budget; it
+# only matters if summarizing keeps failing.
+_MAX_UNSUMMARIZED = 200
+
+# The code is shown with its line numbers; explanations need the comments.
+_CODE_STEPS = frozenset({"license", "blank_runs", "long_lines"})
+
+_last_purge = 0.0
+_summarizing = set()
+_summary_tasks = set()
+
+CHAT_SUMMARIES = metrics.Counter("chat_summaries_total", "Chat history compactions by outcome.", ("outcome",))
+
+
+class Turn(NamedTuple):
+    session_id: str
+    message: str
+    conversation: str    # Everything the model sees for this turn.
+    history_tokens: int  # Estimated tokens of the turns not yet summarized.
+
+
+# --- Storage ---
+
+def init_chat_sessions():
+    """Creates the chat session and message tables if they don't exist."""
+    try:
+        conn = database.get_db_connection()
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS chat_sessions (
+            id TEXT PRIMARY KEY,
+            username TEXT NOT NULL,
+            code_hash TEXT,
+            language TEXT,
+            path TEXT,
+            code_context TEXT NOT NULL DEFAULT '',
+            review_context TEXT NOT NULL DEFAULT '',
+            summary TEXT NOT NULL DEFAULT '',
+            summarized_through INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS chat_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+        """)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_chat_messages_session ON chat_messages (session_id, id)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_chat_sessions_updated ON chat_sessions (updated_at)"
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Chat session table initialization error: {e}")
+
+def _truncate(text: str, max_tokens: int, note: str) -> str:
+    """text cut at a line break to about max_tokens, with note appended if cut."""
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    cut = text.rfind("\n", 0, max_chars)
+    return text[:cut if cut > 0 else max_chars] + "\n" + note
+
+def code_context(code: str, language: Optional[str]) -> str:
+    """The code as the model sees it in every turn: numbered, compacted and capped."""
+    lines = code.replace("\r\n", "\n").split("\n")
+    kept = compaction.compact_lines(lines, _CODE_STEPS, language) or list(enumerate(lines, start=1))
+    return _truncate(chunking.gutter(kept), CHAT_CODE_TOKENS, "… (the rest of the file is left out)")
+
+def _context_columns(code, language, path, review) -> tuple:
+    """(code_hash, language, path, code_context, review_context) column values."""
+    return (
+        history.hash_code(code) if code else None, language, path,
+        code_context(code, language) if code else "",
+        _truncate(review, CHAT_REVIEW_TOKENS, "… (the rest of the review is left out)") if review else "",
+    )
+
+def create_session(username: str, code=None, language=None, path=None, review=None) -> str:
+    """Starts a session with the given context and returns its id."""
+    session_id = uuid.uuid4().hex
+    now = time.time()
+    conn = database.get_db_connection()
+    with conn:
+        conn.execute(
+            "INSERT INTO chat_sessions (id, username, code_hash, language, path, code_context, "
+            "review_context, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (session_id, username) + _context_columns(code, language, path, review) + (now, now)
+        )
+    return session_id
+
+def set_context(session_id: str, username: str, code=None, language=None, path=None, review=None) -> bool:
+    """Replaces the code and review a session is about; False if there's no such session."""
+    conn = database.get_db_connection()
+    with conn:
+        cursor = conn.execute(
+            "UPDATE chat_sessions SET code_hash = ?, language = ?, path = ?, code_context = ?, "
+            "review_context = ?, updated_at = ? WHERE id = ? AND username = ?",
+            _context_columns(code, language, path, review) + (time.time(), session_id, username)
+        )
+    return cursor.rowcount > 0
+
+def get_session(session_id: str, username: str):
+    """The session as a dict, or None if it doesn't exist or isn't this user's."""
+    row = database.get_db_connection().execute(
+        "SELECT id, code_hash, language, path, code_context, review_context, summary, "
+        "summarized_through, created_at, updated_at FROM chat_sessions WHERE id = ? AND username = ?",
+        (session_id, username)
+    ).fetchone()
+    return dict(row) if row else None
+
+def list_messages(session_id: str, after: int = 0, limit: int = None) -> list:
+    """Messages after message id `after`, oldest first; the newest `limit` if given."""
+    sql = "SELECT id, role, content, created_at FROM chat_messages WHERE session_id = ? AND id > ?"
+    if limit is None:
+        rows = database.get_db_connection().execute(sql + " ORDER BY id", (session_id, after)).fetchall()
+        return [dict(r) for r in rows]
+    rows = database.get_db_connection().execute(
+        sql + " ORDER BY id DESC LIMIT ?", (session_id, after, limit)
+    ).fetchall()
+    return [dict(r) for r in reversed(rows)]
+
+def add_turn(session_id: str, message: str, reply: str):
+    now = time.time()
+    conn = database.get_db_connection()
+    with conn:
+        conn.executemany(
+            "INSERT INTO chat_messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+            [(session_id, "user", message, now), (session_id, "assistant", reply, now)]
+        )
+        conn.execute("UPDATE chat_sessions SET updated_at = ? WHERE id = ?", (now, session_id))
+
+def save_summary(session_id: str, summary: str, through: int):
+    conn = database.get_db_connection()
+    with conn:
+        conn.execute(
+            "UPDATE chat_sessions SET summary = ?, summarized_through = ? "
+            "WHERE id = ? AND summarized_through < ?",
+            (summary[:CHAT_SUMMARY_MAX_CHARS], through, session_id, through)
+        )
+
+def _summary_state(session_id: str):
+    row = database.get_db_connection().execute(
+        "SELECT summary, summarized_through FROM chat_sessions WHERE id = ?", (session_id,)
+    ).fetchone()
+    return dict(row) if row else None
+
+def _purge_idle(older_than: float):
+    conn = database.get_db_connection()
+    with conn:
+        conn.execute(
+            "DELETE FROM chat_messages WHERE session_id IN "
+            "(SELECT id FROM chat_sessions WHERE updated_at < ?)", (older_than,)
+        )
+        conn.execute("DELETE FROM chat_sessions WHERE updated_at < ?", (older_than,))
+
+
+# --- Prompt ---
+
+def _tokens(message: dict) -> int:
+    return llm_backends.estimate_tokens(message["content"])
+
+def _split_history(messages: list, budget: int):
+    """(older, recent): recent is the newest run of messages within budget tokens."""
+    used = 0
+    start = len(messages)
+    while start > 0 and used + _tokens(messages[start - 1]) <= budget:
+        start -= 1
+        used += _tokens(messages[start])
+    return messages[:start], messages[start:]
+
+def _transcript(messages: list, max_chars: int = None) -> str:
+    lines = []
+    for m in messages:
+        content = m["content"] if max_chars is None else m["content"][:max_chars]
+        lines.append(f"{'User' if m['role'] == 'user' else 'Assistant'}: {content}")
+    return "\n\n".join(lines)
+
+def build_conversation(session: dict, recent: list, message: str) -> str:
+    """The context, summary, recent turns and question, as one block for the chat prompt."""
+    sections = []
+    if session["code_context"]:
+        where = f" ({session['path']})" if session["path"] else ""
+        sections.append(
+            f"The code{where}, with its line numbers:\n```\n{session['code_context']}\n```"
+        )
+    if session["review_context"]:
+        sections.append(f"The latest review of this code:\n{session['review_context']}")
+    if session["summary"]:
+        sections.append(f"Summary of the earlier conversation:\n{session['summary']}")
+    if recent:
+        sections.append(f"Most recent messages:\n{_transcript(recent)}")
+    sections.append(f"User's question: {message}")
+    return "\n\n".join(sections)
+
+
+# --- API ---
+
+async def _with_past_review(username: str, review_id, code, language, path):
+    """(code, language, path, review) with a past review attached, or None if it isn't this user's."""
+    past = await history.get(review_id, username)
+    if past is None:
+        return None
+    if code is None:
+        code, language, path = past["code"], past["language"], past["path"]
+    return code, language, path, past["result"]
+
+async def create(username: str, code=None, language=None, path=None, review=None, review_id=None):
+    """
+    Starts a session. With review_id, that past review (and its code, if
+    none is given) is attached. Returns the session, or None if review_id
+    isn't one of this user's reviews.
+    """
+    global _last_purge
+    if review_id is not None:
+        context = await _with_past_review(username, review_id, code, language, path)
+        if context is None:
+            return None
+        code, language, path, review = context
+    if time.time() - _last_purge > 60:
+        _last_purge = time.time()
+        await database.run_db(_purge_idle, time.time() - CHAT_SESSION_TTL_SECONDS)
+    session_id = await database.run_db(create_session, username, code, language, path, review)
+    return await get(session_id, username)
+
+async def replace_context(session_id: str, username: str, code=None, language=None, path=None,
+                          review=None, review_id=None):
+    """Like create, for an existing session; its conversation is kept. None if not found."""
+    if review_id is not None:
+        context = await _with_past_review(username, review_id, code, language, path)
+        if context is None:
+            return None
+        code, language, path, review = context
+    if not await database.run_db(set_context, session_id, username, code, language, path, review):
+        return None
+    return await get(session_id, username)
+
+async def get(session_id: str, username: str, with_messages: bool = False):
+    session = await database.run_db(get_session, session_id, username)
+    if session is not None and with_messages:
+        session["messages"] = await database.run_db(list_messages, session_id)
+    return session
+
+async def start_turn(session_id: str, username: str, message: str) -> Optional[Turn]:
+    """The prompt material for a new question in a session, or None if there's no such session."""
+    session = await database.run_db(get_session, session_id, username)
+    if session is None:
+        return None
+    messages = await database.run_db(
+        list_messages, session_id, session["summarized_through"], _MAX_UNSUMMARIZED
+    )
+    _, recent = _split_history(messages, CHAT_HISTORY_TOKENS)
+    history_tokens = sum(_tokens(m) for m in messages)
+    return Turn(session_id, message, build_conversation(session, recent, message), history_tokens)
+
+async def finish_turn(turn: Turn, reply: str):
+    """Stores the question and reply; starts compacting older turns once they outgrow the budget."""
+    await database.run_db(add_turn, turn.session_id, turn.message, reply)
+    new_tokens = llm_backends.estimate_tokens(turn.message) + llm_backends.estimate_tokens(reply)
+    if turn.history_tokens + new_tokens > CHAT_HISTORY_TOKENS:
+        _start_summary(turn.session_id)
+
+def _start_summary(session_id: str):
+    if session_id in _summarizing:
+        return
+    _summarizing.add(session_id)
+    # Its own task so the reply isn't held up; the copied context keeps
+    # charging the model call to the same user.
+    task = asyncio.create_task(_summarize(session_id))
+    _summary_tasks.add(task)
+    task.add_done_callback(_summary_tasks.discard)
+
+async def _summarize(session_id: str):
+    """Folds the oldest unsummarized turns into the session's summary."""
+    try:
+        session = await database.run_db(_summary_state, session_id)
+        if session is None:
+            return
+        messages = await database.run_db(
+            list_messages, session_id, session["summarized_through"], _MAX_UNSUMMARIZED
+        )
+        older, _ = _split_history(messages, CHAT_HISTORY_TOKENS // 2)
+        if not older:
+            return
+        material = ""
+        if session["summary"]:
+            material += f"Summary so far:\n{session['summary']}\n\n"
+        material += f"New messages:\n{_transcript(older, _SUMMARY_MESSAGE_CHARS)}"
+        try:
+            summary = await gemini_client.summarize_chat_async(material)
+        except resilience.UpstreamError as e:
+            print(f"Error summarizing chat session {session_id}: {e}")
+            CHAT_SUMMARIES.labels("error").inc()
+            return
+        await database.run_db(save_summary, session_id, summary.strip(), older[-1]["id"])
+        CHAT_SUMMARIES.labels("ok").inc()
+    finally:
+        _summarizing.discard(session_id)
\ No newline at end of file
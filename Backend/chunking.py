@@ -0,0 +1,155 @@
+import ast
+import os
+from typing import List, NamedTuple, Optional
+
+# --- Configuration ---
+# Files longer than this are reviewed in parts when the client doesn't say.
+LARGE_INPUT_LINES = int(os.getenv("LARGE_INPUT_LINES", "400"))
+# Target size of one part. A single function longer than this is split
+# into line windows.
+MAX_CHUNK_LINES = int(os.getenv("MAX_CHUNK_LINES", "200"))
+
+# When cutting line windows, look back this fraction of a window for a
+# blank or unindented line to cut at instead of mid-block.
+_SOFT_BOUNDARY_FRACTION = 0.25
+_MAX_LABEL_NAMES = 4
+
+
+class Chunk(NamedTuple):
+    start_line: int  # 1-based, inclusive
+    end_line: int    # 1-based, inclusive
+    code: str
+    label: str
+
+
+# --- Detection ---
+
+def is_large_input(code: str, large_input: Optional[bool] = None) -> bool:
+    """Whether code should be reviewed in parts. An explicit flag wins."""
+    if large_input is not None:
+        return large_input
+    return code.count("\n") + 1 > LARGE_INPUT_LINES
+
+def language_from_path(path: str) -> Optional[str]:
+    """Best-effort language name (as used by the frontend editor) from a file path."""
+    extension = os.path.splitext(path)[1].lower()
+    return {
+        ".py": "python", ".js": "javascript", ".ts": "typescript", ".java": "java",
+        ".c": "c_cpp", ".h": "c_cpp", ".cpp": "c_cpp", ".hpp": "c_cpp", ".cs": "csharp",
+        ".go": "go", ".rb": "ruby", ".swift": "swift", ".php": "php", ".sql": "sql",
+    }.get(extension)
+
+
+# --- Splitting ---
+
+def split_code(code: str, language: Optional[str] = None, max_lines: int = MAX_CHUNK_LINES) -> List[Chunk]:
+    """
+    Splits code into parts of roughly max_lines. Python is split along
+    top-level function/class boundaries; anything else (or Python that
+    doesn't parse) is split into line windows.
+    """
+    lines = code.replace("\r\n", "\n").split("\n")
+    if language in (None, "python"):
+        try:
+            tree = ast.parse(code)
+        except (SyntaxError, ValueError):
+            tree = None
+        if tree is not None and tree.body:
+            return _split_python(tree.body, lines, 1, len(lines), max_lines)
+    return _split_lines(lines, 1, len(lines), max_lines, "lines")
+
+def _node_start(node) -> int:
+    decorators = getattr(node, "decorator_list", None) or []
+    return min([node.lineno] + [d.lineno for d in decorators])
+
+def _node_label(node) -> str:
+    if isinstance(node, ast.ClassDef):
+        return f"class {node.name}"
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        return f"def {node.name}"
+    return "statements"
+
+def _make_chunk(lines, start: int, end: int, labels) -> Chunk:
+    # Drop duplicate labels but keep their order ("statements" repeats).
+    names = list(dict.fromkeys(labels))
+    if len(names) > _MAX_LABEL_NAMES:
+        names = names[:_MAX_LABEL_NAMES] + [f"{len(names) - _MAX_LABEL_NAMES} more"]
+    label = ", ".join(names)
+    return Chunk(start, end, "\n".join(lines[start - 1:end]), label)
+
+def _split_python(body, lines, first_line: int, last_line: int, max_lines: int) -> List[Chunk]:
+    """
+    Groups consecutive statements of body into chunks covering
+    first_line..last_line. Comments and blank lines between statements go
+    with the statement that follows them.
+    """
+    # (start, end, node) spans that tile first_line..last_line exactly.
+    spans = []
+    for i, node in enumerate(body):
+        start = first_line if i == 0 else _node_start(node)
+        if spans:
+            spans[-1] = (spans[-1][0], start - 1, spans[-1][2])
+        spans.append((start, last_line, node))
+
+    chunks = []
+    group_start, group_end, group_labels = None, None, []
+
+    def flush():
+        if group_start is not None:
+            chunks.append(_make_chunk(lines, group_start, group_end, group_labels))
+
+    for start, end, node in spans:
+        size = end - start + 1
+        if size > max_lines:
+            flush()
+            group_start, group_labels = None, []
+            chunks.extend(_split_oversized(node, lines, start, end, max_lines))
+            continue
+        if group_start is not None and end - group_start + 1 > max_lines:
+            flush()
+            group_start, group_labels = None, []
+        if group_start is None:
+            group_start = start
+        group_end = end
+        group_labels.append(_node_label(node))
+    flush()
+    return chunks
+
+def _split_oversized(node, lines, start: int, end: int, max_lines: int) -> List[Chunk]:
+    """Splits one statement that is longer than max_lines on its own."""
+    label = _node_label(node)
+    if isinstance(node, ast.ClassDef) and node.body:
+        # Methods become the units; the class header rides with the first.
+        parts = _split_python(node.body, lines, start, end, max_lines)
+        return [p._replace(label=f"{label}: {p.label}") for p in parts]
+    return _split_lines(lines, start, end, max_lines, label)
+
+def _split_lines(lines, first_line: int, last_line: int, max_lines: int, label: str) -> List[Chunk]:
+    """Fixed-size windows, nudged back to a blank or unindented line when one is close."""
+    chunks = []
+    start = first_line
+    lookback = max(1, int(max_lines * _SOFT_BOUNDARY_FRACTION))
+    while start <= last_line:
+        end = min(start + max_lines - 1, last_line)
+        if end < last_line:
+            for candidate in range(end, max(start, end - lookback), -1):
+                following = lines[candidate] if candidate < len(lines) else ""
+                if not following.strip() or not following[:1].isspace():
+                    end = candidate
+                    break
+        chunks.append(_make_chunk(lines, start, end, [label]))
+        start = end + 1
+    return chunks
+
+
+# --- Prompt Helpers ---
+
+def number_lines(chunk: Chunk) -> str:
+    """The chunk's code with its original line numbers in a left gutter."""
+    return gutter(enumerate(chunk.code.split("\n"), start=chunk.start_line))
+
+def gutter(numbered_lines) -> str:
+    """(line number, text) pairs as text with the numbers in a left gutter."""
+    numbered_lines = list(numbered_lines)
+    width = len(str(numbered_lines[-1][0])) if numbered_lines else 1
+    return "\n".join(f"{n:>{width}} | {line}" for n, line in numbered_lines)
\ No newline at end of file
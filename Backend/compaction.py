@@ -0,0 +1,203 @@
+import os
+import re
+from typing import List, NamedTuple, Optional, Tuple
+
+import chunking
+import llm_backends
+import metrics
+
+# --- Configuration ---
+#
+#  Code is compacted before it goes into a review prompt. License headers,
+#  comments, runs of blank lines and very long lines (minified code,
+#  embedded data) cost tokens but change few reviews. What gets dropped
+#  depends on the review type (COMPACTION_STEPS).
+#
+#  If whole lines are dropped, the rest is sent with the original line
+#  numbers in a gutter, as for the parts of a large file, so line
+#  references in the review stay correct. If that would save fewer than
+#  COMPACT_MIN_SAVED_TOKENS, the code is sent as it is.
+#
+COMPACTION_ENABLED = os.getenv("PROMPT_COMPACTION", "1") != "0"
+COMPACT_MAX_LINE_CHARS = int(os.getenv("COMPACT_MAX_LINE_CHARS", "400"))
+COMPACT_MIN_SAVED_TOKENS = int(os.getenv("COMPACT_MIN_SAVED_TOKENS", "50"))
+# How much of an over-long line is kept.
+COMPACT_KEEP_CHARS = 160
+
+STEPS = ("license", "comments", "blank_runs", "long_lines")
+
+# Refactors get the code untouched: the model sends back the whole file,
+# and anything dropped here would be missing from it. Documentation and
+# explanations keep comments, which is what they're about.
+_DEFAULT_STEPS = {
+    "general": "license,comments,blank_runs,long_lines",
+    "competitive": "license,comments,blank_runs,long_lines",
+    "documentation": "license,blank_runs,long_lines",
+    "explain": "license,blank_runs,long_lines",
+    "refactor": "",
+}
+
+# Overridable per type, e.g. COMPACT_STEPS_GENERAL=license,blank_runs.
+COMPACTION_STEPS = {
+    review_type: frozenset(
+        step.strip() for step in os.getenv(f"COMPACT_STEPS_{review_type.upper()}", default).split(",")
+        if step.strip() in STEPS
+    )
+    for review_type, default in _DEFAULT_STEPS.items()
+}
+
+_LICENSE = re.compile(r"copyright|licen[cs]e|spdx-license-identifier|all rights reserved", re.IGNORECASE)
+
+# Full-line comment syntax by editor language. Without a language, the
+# review cache's rule applies: "# ..." and "// ..." (but not "#include").
+_LINE_COMMENTS = {
+    "python": re.compile(r"^\s*#"),
+    "ruby": re.compile(r"^\s*#"),
+    "sql": re.compile(r"^\s*--"),
+    "php": re.compile(r"^\s*(#|//)"),
+    None: re.compile(r"^\s*(#(\s|!|$)|//)"),
+}
+_C_STYLE = re.compile(r"^\s*//")
+_BLOCK_COMMENT_LANGUAGES = {"javascript", "typescript", "java", "c_cpp", "csharp", "go", "swift", "php", "sql"}
+
+_totals = {"prompts": 0, "original_tokens": 0, "compacted_tokens": 0}
+
+COMPACTION_TOKENS = metrics.Counter(
+    "prompt_compaction_tokens_total",
+    "Estimated tokens of review code before and after compaction.",
+    ("review_type", "prompt"),
+)
+
+
+class Compacted(NamedTuple):
+    text: str              # The code as it goes into the prompt.
+    numbered: bool         # Whether text carries a line-number gutter.
+    original_tokens: int   # Estimated tokens of the code as submitted.
+    tokens: int            # Estimated tokens of text.
+
+
+# --- Compaction ---
+
+def _comment_lines(lines, language: Optional[str]) -> set:
+    """0-based indexes of lines that hold nothing but a comment."""
+    line_comment = _LINE_COMMENTS.get(language, _C_STYLE)
+    blocks = language in _BLOCK_COMMENT_LANGUAGES
+    comments = set()
+    in_block = False
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if in_block:
+            end = stripped.find("*/")
+            if end == -1:
+                comments.add(i)
+            else:
+                in_block = False
+                if not stripped[end + 2:].strip():
+                    comments.add(i)
+        elif blocks and stripped.startswith("/*"):
+            end = stripped.find("*/", 2)
+            if end == -1:
+                in_block = True
+                comments.add(i)
+            elif not stripped[end + 2:].strip():
+                comments.add(i)
+        elif line_comment.match(line):
+            comments.add(i)
+    return comments
+
+def _license_header(lines, comments: set) -> set:
+    """The leading comment block, if it's a license or copyright notice."""
+    header = []
+    for i, line in enumerate(lines):
+        if i not in comments and line.strip():
+            break
+        header.append(i)
+    if any(_LICENSE.search(lines[i]) for i in header if i in comments):
+        return set(header)
+    return set()
+
+def _shorten(line: str) -> str:
+    return f"{line[:COMPACT_KEEP_CHARS]} … [{len(line) - COMPACT_KEEP_CHARS} more characters]"
+
+def compact_lines(lines, steps, language: Optional[str] = None,
+                  first_line: int = 1) -> List[Tuple[int, str]]:
+    """
+    The lines to keep as (line number, text) pairs. first_line is the
+    number of lines[0]; a license header is only looked for at line 1.
+    """
+    comments = _comment_lines(lines, language) if steps & {"license", "comments"} else set()
+    dropped = set()
+    if "license" in steps and first_line == 1:
+        dropped |= _license_header(lines, comments)
+    if "comments" in steps:
+        dropped |= comments
+
+    kept = []
+    previous_blank = True  # No blank lines at the very start either.
+    for i, line in enumerate(lines):
+        if i in dropped:
+            continue
+        line = line.rstrip()
+        if not line and previous_blank and "blank_runs" in steps:
+            continue
+        previous_blank = not line
+        if "long_lines" in steps and len(line) > COMPACT_MAX_LINE_CHARS:
+            line = _shorten(line)
+        kept.append((first_line + i, line))
+    if "blank_runs" in steps and kept and not kept[-1][1]:
+        kept.pop()
+    return kept
+
+def _steps(review_type: str) -> frozenset:
+    return COMPACTION_STEPS.get(review_type, frozenset()) if COMPACTION_ENABLED else frozenset()
+
+def _report(review_type: str, original_tokens: int, tokens: int):
+    COMPACTION_TOKENS.labels(review_type, "original").inc(original_tokens)
+    COMPACTION_TOKENS.labels(review_type, "compacted").inc(tokens)
+    _totals["prompts"] += 1
+    _totals["original_tokens"] += original_tokens
+    _totals["compacted_tokens"] += tokens
+
+def compact(code: str, review_type: str, language: Optional[str] = None) -> Compacted:
+    """Compacts a whole file for the review prompt."""
+    original_tokens = llm_backends.estimate_tokens(code)
+    unchanged = Compacted(code, False, original_tokens, original_tokens)
+    steps = _steps(review_type)
+    if not steps:
+        return unchanged
+    with metrics.time_stage("prompt_compaction"):
+        lines = code.replace("\r\n", "\n").split("\n")
+        kept = compact_lines(lines, steps, language)
+        if not kept:
+            return unchanged  # Nothing but comments; the model should see them.
+        numbered = len(kept) < len(lines)
+        text = chunking.gutter(kept) if numbered else "\n".join(line for _, line in kept)
+    tokens = llm_backends.estimate_tokens(text)
+    if original_tokens - tokens < COMPACT_MIN_SAVED_TOKENS:
+        result = unchanged
+    else:
+        result = Compacted(text, numbered, original_tokens, tokens)
+    _report(review_type, original_tokens, result.tokens)
+    return result
+
+def compact_chunk(chunk: chunking.Chunk, review_type: str, language: Optional[str] = None) -> str:
+    """One part of a large file, compacted, with its line-number gutter."""
+    steps = _steps(review_type)
+    if not steps:
+        return chunking.number_lines(chunk)
+    with metrics.time_stage("prompt_compaction"):
+        kept = compact_lines(chunk.code.split("\n"), steps, language, chunk.start_line)
+    if not kept:
+        # Nothing but comments: send the part as it is, not an empty one.
+        return chunking.number_lines(chunk)
+    original = chunking.number_lines(chunk)
+    text = chunking.gutter(kept)
+    _report(review_type, llm_backends.estimate_tokens(original), llm_backends.estimate_tokens(text))
+    return text
+
+def get_stats() -> dict:
+    """Estimated prompt tokens before and after compaction since startup."""
+    stats = dict(_totals)
+    original = stats["original_tokens"]
+    stats["saved_fraction"] = round(1 - stats["compacted_tokens"] / original, 4) if original else 0.0
+    return stats
\ No newline at end of file
@@ -1,17 +1,71 @@
 import sqlite3
 import os
+import asyncio
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from passlib.context import CryptContext
 
 # Configuration
 DATABASE_URL = "code_reviewer.db"
 
+# --- Connection Pool ---
+#
+#  Each thread keeps one long-lived connection per database file instead
+#  of connecting on every call. That keeps sqlite3's prepared-statement
+#  cache warm and lets us apply WAL mode once per connection. Async code
+#  reaches the database through run_db, which uses a fixed set of DB
+#  threads, so the pool size is DB_THREADS connections. That holds for
+#  every SQLite file: the review cache and shared state use this pool too,
+#  and their async callers go through run_db (review_cache.get_async).
+#
+DB_THREADS = int(os.getenv("DB_THREADS", "8"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_STATEMENT_CACHE_SIZE = 256
+
+_local = threading.local()
+_db_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="db")
+
 # --- Password Hashing Setup ---
 #
 #  We are now ONLY using "argon2".
 #  We have completely removed "bcrypt" from the schemes list
 #  to match our clean environment.
 #
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+#  Cost parameters default to passlib's own, so existing hashes keep
+#  verifying; raising them only affects newly hashed passwords.
+#
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536"))  # KiB
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "4"))
+
+pwd_context = CryptContext(
+    schemes=["argon2"],
+    deprecated="auto",
+    argon2__rounds=ARGON2_TIME_COST,
+    argon2__memory_cost=ARGON2_MEMORY_COST,
+    argon2__parallelism=ARGON2_PARALLELISM,
+)
+
+# --- Hashing Pool ---
+#
+#  Each hash/verify costs tens of milliseconds of CPU, so async handlers
+#  never run them on the event loop. They go to a dedicated pool
+#  ("thread" works because argon2-cffi releases the GIL; "process" also
+#  isolates the memory cost). At most HASH_QUEUE_LIMIT operations may be
+#  running or waiting; past that, callers get PasswordHashingBusy right
+#  away instead of queueing behind a login storm.
+#
+HASH_EXECUTOR = os.getenv("HASH_EXECUTOR", "thread")
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", str(HASH_WORKERS * 8)))
+
+_hash_executor = None
+_hash_slots = threading.BoundedSemaphore(HASH_QUEUE_LIMIT)
+
+
+class PasswordHashingBusy(Exception):
+    """Raised when the password hashing queue is full."""
 
 
 # --- Hashing Utility ---
@@ -28,6 +82,33 @@ def get_password_hash(password: str):
     """
     return pwd_context.hash(password)
 
+def _get_hash_executor():
+    # Created on first use so importing this module never forks.
+    global _hash_executor
+    if _hash_executor is None:
+        if HASH_EXECUTOR == "process":
+            _hash_executor = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+        else:
+            _hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="hash")
+    return _hash_executor
+
+async def _run_hashing(func, *args):
+    if not _hash_slots.acquire(blocking=False):
+        raise PasswordHashingBusy()
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_hash_executor(), func, *args)
+    finally:
+        _hash_slots.release()
+
+async def verify_password_async(plain_password: str, hashed_password: str):
+    """verify_password on the hashing pool. May raise PasswordHashingBusy."""
+    return await _run_hashing(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str):
+    """get_password_hash on the hashing pool. May raise PasswordHashingBusy."""
+    return await _run_hashing(get_password_hash, password)
+
 # --- Database Initialization ---
 
 def init_db():
@@ -60,21 +141,56 @@ def init_db():
             if conn:
                 conn.close()
 
-# --- User Management Functions ---
+# --- Connections ---
 
-def get_db_connection():
-    """Establishes a connection to the SQLite database."""
-    conn = sqlite3.connect(DATABASE_URL)
+def _open_connection(path: str):
+    conn = sqlite3.connect(path, cached_statements=DB_STATEMENT_CACHE_SIZE)
     conn.row_factory = sqlite3.Row
+    # WAL lets readers run alongside a writer; NORMAL skips the fsync per
+    # commit that WAL doesn't need for consistency.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    return conn
+
+def get_db_connection(path: str = None):
+    """
+    Returns this thread's pooled connection to the database at path
+    (code_reviewer.db by default). Callers must not close it.
+    """
+    if path is None:
+        path = DATABASE_URL
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(path)
+    if conn is None:
+        conn = connections[path] = _open_connection(path)
     return conn
 
+def close_connections():
+    """
+    Closes this thread's pooled connections. gunicorn.conf.py calls it in
+    the master process before forking workers: an SQLite connection must
+    not be carried into a child process.
+    """
+    connections = getattr(_local, "connections", None) or {}
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
+
+async def run_db(func, *args, **kwargs):
+    """Runs a blocking database function on a DB thread and awaits it."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(func, *args, **kwargs))
+
+# --- User Management Functions ---
+
 def get_user(username: str):
     """Fetches a user by username from the database."""
-    conn = None
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
+        cursor = conn.execute("SELECT * FROM users WHERE username = ?", (username,))
         user = cursor.fetchone()
         if user:
             return dict(user)
@@ -82,30 +198,37 @@ def get_user(username: str):
     except sqlite3.Error as e:
         print(f"Database error in get_user: {e}")
         return None
-    finally:
-        if conn:
-            conn.close()
 
 def create_user(username: str, password: str):
     """Creates a new user in the database."""
-    conn = None
+    return insert_user(username, get_password_hash(password))
+
+def insert_user(username: str, hashed_password: str):
+    """Stores a user whose password is already hashed."""
     try:
-        hashed_password = get_password_hash(password)
         conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO users (username, hashed_password) VALUES (?, ?)",
-            (username, hashed_password)
-        )
-        conn.commit()
+        with conn:
+            conn.execute(
+                "INSERT INTO users (username, hashed_password) VALUES (?, ?)",
+                (username, hashed_password)
+            )
         return get_user(username)
         
     except sqlite3.IntegrityError:
         # This catches the 'UNIQUE NOT NULL' constraint violation
         return "Username already exists"
     except sqlite3.Error as e:
-        print(f"Database error in create_user: {e}")
+        print(f"Database error in insert_user: {e}")
         return None
-    finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+
+# --- Async Wrappers ---
+# For the FastAPI handlers: same functions, run on a DB thread.
+
+async def get_user_async(username: str):
+    return await run_db(get_user, username)
+
+async def create_user_async(username: str, password: str):
+    # Hash on the hashing pool, then insert on a DB thread, so neither
+    # pool is held up by the other's work.
+    hashed_password = await get_password_hash_async(password)
+    return await run_db(insert_user, username, hashed_password)
\ No newline at end of file
@@ -1,7 +1,37 @@
 import os
-import google.generativeai as genai
+import time
+import asyncio
+from contextlib import aclosing
+import llm_backends
 from models import ReviewType
 import re
+import review_cache
+import chunking
+import metrics
+import resilience
+import quotas
+import history
+import analysis
+import compaction
+
+MODEL_NAME = 'gemini-2.5-flash-preview-09-2025'
+
+# Bump whenever a review prompt changes so cached reviews produced by the
+# old wording are no longer served.
+PROMPT_VERSION = "3"
+
+# --- Concurrency ---
+# Upper bound on simultaneous upstream model calls per worker process.
+# Requests beyond this wait on the semaphore instead of piling onto the API.
+MAX_CONCURRENT_MODEL_CALLS = int(os.getenv("MAX_CONCURRENT_MODEL_CALLS", "32"))
+_model_call_semaphore = asyncio.Semaphore(MAX_CONCURRENT_MODEL_CALLS)
+
+# How many files of one /review/batch request are reviewed at once. Each
+# still takes a slot from the shared semaphore above.
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+# How many parts of one large file are reviewed at once.
+CHUNK_CONCURRENCY = int(os.getenv("CHUNK_CONCURRENCY", "8"))
 
 # --- Prompts ---
 
@@ -75,51 +105,128 @@ Code:
 {code}
 """
 
+# Prepended to the review prompt for each part of a large file. The code
+# itself is sent with a line-number gutter (see chunking.number_lines).
+CHUNK_PROMPT_NOTE = """
+Note: the code below is only part of a larger file: lines {start}-{end} of {total} ({label}).
+Review just this part. Every line is prefixed with its line number in the full file;
+use those numbers whenever you refer to a line.
+"""
+
+# Prepended to the review prompt for an incremental re-review, which sends
+# only the edited regions of a file (see incremental.py).
+EDITS_PROMPT_NOTE = """
+Note: the user already has a review of an earlier version of this file and has since edited it.
+Below are only the edited regions, as a diff: lines marked "+" are new or changed, lines marked "-"
+were removed, and unmarked lines are unchanged context. Every line is prefixed with its line number
+in the new file; use those numbers whenever you refer to a line. Review only the edits: problems
+they introduce and earlier problems they fix. Do not review the unchanged context lines.
+"""
+
+# Prepended to the review prompt when compaction (see compaction.py)
+# dropped whole lines, so the code is sent with a line-number gutter.
+COMPACTED_PROMPT_NOTE = """
+Note: to keep it short, lines such as the license header, comments or extra blank lines were left
+out of the code below. Every line is prefixed with its line number in the full file; use those
+numbers whenever you refer to a line.
+"""
+
+# Prepended to the review prompt when the static pre-analysis (see
+# analysis.py) found something. Line numbers are those of the full file.
+ANALYSIS_PROMPT_NOTE = """
+Note: a static analysis pass over this code already found the following. Take these as facts,
+explain their impact where relevant, and don't spend effort re-deriving them:
+"""
+
 CHAT_PROMPT = """
 You are a helpful AI assistant specializing in programming.
 Answer the user's question clearly.
 User's question: {message}
 """
 
+# For a chat session (see chat_sessions.py): the conversation holds the
+# code under discussion, a summary of older turns, the recent turns and
+# the new question.
+CHAT_SESSION_PROMPT = """
+You are a helpful AI assistant specializing in programming, talking with a user about their code.
+Answer the user's question clearly, using the code and the conversation so far.
+When you refer to the code, use the line numbers shown.
+
+{conversation}
+"""
+
+CHAT_SUMMARY_PROMPT = """
+You keep a running summary of a conversation between a user and a programming assistant about
+the user's code. Update the summary with the new messages below. Keep the facts, decisions, code
+changes and open questions that later questions may refer to, with line numbers where given.
+Reply with the updated summary only, in at most 150 words.
+
+{conversation}
+"""
+
+
+REVIEW_PROMPTS = {
+    "general": GENERAL_REVIEW_PROMPT,
+    "documentation": DOC_REVIEW_PROMPT,
+    "competitive": CP_REVIEW_PROMPT,
+    "refactor": REFACTOR_REVIEW_PROMPT,
+    "explain": EXPLAIN_REVIEW_PROMPT,
+}
+
 
 # --- Gemini Client ---
 
 def configure_gemini():
-    """Configures the Gemini API."""
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY environment variable not set.")
-    genai.configure(api_key=api_key)
+    """
+    Configures the LLM backend selected by LLM_BACKEND (the Gemini API
+    unless told otherwise; see llm_backends).
+    """
+    llm_backends.get_backend().configure()
 
 def get_gemini_model():
-    """Initializes and returns the Gemini model."""
-    return genai.GenerativeModel('gemini-2.5-flash-preview-09-2025')
+    """Returns a model handle on the active backend (cheap: the SDK connects on first use)."""
+    return llm_backends.get_backend().create_model(MODEL_NAME)
 
 def clean_refactored_code(text: str) -> str:
     """Helper to strip markdown code blocks."""
-    pattern = r"^```[a-zA-Z]*\n"
-    text = re.sub(pattern, "", text)
-    text = text.replace("```", "")
-    return text.strip()
+    with metrics.time_stage("clean_refactored_code"):
+        pattern = r"^```[a-zA-Z]*\n"
+        text = re.sub(pattern, "", text)
+        text = text.replace("```", "")
+        return text.strip()
+
+def build_review_prompt(code: str, review_type: ReviewType) -> str:
+    """Fills in the prompt template for the given review type."""
+    template = REVIEW_PROMPTS.get(review_type)
+    if template is None:
+        raise ValueError("Invalid review type")
+    with metrics.time_stage("prompt_build"):
+        return template.format(code=code)
+
+def current_model_id() -> str:
+    """The review model as the active backend names it (e.g. "fake/..." offline)."""
+    return llm_backends.get_backend().model_id(MODEL_NAME)
+
+def review_cache_key(code: str, review_type: ReviewType, language=None) -> str:
+    """Cache key covering everything that determines the review text."""
+    return review_cache.make_key(code, review_type, PROMPT_VERSION, current_model_id(), language)
+
+async def review_cache_key_async(code: str, review_type: ReviewType, language=None) -> str:
+    """review_cache_key, off the event loop unless the code is short (tokenizing Python takes a while)."""
+    if len(code) < analysis.ANALYSIS_INLINE_CHARS:
+        return review_cache_key(code, review_type, language)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, review_cache_key, code, review_type, language)
 
 def get_code_review(code: str, review_type: ReviewType) -> str:
     """Gets a code review from the Gemini API."""
-    model = get_gemini_model()
-    
-    prompt = ""
-    if review_type == "general":
-        prompt = GENERAL_REVIEW_PROMPT.format(code=code)
-    elif review_type == "documentation":
-        prompt = DOC_REVIEW_PROMPT.format(code=code)
-    elif review_type == "competitive":
-        prompt = CP_REVIEW_PROMPT.format(code=code)
-    elif review_type == "refactor":
-        prompt = REFACTOR_REVIEW_PROMPT.format(code=code)
-    elif review_type == "explain":  # MODIFICATION: Handle new type
-        prompt = EXPLAIN_REVIEW_PROMPT.format(code=code)
-    else:
-        raise ValueError("Invalid review type")
+    prompt = build_review_prompt(code, review_type)
+    cache_key = review_cache_key(code, review_type)
+    cached = review_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
+    model = get_gemini_model()
     try:
         response = model.generate_content(prompt)
         content = response.text
@@ -127,6 +234,7 @@ def get_code_review(code: str, review_type: ReviewType) -> str:
         if review_type == "refactor":
             content = clean_refactored_code(content)
             
+        review_cache.put(cache_key, review_type, content)
         return content
     except Exception as e:
         print(f"Error calling Gemini API: {e}")
@@ -142,4 +250,452 @@ def get_chat_response(message: str) -> str:
         return response.text
     except Exception as e:
         print(f"Error calling Gemini API: {e}")
-        return "An error occurred while generating the response. Please try again."
\ No newline at end of file
+        return "An error occurred while generating the response. Please try again."
+
+# --- Async API ---
+#
+#  These are what the FastAPI handlers use. They await the SDK's native
+#  async call, so a slow generation never blocks the event loop, and they
+#  share one semaphore so a worker never has more than
+#  MAX_CONCURRENT_MODEL_CALLS requests in flight upstream. Every call goes
+#  through resilience (deadline, retries, circuit breaker); failures are
+#  raised as resilience.UpstreamError, which the API maps to 502/503/504.
+#
+
+def _record_usage(usage_metadata):
+    """Token counts of one response: into the metrics, the user's daily budget and the request's tally."""
+    metrics.record_usage(usage_metadata)
+    quotas.charge_usage(usage_metadata)
+    history.count_tokens(usage_metadata)
+
+async def generate_text_async(model, prompt: str) -> str:
+    """Runs one upstream generation under the concurrency limit, with retries."""
+    return await resilience.call_with_retries(lambda: _generate_once(model, prompt))
+
+async def _generate_once(model, prompt: str) -> str:
+    # Only the call itself is under the deadline, not the wait for a slot.
+    with metrics.time_stage("upstream_queue"):
+        await _model_call_semaphore.acquire()
+    metrics.UPSTREAM_IN_FLIGHT.inc()
+    try:
+        with metrics.time_stage("upstream"):
+            response = await resilience.with_deadline(model.generate_content_async(prompt))
+        text = response.text  # Raises ValueError for a blocked response.
+    except Exception:
+        metrics.UPSTREAM_REQUESTS.labels("generate", "error").inc()
+        raise
+    finally:
+        metrics.UPSTREAM_IN_FLIGHT.dec()
+        _model_call_semaphore.release()
+    metrics.UPSTREAM_REQUESTS.labels("generate", "ok").inc()
+    _record_usage(response.usage_metadata)
+    return text
+
+def _with_findings(material: str, findings) -> str:
+    """material with the static analysis findings noted above it, if any."""
+    if not findings:
+        return material
+    return ANALYSIS_PROMPT_NOTE + "\n".join(f"- {f}" for f in findings) + "\n\n" + material
+
+def _code_prompt(code: str, review_type: ReviewType, language, findings) -> str:
+    """The review prompt for a whole file: compacted code, with the findings."""
+    compacted = compaction.compact(code, review_type, language)
+    material = COMPACTED_PROMPT_NOTE + compacted.text if compacted.numbered else compacted.text
+    return build_review_prompt(_with_findings(material, findings), review_type)
+
+async def review_code_async(code: str, review_type: ReviewType, model=None,
+                            language=None, large_input=None) -> str:
+    """
+    Reviews one piece of code, going through the review cache. Large
+    inputs are reviewed in parts (see review_large_code_async). Empty or
+    unparseable code is answered by the static analysis alone.
+    """
+    report = await analysis.analyze_async(code, review_type, language)
+    if report.answer is not None:
+        return report.answer
+    if chunking.is_large_input(code, large_input):
+        return await review_large_code_async(code, review_type, model, language, report.findings)
+    # Findings and compaction follow from the code and language, so those still key the cache.
+    prompt = _code_prompt(code, review_type, language, report.findings)
+    cache_key = await review_cache_key_async(code, review_type, language)
+    return await _review_prompt_async(prompt, cache_key, review_type, model)
+
+async def _review_prompt_async(prompt: str, cache_key: str, review_type: ReviewType, model=None) -> str:
+    with metrics.time_stage("review_cache_get"):
+        cached = await review_cache.get_async(cache_key)
+    if cached is not None:
+        return cached
+
+    if model is None:
+        model = get_gemini_model()
+
+    async def generate():
+        content = await generate_text_async(model, prompt)
+        if review_type == "refactor":
+            content = clean_refactored_code(content)
+        await review_cache.put_async(cache_key, review_type, content)
+        return content
+
+    return await _single_flight(cache_key, generate)
+
+# --- Request Coalescing ---
+#
+#  Identical reviews that arrive while one is already being generated
+#  (same cache key) wait for that upstream call instead of making their
+#  own. The call runs as its own task, so one caller disconnecting
+#  doesn't cancel it for the others.
+#
+_in_flight = {}
+_coalesce_stats = {"upstream_calls": 0, "collapsed": 0}
+
+async def _single_flight(key: str, generate):
+    task = _in_flight.get(key)
+    if task is not None:
+        _coalesce_stats["collapsed"] += 1
+        return await asyncio.shield(task)
+
+    task = asyncio.ensure_future(generate())
+    _in_flight[key] = task
+    _coalesce_stats["upstream_calls"] += 1
+    task.add_done_callback(lambda t: _finish_flight(key, t))
+    return await asyncio.shield(task)
+
+def _finish_flight(key: str, task):
+    if _in_flight.get(key) is task:
+        del _in_flight[key]
+    # Mark the exception as retrieved in case every caller went away.
+    if not task.cancelled():
+        task.exception()
+
+def get_coalescing_stats() -> dict:
+    """Upstream review calls made vs. requests that shared one."""
+    stats = dict(_coalesce_stats)
+    stats["in_flight"] = len(_in_flight)
+    return stats
+
+async def get_code_review_async(code: str, review_type: ReviewType,
+                                language=None, large_input=None) -> str:
+    """Async version of get_code_review. Raises resilience.UpstreamError on failure."""
+    try:
+        return await review_code_async(code, review_type, language=language, large_input=large_input)
+    except resilience.UpstreamError as e:
+        print(f"Error calling Gemini API: {e}")
+        raise
+
+async def get_code_reviews_batch(files, concurrency: int = BATCH_CONCURRENCY):
+    """
+    Reviews many (code, review_type, language) tuples concurrently with
+    one model handle, at most `concurrency` at a time.
+
+    Returns one (content, error, latency_ms) tuple per input, in order.
+    A failed file has content None and an error message; it doesn't
+    affect the others.
+    """
+    model = get_gemini_model()
+    limit = asyncio.Semaphore(concurrency)
+
+    async def review_one(code, review_type, language):
+        async with limit:
+            start = time.perf_counter()
+            try:
+                content = await review_code_async(code, review_type, model, language)
+                return content, None, (time.perf_counter() - start) * 1000
+            except resilience.UpstreamError as e:
+                print(f"Error calling Gemini API: {e}")
+                return None, e.detail, (time.perf_counter() - start) * 1000
+
+    return await asyncio.gather(*(review_one(*f) for f in files))
+
+# --- Large Inputs ---
+#
+#  Big files are split by chunking.split_code (along function/class
+#  boundaries for Python) and the parts are reviewed in parallel, each
+#  with its original line numbers. The part reviews are then stitched
+#  back together in file order. A part that fails is marked as such
+#  instead of failing the whole review.
+#
+
+def _chunk_prompt(chunk, review_type: ReviewType, total_lines: int, findings=(), language=None):
+    """(prompt, cache_key) for one part of a large file, with the findings that fall in it."""
+    if review_type == "refactor":
+        # Refactored code must come back without a line-number gutter.
+        return build_review_prompt(chunk.code, review_type), review_cache_key(chunk.code, review_type, language)
+    numbered = CHUNK_PROMPT_NOTE.format(
+        start=chunk.start_line, end=chunk.end_line, total=total_lines, label=chunk.label
+    ) + compaction.compact_chunk(chunk, review_type, language)
+    # Findings can depend on the rest of the file, so they're part of the key.
+    numbered = _with_findings(numbered, [f for f in findings if chunk.start_line <= f.line <= chunk.end_line])
+    return build_review_prompt(numbered, review_type), review_cache_key(numbered, review_type, language)
+
+def _start_chunk_reviews(code: str, review_type: ReviewType, model, language, findings=()):
+    """Splits code and starts one review task per part. Returns (chunks, tasks)."""
+    chunks = chunking.split_code(code, language)
+    total_lines = chunks[-1].end_line if chunks else 0
+    limit = asyncio.Semaphore(CHUNK_CONCURRENCY)
+
+    async def review_chunk(chunk):
+        args = (chunk, review_type, total_lines, findings, language)
+        if len(chunk.code) < analysis.ANALYSIS_INLINE_CHARS:
+            prompt, cache_key = _chunk_prompt(*args)
+        else:
+            prompt, cache_key = await asyncio.get_running_loop().run_in_executor(None, _chunk_prompt, *args)
+        async with limit:
+            return await _review_prompt_async(prompt, cache_key, review_type, model)
+
+    return chunks, [asyncio.ensure_future(review_chunk(c)) for c in chunks]
+
+def _large_review_header(chunks) -> str:
+    return f"_This file was reviewed in {len(chunks)} parts. Line numbers refer to the full file._"
+
+def _format_chunk_review(chunk, content, review_type: ReviewType) -> str:
+    """One part of the merged review; content is None if that part failed."""
+    if review_type == "refactor":
+        # Keep the original code for a part that couldn't be refactored.
+        return chunk.code if content is None else content
+    if content is None:
+        content = "_The review of this part failed. Please try again._"
+    return f"### Lines {chunk.start_line}-{chunk.end_line} ({chunk.label})\n\n{content}"
+
+def _merge_chunk_reviews(chunks, contents, review_type: ReviewType) -> str:
+    sections = [_format_chunk_review(c, r, review_type) for c, r in zip(chunks, contents)]
+    if review_type == "refactor":
+        return "\n\n".join(sections)
+    return "\n\n".join([_large_review_header(chunks)] + sections)
+
+async def review_large_code_async(code: str, review_type: ReviewType, model=None, language=None,
+                                  findings=()) -> str:
+    """
+    Reviews a large file in parts and merges the results. Raises only if
+    every part failed.
+    """
+    if model is None:
+        model = get_gemini_model()
+    chunks, tasks = _start_chunk_reviews(code, review_type, model, language, findings)
+    outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+
+    errors = [o for o in outcomes if isinstance(o, Exception)]
+    if errors and len(errors) == len(outcomes):
+        raise errors[0]
+    for error in errors:
+        print(f"Error calling Gemini API: {error}")
+    contents = [None if isinstance(o, Exception) else o for o in outcomes]
+    return _merge_chunk_reviews(chunks, contents, review_type)
+
+async def review_edits_async(changes: str, review_type: ReviewType) -> str:
+    """Reviews just the edited regions of a file (a diff from incremental.py)."""
+    prompt, cache_key = _edits_prompt(changes, review_type)
+    return await _review_prompt_async(prompt, cache_key, review_type)
+
+def _edits_prompt(changes: str, review_type: ReviewType):
+    material = EDITS_PROMPT_NOTE + changes
+    return build_review_prompt(material, review_type), review_cache_key(material, review_type)
+
+def _chat_prompt(message: str, conversation=None) -> str:
+    if conversation is None:
+        return CHAT_PROMPT.format(message=message)
+    return CHAT_SESSION_PROMPT.format(conversation=conversation)
+
+async def get_chat_response_async(message: str, conversation=None) -> str:
+    """
+    Async version of get_chat_response. In a chat session, conversation
+    is the session's context and history, ending with the message (see
+    chat_sessions.build_conversation). Raises resilience.UpstreamError on failure.
+    """
+    model = get_gemini_model()
+    prompt = _chat_prompt(message, conversation)
+
+    try:
+        return await generate_text_async(model, prompt)
+    except resilience.UpstreamError as e:
+        print(f"Error calling Gemini API: {e}")
+        raise
+
+async def summarize_chat_async(material: str) -> str:
+    """A chat session's updated summary, from the old one and the turns to fold in."""
+    return await generate_text_async(get_gemini_model(), CHAT_SUMMARY_PROMPT.format(conversation=material))
+
+# --- Streaming API ---
+#
+#  Both generators yield (event, text) pairs: any number of "chunk" events
+#  as tokens arrive, then exactly one "done" event carrying the assembled
+#  result, or one "error" event. The "done" text is what a non-streaming
+#  call would have returned, so refactor output is cleaned there rather
+#  than chunk by chunk (the ``` markers can be split across chunks).
+#
+#  A failure before the first event is raised as resilience.UpstreamError
+#  instead, so the API can still answer with a proper status code.
+#
+
+async def stream_text_async(model, prompt: str):
+    """
+    Yields text chunks from one upstream generation as they arrive.
+    Failures before the first chunk are retried like generate_text_async;
+    after that they are raised, since part of the text is already out.
+    """
+    attempt = 0
+    while True:
+        resilience.breaker.before_call()
+        started = False
+        try:
+            # aclosing: a client that goes away frees the call slot right away.
+            async with aclosing(_stream_once(model, prompt)) as stream:
+                async for text in stream:
+                    started = True
+                    yield text
+        except Exception as e:
+            attempt += 1
+            await resilience.after_failure(e, attempt, can_retry=not started)
+            continue
+        resilience.record_outcome()
+        return
+
+async def _stream_once(model, prompt: str):
+    # Each chunk must arrive within the upstream deadline.
+    with metrics.time_stage("upstream_queue"):
+        await _model_call_semaphore.acquire()
+    metrics.UPSTREAM_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    first_token = True
+    outcome = "error"
+    usage = None
+    try:
+        response = await resilience.with_deadline(model.generate_content_async(prompt, stream=True))
+        chunks = response.__aiter__()
+        while True:
+            try:
+                chunk = await resilience.with_deadline(chunks.__anext__())
+            except StopAsyncIteration:
+                break
+            if first_token:
+                metrics.STAGE_DURATION.labels("upstream_first_token").observe(time.perf_counter() - start)
+                first_token = False
+            # Usage is cumulative; the last chunk that carries it has the totals.
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. only safety metadata).
+                continue
+            if text:
+                yield text
+        outcome = "ok"
+    finally:
+        metrics.UPSTREAM_IN_FLIGHT.dec()
+        _model_call_semaphore.release()
+        metrics.STAGE_DURATION.labels("upstream").observe(time.perf_counter() - start)
+        metrics.UPSTREAM_REQUESTS.labels("stream", outcome).inc()
+        _record_usage(usage)
+
+async def stream_code_review(code: str, review_type: ReviewType, language=None, large_input=None):
+    """Streaming version of get_code_review_async."""
+    report = await analysis.analyze_async(code, review_type, language)
+    if report.answer is not None:
+        yield "chunk", report.answer
+        yield "done", report.answer
+        return
+    if chunking.is_large_input(code, large_input):
+        async for event in stream_large_code_review(code, review_type, language, report.findings):
+            yield event
+        return
+
+    prompt = _code_prompt(code, review_type, language, report.findings)
+    cache_key = await review_cache_key_async(code, review_type, language)
+    async for event in _stream_prompt_review(prompt, cache_key, review_type):
+        yield event
+
+async def stream_edits_review(changes: str, review_type: ReviewType):
+    """Streaming version of review_edits_async."""
+    prompt, cache_key = _edits_prompt(changes, review_type)
+    async for event in _stream_prompt_review(prompt, cache_key, review_type):
+        yield event
+
+async def _stream_prompt_review(prompt: str, cache_key: str, review_type: ReviewType):
+    cached = await review_cache.get_async(cache_key)
+    if cached is None and cache_key in _in_flight:
+        # An identical non-streamed review is already running; share it.
+        try:
+            cached = await _single_flight(cache_key, None)
+        except resilience.UpstreamError as e:
+            print(f"Error calling Gemini API: {e}")
+            raise
+    if cached is not None:
+        yield "chunk", cached
+        yield "done", cached
+        return
+
+    model = get_gemini_model()
+    parts = []
+    try:
+        async for text in stream_text_async(model, prompt):
+            parts.append(text)
+            yield "chunk", text
+    except resilience.UpstreamError as e:
+        print(f"Error calling Gemini API: {e}")
+        if not parts:
+            raise
+        yield "error", e.detail
+        return
+
+    content = "".join(parts)
+    if review_type == "refactor":
+        content = clean_refactored_code(content)
+    await review_cache.put_async(cache_key, review_type, content)
+    yield "done", content
+
+async def stream_large_code_review(code: str, review_type: ReviewType, language=None, findings=()):
+    """
+    Streams a large-file review one part at a time, in file order. All
+    parts are reviewed in parallel; each is sent as soon as it and every
+    part before it are done.
+    """
+    # The header goes out before any part is reviewed, so fail fast here
+    # while a status code can still be sent.
+    resilience.breaker.before_call()
+    model = get_gemini_model()
+    chunks, tasks = _start_chunk_reviews(code, review_type, model, language, findings)
+    separator = "\n\n"
+    parts = []
+    if review_type != "refactor":
+        parts.append(_large_review_header(chunks))
+        yield "chunk", parts[0]
+
+    failed = 0
+    error = None
+    try:
+        for chunk, task in zip(chunks, tasks):
+            try:
+                content = await task
+            except resilience.UpstreamError as e:
+                print(f"Error calling Gemini API: {e}")
+                content = None
+                failed += 1
+                error = e
+            section = _format_chunk_review(chunk, content, review_type)
+            yield "chunk", (separator if parts else "") + section
+            parts.append(section)
+    finally:
+        # The client went away mid-stream: stop reviewing the remaining parts.
+        for task in tasks:
+            task.cancel()
+
+    if failed and failed == len(chunks):
+        yield "error", error.detail
+        return
+    yield "done", separator.join(parts)
+
+async def stream_chat_response(message: str, conversation=None):
+    """Streaming version of get_chat_response_async."""
+    model = get_gemini_model()
+    prompt = _chat_prompt(message, conversation)
+    parts = []
+    try:
+        async for text in stream_text_async(model, prompt):
+            parts.append(text)
+            yield "chunk", text
+    except resilience.UpstreamError as e:
+        print(f"Error calling Gemini API: {e}")
+        if not parts:
+            raise
+        yield "error", e.detail
+        return
+    yield "done", "".join(parts)
\ No newline at end of file
@@ -0,0 +1,34 @@
+"""
+Runs the API in several worker processes, one per core by default:
+
+    gunicorn main:app
+
+(gunicorn reads this file from the working directory.) The app is
+imported once in the master and the workers are forked from it
+(preload_app), so startup work like creating tables happens once.
+
+With more than one worker, SHARED_STATE is turned on so rate limits,
+daily budgets and /metrics cover all workers (see shared_state).
+"""
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn_worker.UvicornWorker"
+preload_app = True
+# Streams send nothing until the model answers; don't kill a worker for it.
+timeout = int(os.getenv("WORKER_TIMEOUT_SECONDS", "120"))
+graceful_timeout = 30
+keepalive = 5
+
+if workers > 1:
+    # Before the app is imported, so every module sees it.
+    os.environ.setdefault("SHARED_STATE", "1")
+
+
+def pre_fork(server, worker):
+    # The master opened SQLite connections while importing the app; a
+    # connection must not be used from a forked child.
+    import database
+    database.close_connections()
\ No newline at end of file
@@ -0,0 +1,252 @@
+import contextvars
+import hashlib
+import os
+import re
+import sqlite3
+import time
+
+import database
+import similarity
+
+# --- Configuration ---
+#
+#  Every finished review is kept in the reviews table with what it cost
+#  (model, latency, tokens), so a user can list, search and reopen past
+#  reviews with an indexed query instead of asking the model again.
+#  reviews_fts is an FTS5 index over the review text, kept in step with
+#  the table by triggers.
+#
+HISTORY_ENABLED = os.getenv("REVIEW_HISTORY_ENABLED", "1") != "0"
+HISTORY_PAGE_SIZE = 20
+HISTORY_MAX_PAGE_SIZE = 100
+PREVIEW_CHARS = 200
+
+# False if this SQLite build lacks FTS5; search then falls back to LIKE.
+_fts_available = True
+
+# Model tokens used by the current request: [prompt, output]. Started by
+# track_tokens(); the list is shared with any task the request starts.
+_tally = contextvars.ContextVar("review_history_tally", default=None)
+
+_SUMMARY_COLUMNS = (
+    "id, created_at, review_type, language, path, model, code_hash, "
+    "latency_ms, prompt_tokens, output_tokens"
+)
+
+
+# --- Storage ---
+
+def init_history():
+    """Creates the reviews table, its indexes and the full-text index if they don't exist."""
+    global _fts_available
+    try:
+        conn = database.get_db_connection()
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS reviews (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            code_hash TEXT NOT NULL,
+            review_type TEXT NOT NULL,
+            language TEXT,
+            path TEXT,
+            model TEXT,
+            latency_ms REAL,
+            prompt_tokens INTEGER,
+            output_tokens INTEGER,
+            code TEXT NOT NULL,
+            result TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+        """)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_reviews_user_time ON reviews (username, created_at)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_reviews_user_hash ON reviews (username, code_hash, review_type)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_reviews_user_path ON reviews (username, path, review_type, created_at)"
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Review history initialization error: {e}")
+        return
+    try:
+        conn.executescript("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS reviews_fts USING fts5(
+            result, content='reviews', content_rowid='id', tokenize='porter unicode61'
+        );
+        CREATE TRIGGER IF NOT EXISTS reviews_fts_insert AFTER INSERT ON reviews BEGIN
+            INSERT INTO reviews_fts (rowid, result) VALUES (new.id, new.result);
+        END;
+        CREATE TRIGGER IF NOT EXISTS reviews_fts_delete AFTER DELETE ON reviews BEGIN
+            INSERT INTO reviews_fts (reviews_fts, rowid, result) VALUES ('delete', old.id, old.result);
+        END;
+        """)
+    except sqlite3.Error as e:
+        print(f"Review search index unavailable, falling back to LIKE: {e}")
+        _fts_available = False
+
+def hash_code(code: str) -> str:
+    return hashlib.sha256(code.encode("utf-8")).hexdigest()
+
+def save_reviews(rows) -> list:
+    """
+    Stores finished reviews, given as dicts with username, code,
+    review_type, result and optionally language, path, model, latency_ms,
+    prompt_tokens and output_tokens. Returns their ids (None on error).
+    """
+    now = time.time()
+    ids = []
+    # Signed before the transaction, so the write lock isn't held for it.
+    signatures = [
+        similarity.review_signature(row["code"], row["review_type"], row.get("language")) for row in rows
+    ]
+    try:
+        conn = database.get_db_connection()
+        with conn:
+            for row, sig in zip(rows, signatures):
+                cursor = conn.execute(
+                    "INSERT INTO reviews (username, code_hash, review_type, language, path, model, "
+                    "latency_ms, prompt_tokens, output_tokens, code, result, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (row["username"], hash_code(row["code"]), row["review_type"], row.get("language"),
+                     row.get("path"), row.get("model"), row.get("latency_ms"), row.get("prompt_tokens"),
+                     row.get("output_tokens"), row["code"], row["result"], now)
+                )
+                ids.append(cursor.lastrowid)
+                similarity.index_review(
+                    conn, cursor.lastrowid, sig, row["username"], row["review_type"], row.get("model")
+                )
+        return ids
+    except sqlite3.Error as e:
+        print(f"Review history write error: {e}")
+        return [None] * len(rows)
+
+def _summary(row) -> dict:
+    summary = dict(row)
+    summary["preview"] = summary["preview"] or ""
+    return summary
+
+# Keyset pagination: a page ends at a review id, and the next page is
+# everything ordered after that review. (username, created_at) plus the
+# implicit rowid make this a range scan on idx_reviews_user_time.
+_BEFORE = "(created_at, id) < (SELECT created_at, id FROM reviews WHERE id = ?)"
+
+def list_reviews(username: str, limit: int, before: int = None, code_hash: str = None) -> list:
+    """A user's reviews, newest first; only those after review `before` in that order, if given."""
+    sql = f"SELECT {_SUMMARY_COLUMNS}, substr(result, 1, {PREVIEW_CHARS}) AS preview FROM reviews WHERE username = ?"
+    params = [username]
+    if code_hash:
+        sql += " AND code_hash = ?"
+        params.append(code_hash)
+    if before is not None:
+        sql += " AND " + _BEFORE
+        params.append(before)
+    sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+    params.append(limit)
+    rows = database.get_db_connection().execute(sql, params).fetchall()
+    return [_summary(r) for r in rows]
+
+def _fts_query(text: str) -> str:
+    # Each word as a quoted term (all must match), so user input can't
+    # hit FTS5 query syntax.
+    return " ".join(f'"{word}"' for word in re.findall(r"\w+", text))
+
+def search_reviews(username: str, text: str, limit: int, before: int = None) -> list:
+    """A user's reviews whose text contains every word of `text`, newest first."""
+    if not re.search(r"\w", text):
+        return []
+    columns = ", ".join(f"r.{c.strip()}" for c in _SUMMARY_COLUMNS.split(","))
+    if _fts_available:
+        sql = (
+            f"SELECT {columns}, snippet(reviews_fts, 0, '**', '**', '…', 24) AS preview "
+            "FROM reviews_fts JOIN reviews r ON r.id = reviews_fts.rowid "
+            "WHERE reviews_fts MATCH ? AND r.username = ?"
+        )
+        params = [_fts_query(text), username]
+    else:
+        sql = (
+            f"SELECT {columns}, substr(r.result, 1, {PREVIEW_CHARS}) AS preview "
+            "FROM reviews r WHERE r.username = ?"
+        )
+        params = [username]
+        for word in re.findall(r"\w+", text):
+            sql += " AND r.result LIKE ?"
+            params.append(f"%{word}%")
+    if before is not None:
+        sql += " AND (r.created_at, r.id) < (SELECT created_at, id FROM reviews WHERE id = ?)"
+        params.append(before)
+    sql += " ORDER BY r.created_at DESC, r.id DESC LIMIT ?"
+    params.append(limit)
+    rows = database.get_db_connection().execute(sql, params).fetchall()
+    return [_summary(r) for r in rows]
+
+def latest_review(username: str, path, review_type: str):
+    """The user's newest review of this file (path None: of unnamed code) and type, or None."""
+    row = database.get_db_connection().execute(
+        "SELECT id, code, result FROM reviews WHERE username = ? AND path IS ? AND review_type = ? "
+        "ORDER BY created_at DESC LIMIT 1", (username, path, review_type)
+    ).fetchone()
+    return dict(row) if row else None
+
+def get_review(review_id: int, username: str):
+    """The full review as a dict, or None if it doesn't exist or isn't this user's."""
+    row = database.get_db_connection().execute(
+        f"SELECT {_SUMMARY_COLUMNS}, code, result FROM reviews WHERE id = ? AND username = ?",
+        (review_id, username)
+    ).fetchone()
+    return dict(row) if row else None
+
+
+# --- Token Tally ---
+
+def track_tokens() -> list:
+    """Starts counting model tokens for the current request; returns [prompt, output]."""
+    tally = [0, 0]
+    _tally.set(tally)
+    return tally
+
+def count_tokens(usage_metadata):
+    """Adds a model response's tokens to the current request's tally, if any."""
+    tally = _tally.get()
+    if tally is None or usage_metadata is None:
+        return
+    tally[0] += getattr(usage_metadata, "prompt_token_count", 0) or 0
+    tally[1] += getattr(usage_metadata, "candidates_token_count", 0) or 0
+
+
+# --- API ---
+
+async def record(username: str, code: str, review_type: str, result: str, language=None,
+                 path=None, model=None, latency_ms=None, tally=None):
+    """Stores one finished review; returns its id, or None if history is off or the write failed."""
+    if not HISTORY_ENABLED:
+        return None
+    row = {
+        "username": username, "code": code, "review_type": review_type, "result": result,
+        "language": language, "path": path, "model": model,
+        "latency_ms": None if latency_ms is None else round(latency_ms, 1),
+        "prompt_tokens": tally[0] if tally else None,
+        "output_tokens": tally[1] if tally else None,
+    }
+    ids = await database.run_db(save_reviews, [row])
+    return ids[0]
+
+async def record_many(rows) -> list:
+    """Stores several finished reviews (dicts as for save_reviews) in one transaction."""
+    if not HISTORY_ENABLED or not rows:
+        return [None] * len(rows)
+    return await database.run_db(save_reviews, rows)
+
+async def list_page(username: str, limit: int, before: int = None, code_hash: str = None) -> list:
+    return await database.run_db(list_reviews, username, limit, before, code_hash)
+
+async def search(username: str, text: str, limit: int, before: int = None) -> list:
+    return await database.run_db(search_reviews, username, text, limit, before)
+
+async def latest(username: str, path, review_type: str):
+    return await database.run_db(latest_review, username, path, review_type)
+
+async def get(review_id: int, username: str):
+    return await database.run_db(get_review, review_id, username)
\ No newline at end of file
@@ -0,0 +1,248 @@
+import asyncio
+import difflib
+import os
+import re
+from bisect import bisect_right
+from typing import List, NamedTuple, Optional, Tuple
+
+import analysis
+import gemini_client
+import history
+
+# --- Configuration ---
+#
+#  Incremental re-review: when a user re-submits a file they've had
+#  reviewed before, only the edited regions (with a few lines of context)
+#  go to the model. The answer is merged with the previous review, whose
+#  line numbers are moved to where that code sits now.
+#
+#  "The same file" is the user's newest review with the same path and
+#  review type (or, without a path, their newest review of unnamed code).
+#  If too much changed, a full review is cheaper to read and no worse to
+#  pay for, so the caller falls back to one.
+#
+INCREMENTAL_CONTEXT_LINES = int(os.getenv("INCREMENTAL_CONTEXT_LINES", "3"))
+INCREMENTAL_MAX_CHANGED_FRACTION = float(os.getenv("INCREMENTAL_MAX_CHANGED_FRACTION", "0.5"))
+
+# Review types that make sense for part of a file. The others need the
+# whole file (complexity analysis, walkthroughs, a full refactored copy).
+INCREMENTAL_TYPES = {"general", "documentation"}
+
+# "line 12", "Lines 4-9", "lines 4–9" in a review's text.
+_LINE_REF = re.compile(r"\b([Ll]ines?)(\s+)(\d+)(?:(\s*[-–]\s*)(\d+))?")
+_EDITED = " (since edited)"
+_NOTE_PREFIX = "_Incremental review:"
+# Headings of a merged review (see merge), and of the carried-over
+# previous review when that was itself merged.
+_EDITS_HEADINGS = ("### Review of Your Edits\n\n", "### Review of the Differences\n\n")
+_PREVIOUS_HEADINGS = ("\n\n### Previous Review\n\n", "\n\n### Review of the Matching Code\n\n")
+_EARLIER_EDITS = "#### Earlier Edits\n\n"
+_REST = "\n\n#### Rest of the File\n\n"
+
+
+class EditPlan(NamedTuple):
+    changes: str                    # The diff sent to the model; "" if nothing changed.
+    regions: List[Tuple[int, int]]  # Edited line ranges in the new file (1-based, inclusive).
+    previous: str                   # The previous review, renumbered for the new file.
+    # True if the previous review is of someone's similar code (see
+    # similarity) rather than of an earlier version of this file.
+    similar: bool = False
+
+
+# --- Diffing ---
+
+def _split_lines(code: str) -> List[str]:
+    return code.replace("\r\n", "\n").split("\n")
+
+def plan_edits(old_code: str, new_code: str, previous_review: str,
+               max_changed_fraction: float = None, normalize=None) -> Optional[EditPlan]:
+    """
+    Compares a file with the version that was last reviewed. Returns None
+    if more than max_changed_fraction (INCREMENTAL_MAX_CHANGED_FRACTION by
+    default) of it changed, or if the previous review already builds on an
+    earlier review of edits: another level would have to drop one of them,
+    so a full review starts over instead. Lines are compared as
+    normalize(line), if given.
+    """
+    if _edit_levels(previous_review) > 1:
+        return None
+    if max_changed_fraction is None:
+        max_changed_fraction = INCREMENTAL_MAX_CHANGED_FRACTION
+    old, new = _split_lines(old_code), _split_lines(new_code)
+    if normalize is None:
+        matcher = difflib.SequenceMatcher(None, old, new)
+    else:
+        matcher = difflib.SequenceMatcher(None, [normalize(l) for l in old], [normalize(l) for l in new])
+    changed = sum(
+        max(i2 - i1, j2 - j1) for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != "equal"
+    )
+    if changed > max_changed_fraction * max(len(old), len(new)):
+        return None
+
+    previous = _renumber(previous_review, matcher.get_matching_blocks())
+    if not changed:
+        return EditPlan("", [], previous)
+
+    width = len(str(len(new)))
+    hunks, regions = [], []
+    for group in matcher.get_grouped_opcodes(INCREMENTAL_CONTEXT_LINES):
+        lines = []
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                lines.extend(f"{j + 1:>{width}}   | {new[j]}" for j in range(j1, j2))
+                continue
+            lines.extend(f"{'':>{width}} - | {old[i]}" for i in range(i1, i2))
+            lines.extend(f"{j + 1:>{width}} + | {new[j]}" for j in range(j1, j2))
+        edited = [op for op in group if op[0] != "equal"]
+        start, end = edited[0][3] + 1, edited[-1][4]
+        regions.append((start, max(start, end)))
+        hunks.append("\n".join(lines))
+    return EditPlan("\n...\n".join(hunks), regions, previous)
+
+def _renumber(review: str, matching_blocks) -> str:
+    """
+    Moves "line N" references in a review to where those lines are in the
+    new file. References to lines that were edited or removed keep their
+    number and are marked as such.
+    """
+    starts = [block.a for block in matching_blocks]
+
+    def new_line(n):
+        # 1-based old line number -> 1-based new line number, or None.
+        i = bisect_right(starts, n - 1) - 1
+        if i < 0:
+            return None
+        a, b, size = matching_blocks[i]
+        return b + (n - 1 - a) + 1 if n - 1 < a + size else None
+
+    def replace(match):
+        if match.string.startswith(_EDITED, match.end()):
+            # Marked by an earlier incremental review; the number is stale.
+            return match.group(0)
+        word, space, first, dash, last = match.groups()
+        mapped_first = new_line(int(first))
+        mapped_last = new_line(int(last)) if last else mapped_first
+        if mapped_first is None or mapped_last is None:
+            return match.group(0) + _EDITED
+        if not last:
+            return f"{word}{space}{mapped_first}"
+        return f"{word}{space}{mapped_first}{dash}{mapped_last}"
+
+    return _LINE_REF.sub(replace, review)
+
+
+# --- Merging ---
+
+def _describe(regions) -> str:
+    ranges = ", ".join(str(a) if a == b else f"{a}-{b}" for a, b in regions)
+    single = len(regions) == 1 and regions[0][0] == regions[0][1]
+    return ("line " if single else "lines ") + ranges
+
+def _edits_heading(plan: EditPlan) -> str:
+    if plan.similar:
+        return (
+            f"{_NOTE_PREFIX} this code closely matches code reviewed before, so only the lines "
+            f"that differ ({_describe(plan.regions)}) were reviewed; the earlier review of the "
+            "rest follows, with line numbers and names updated._"
+            "\n\n### Review of the Differences\n\n"
+        )
+    return (
+        f"{_NOTE_PREFIX} only your edits ({_describe(plan.regions)}) were reviewed again; "
+        "the previous review of the rest of the file follows, with line numbers updated._"
+        "\n\n### Review of Your Edits\n\n"
+    )
+
+def _split_merged(review: str) -> Optional[Tuple[str, str]]:
+    # (review of the edits, previous review) of a merged review, else None.
+    for heading in _EDITS_HEADINGS:
+        if review.startswith(heading):
+            for marker in _PREVIOUS_HEADINGS:
+                if marker in review:
+                    return tuple(review[len(heading):].split(marker, 1))
+    return None
+
+def _strip_note(review: str) -> str:
+    if review.startswith(_NOTE_PREFIX):
+        # Drop the note of an earlier incremental review; it's about an older version.
+        return review.split("\n\n", 1)[-1]
+    return review
+
+def _edit_levels(review: str) -> int:
+    """How many reviews of edits a stored review carries on top of its full review."""
+    review, levels = _strip_note(review), 0
+    while True:
+        split = _split_merged(review)
+        if split is not None:
+            review = split[1]
+        elif review.startswith(_EARLIER_EDITS) and _REST in review:
+            review = review.split(_REST, 1)[1]
+        else:
+            return levels
+        levels += 1
+
+def _carried_forward(previous: str) -> str:
+    """
+    The part of the previous review to carry over: all of it, with the
+    review of its edits (if it was merged) under "Earlier Edits". plan_edits
+    never builds on a review with more than one level of edits, so nothing
+    is dropped and the nesting stays bounded.
+    """
+    previous = _strip_note(previous)
+    split = _split_merged(previous)
+    if split is None:
+        return previous
+    edits, base = split
+    return f"{_EARLIER_EDITS}{edits}{_REST}{base}"
+
+def _previous_section(plan: EditPlan) -> str:
+    heading = "Review of the Matching Code" if plan.similar else "Previous Review"
+    return f"\n\n### {heading}\n\n{_carried_forward(plan.previous)}"
+
+def merge(plan: EditPlan, edits_review: str) -> str:
+    """The review of the edits followed by the carried-over previous review."""
+    return _edits_heading(plan) + edits_review + _previous_section(plan)
+
+
+# --- API ---
+
+async def prepare(username: str, code: str, review_type: str, path=None, language=None) -> Optional[EditPlan]:
+    """
+    The plan for reviewing code incrementally against this user's previous
+    review of the same file, or None if a full review is needed.
+    """
+    if review_type not in INCREMENTAL_TYPES:
+        return None
+    if (await analysis.analyze_async(code, review_type, language)).answer is not None:
+        return None  # Broken or empty code: the full path answers it without the model.
+    previous = await history.latest(username, path, review_type)
+    if previous is None:
+        return None
+    if (await analysis.analyze_async(previous["code"], review_type, language)).answer is not None:
+        return None  # The previous "review" was that answer; there's nothing to build on.
+    # Diffing a long file takes milliseconds of CPU; keep it off the event loop.
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, plan_edits, previous["code"], code, previous["result"])
+
+async def review(plan: EditPlan, review_type: str) -> str:
+    """Reviews the planned edits and merges the result. Raises resilience.UpstreamError on failure."""
+    if not plan.changes:
+        return plan.previous
+    edits_review = await gemini_client.review_edits_async(plan.changes, review_type)
+    return merge(plan, edits_review)
+
+async def stream_review(plan: EditPlan, review_type: str):
+    """Streaming version of review: the same (event, text) pairs as gemini_client's streams."""
+    if not plan.changes:
+        yield "chunk", plan.previous
+        yield "done", plan.previous
+        return
+    started = False
+    async for event, text in gemini_client.stream_edits_review(plan.changes, review_type):
+        if event == "chunk":
+            yield "chunk", text if started else _edits_heading(plan) + text
+            started = True
+        elif event == "done":
+            yield "chunk", _previous_section(plan)
+            yield "done", merge(plan, text)
+        else:
+            yield event, text
\ No newline at end of file
@@ -0,0 +1,239 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import urllib.request
+import uuid
+
+import database
+import gemini_client
+import history
+import metrics
+import quotas
+import resilience
+
+# --- Configuration ---
+#
+#  Review jobs: POST /review/jobs stores the request in the review_jobs
+#  table and returns at once; JOB_WORKERS tasks per process take queued
+#  jobs, run the review and store the result for GET /review/jobs/{id}
+#  (and POST it to the job's callback URL, if any).
+#
+#  A job is claimed by stamping it "running" with a lease. If its worker
+#  dies, the lease runs out after JOB_LEASE_SECONDS and any worker may
+#  take the job again, so no external broker is needed and several
+#  processes can share the queue.
+#
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "900"))
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", str(24 * 3600)))
+JOB_CALLBACK_TIMEOUT_SECONDS = float(os.getenv("JOB_CALLBACK_TIMEOUT_SECONDS", "10"))
+JOB_CALLBACK_ATTEMPTS = 3
+
+# Set when a job is queued in this process, so an idle worker starts on
+# it at once instead of at its next poll.
+_job_queued = None
+_last_purge = 0.0
+_callback_tasks = set()
+
+JOB_DURATION = metrics.Histogram(
+    "review_job_duration_seconds", "Review job time by phase (queued, running).", ("phase",)
+)
+JOB_RESULTS = metrics.Counter("review_jobs_total", "Finished review jobs by status.", ("status",))
+
+
+# --- Storage ---
+
+def init_jobs():
+    """Creates the jobs table if it doesn't exist."""
+    try:
+        conn = database.get_db_connection()
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS review_jobs (
+            id TEXT PRIMARY KEY,
+            username TEXT NOT NULL,
+            status TEXT NOT NULL,
+            review_type TEXT NOT NULL,
+            language TEXT,
+            large_input INTEGER,
+            code TEXT NOT NULL,
+            path TEXT,
+            callback_url TEXT,
+            result TEXT,
+            error TEXT,
+            status_code INTEGER,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            lease_expires REAL,
+            finished_at REAL
+        );
+        """)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_review_jobs_status ON review_jobs (status, created_at)"
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Job table initialization error: {e}")
+
+def create_job(username: str, code: str, review_type: str, language=None,
+               large_input=None, callback_url=None, path=None) -> str:
+    """Queues a review and returns its job id."""
+    job_id = uuid.uuid4().hex
+    conn = database.get_db_connection()
+    with conn:
+        conn.execute(
+            "INSERT INTO review_jobs (id, username, status, review_type, language, large_input, "
+            "code, path, callback_url, created_at) VALUES (?, ?, 'queued', ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, username, review_type, language,
+             None if large_input is None else int(large_input), code, path, callback_url, time.time())
+        )
+    return job_id
+
+def get_job(job_id: str, username: str):
+    """The job as a dict, or None if it doesn't exist or isn't this user's."""
+    row = database.get_db_connection().execute(
+        "SELECT id, status, review_type, result, error, created_at, started_at, finished_at "
+        "FROM review_jobs WHERE id = ? AND username = ?", (job_id, username)
+    ).fetchone()
+    return dict(row) if row else None
+
+def _claim_next():
+    """Marks the oldest runnable job as running and returns it, or None."""
+    now = time.time()
+    conn = database.get_db_connection()
+    with conn:
+        row = conn.execute(
+            "UPDATE review_jobs SET status = 'running', started_at = ?, lease_expires = ? "
+            "WHERE id = (SELECT id FROM review_jobs "
+            "            WHERE status = 'queued' OR (status = 'running' AND lease_expires < ?) "
+            "            ORDER BY created_at LIMIT 1) "
+            "RETURNING id, username, review_type, language, large_input, code, path, callback_url, created_at",
+            (now, now + JOB_LEASE_SECONDS, now)
+        ).fetchone()
+    return dict(row) if row else None
+
+def _finish(job_id: str, status: str, result=None, error=None, status_code=None):
+    conn = database.get_db_connection()
+    with conn:
+        conn.execute(
+            "UPDATE review_jobs SET status = ?, result = ?, error = ?, status_code = ?, "
+            "finished_at = ?, code = '' WHERE id = ?",
+            (status, result, error, status_code, time.time(), job_id)
+        )
+
+def _requeue(job_id: str):
+    conn = database.get_db_connection()
+    with conn:
+        conn.execute(
+            "UPDATE review_jobs SET status = 'queued', started_at = NULL, lease_expires = NULL WHERE id = ?",
+            (job_id,)
+        )
+
+def _purge_finished(older_than: float):
+    conn = database.get_db_connection()
+    with conn:
+        conn.execute(
+            "DELETE FROM review_jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (older_than,)
+        )
+
+
+# --- API ---
+
+async def submit(username: str, code: str, review_type: str, language=None,
+                 large_input=None, callback_url=None, path=None) -> str:
+    job_id = await database.run_db(
+        create_job, username, code, review_type, language, large_input, callback_url, path
+    )
+    if _job_queued is not None:
+        _job_queued.set()
+    return job_id
+
+async def get(job_id: str, username: str):
+    return await database.run_db(get_job, job_id, username)
+
+
+# --- Workers ---
+
+def _post_callback(url: str, payload: dict):
+    data = json.dumps(payload).encode("utf-8")
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=JOB_CALLBACK_TIMEOUT_SECONDS) as response:
+        response.read()
+
+async def _send_callback(url: str, payload: dict):
+    """POSTs the finished job to its callback URL, retrying a few times."""
+    loop = asyncio.get_running_loop()
+    for attempt in range(1, JOB_CALLBACK_ATTEMPTS + 1):
+        try:
+            await loop.run_in_executor(None, _post_callback, url, payload)
+            return
+        except Exception as e:
+            print(f"Job callback to {url} failed (attempt {attempt}): {e}")
+            if attempt < JOB_CALLBACK_ATTEMPTS:
+                await asyncio.sleep(2 ** attempt)
+
+async def _run_job(job: dict):
+    JOB_DURATION.labels("queued").observe(max(0.0, time.time() - job["created_at"]))
+    # Model tokens count against the budget of the user who queued the job.
+    quotas.charge_to(job["username"])
+    tally = history.track_tokens()
+    large_input = None if job["large_input"] is None else bool(job["large_input"])
+    status, result, error, status_code = "done", None, None, 200
+    start = time.perf_counter()
+    try:
+        result = await gemini_client.review_code_async(
+            job["code"], job["review_type"], language=job["language"], large_input=large_input
+        )
+    except resilience.UpstreamError as e:
+        print(f"Error calling Gemini API: {e}")
+        status, error, status_code = "failed", e.detail, e.status_code
+    latency = time.perf_counter() - start
+    JOB_DURATION.labels("running").observe(latency)
+    if status == "done":
+        await history.record(
+            job["username"], job["code"], job["review_type"], result, language=job["language"],
+            path=job["path"], model=gemini_client.current_model_id(), latency_ms=latency * 1000, tally=tally
+        )
+    await database.run_db(_finish, job["id"], status, result, error, status_code)
+    JOB_RESULTS.labels(status).inc()
+    if job["callback_url"]:
+        # In its own task so a slow receiver doesn't hold up the worker.
+        task = asyncio.create_task(_send_callback(job["callback_url"], {
+            "job_id": job["id"], "status": status, "review_type": job["review_type"],
+            "review_content": result, "error": error,
+        }))
+        _callback_tasks.add(task)
+        task.add_done_callback(_callback_tasks.discard)
+
+async def _worker():
+    global _last_purge
+    while True:
+        # Cleared before looking, so a job queued meanwhile still wakes us.
+        _job_queued.clear()
+        job = await database.run_db(_claim_next)
+        if job is None:
+            if time.time() - _last_purge > 60:
+                _last_purge = time.time()
+                await database.run_db(_purge_finished, time.time() - JOB_RETENTION_SECONDS)
+            try:
+                await asyncio.wait_for(_job_queued.wait(), JOB_POLL_SECONDS)
+            except TimeoutError:
+                pass
+            continue
+        try:
+            await _run_job(job)
+        except asyncio.CancelledError:
+            # Shutting down: hand the job back rather than wait out its lease.
+            await database.run_db(_requeue, job["id"])
+            raise
+        except Exception as e:
+            print(f"Review job {job['id']} crashed: {e}")
+            await database.run_db(_finish, job["id"], "failed", None, "Internal error", 500)
+
+def start_workers():
+    """Starts JOB_WORKERS worker tasks on the running loop; returns them."""
+    global _job_queued
+    _job_queued = asyncio.Event()
+    return [asyncio.create_task(_worker()) for _ in range(JOB_WORKERS)]
\ No newline at end of file
@@ -0,0 +1,211 @@
+import asyncio
+import hashlib
+import math
+import os
+import random
+import threading
+import time
+
+# --- Backend Selection ---
+#
+#  gemini_client talks to a "model handle" with the google.generativeai
+#  GenerativeModel interface: generate_content(prompt) and
+#  generate_content_async(prompt, stream=False), returning responses with
+#  .text and .usage_metadata. A backend just configures itself and builds
+#  those handles:
+#
+#    LLM_BACKEND=gemini  the real API (default; needs GEMINI_API_KEY)
+#    LLM_BACKEND=fake    a local, deterministic stand-in for load tests
+#
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+
+
+class UpstreamAPIError(Exception):
+    """An error response from the model API, with its HTTP status code."""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = status_code  # Same attribute name as google.api_core errors.
+
+
+# --- Gemini ---
+
+class GeminiBackend:
+    name = "gemini"
+
+    def configure(self):
+        # Imported here so the fake backend runs without the SDK installed.
+        import google.generativeai as genai
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY environment variable not set.")
+        genai.configure(api_key=api_key)
+
+    def create_model(self, model_name: str, generation_config: dict = None):
+        import google.generativeai as genai
+        return genai.GenerativeModel(model_name, generation_config=generation_config)
+
+    def model_id(self, model_name: str) -> str:
+        """Identifies the model in cache keys."""
+        return model_name
+
+
+# --- Fake ---
+
+class FakeUsage:
+    def __init__(self, prompt_tokens: int, output_tokens: int):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+class FakeResponse:
+    def __init__(self, text: str, usage: FakeUsage = None):
+        self.text = text
+        self.usage_metadata = usage
+
+class FakeStream:
+    """Async-iterable like the SDK's streamed response."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+
+    async def __aiter__(self):
+        for delay, response in self._chunks:
+            await asyncio.sleep(delay)
+            yield response
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token)."""
+    return max(1, len(text) // 4)
+
+class FakeModel:
+    """
+    Behaves like a GenerativeModel with configurable timing and failures:
+
+    - time to first token drawn from `latency_dist` ("fixed", "uniform",
+      "exponential" or "lognormal") around `latency_ms` with `jitter_ms`
+    - `output_tokens` tokens generated at `tokens_per_sec` (0 = instant)
+    - each call fails with probability `error_rate`, raising
+      UpstreamAPIError with a status from `error_codes`
+
+    The reply text depends only on the prompt, and the random draws come
+    from one seeded generator, so a run is reproducible for a given
+    request order.
+    """
+
+    STREAM_CHUNK_TOKENS = 8
+
+    def __init__(self, backend, model_name: str):
+        self.backend = backend
+        self.model_name = model_name
+
+    def _plan(self, prompt: str):
+        """(first token delay, per-chunk delay, chunk texts, usage), or raises."""
+        backend = self.backend
+        first_token = backend.draw_latency()
+        if backend.draw_error():
+            raise UpstreamAPIError("Injected fake upstream error", backend.draw_error_code())
+
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        words = f"Fake review {digest[:8]} of {estimate_tokens(prompt)} prompt tokens.".split()
+        words += [f"tok{i}" for i in range(max(0, backend.output_tokens - len(words)))]
+        per_token = 1 / backend.tokens_per_sec if backend.tokens_per_sec > 0 else 0.0
+
+        chunks = []
+        step = self.STREAM_CHUNK_TOKENS
+        for i in range(0, len(words), step):
+            chunks.append(" ".join(words[i:i + step]) + " ")
+        usage = FakeUsage(estimate_tokens(prompt), backend.output_tokens)
+        return first_token, per_token * step, chunks, usage
+
+    def generate_content(self, prompt, stream=False):
+        first_token, chunk_delay, chunks, usage = self._plan(prompt)
+        time.sleep(first_token + chunk_delay * max(0, len(chunks) - 1))
+        return FakeResponse("".join(chunks).strip(), usage)
+
+    async def generate_content_async(self, prompt, stream=False):
+        first_token, chunk_delay, chunks, usage = self._plan(prompt)
+        if stream:
+            delays = [first_token] + [chunk_delay] * (len(chunks) - 1)
+            responses = [FakeResponse(c) for c in chunks[:-1]] + [FakeResponse(chunks[-1], usage)]
+            return FakeStream(list(zip(delays, responses)))
+        await asyncio.sleep(first_token + chunk_delay * max(0, len(chunks) - 1))
+        return FakeResponse("".join(chunks).strip(), usage)
+
+class FakeBackend:
+    """Offline backend for load tests; configured from FAKE_LLM_* env vars by default."""
+
+    name = "fake"
+
+    def __init__(self, latency_ms=None, jitter_ms=None, latency_dist=None, tokens_per_sec=None,
+                 output_tokens=None, error_rate=None, error_codes=None, seed=None):
+        env = os.getenv
+        self.latency_ms = float(env("FAKE_LLM_LATENCY_MS", "800") if latency_ms is None else latency_ms)
+        self.jitter_ms = float(env("FAKE_LLM_JITTER_MS", "0") if jitter_ms is None else jitter_ms)
+        self.latency_dist = env("FAKE_LLM_LATENCY_DIST", "fixed") if latency_dist is None else latency_dist
+        self.tokens_per_sec = float(env("FAKE_LLM_TOKENS_PER_SEC", "0") if tokens_per_sec is None else tokens_per_sec)
+        self.output_tokens = int(env("FAKE_LLM_OUTPUT_TOKENS", "200") if output_tokens is None else output_tokens)
+        self.error_rate = float(env("FAKE_LLM_ERROR_RATE", "0") if error_rate is None else error_rate)
+        codes = env("FAKE_LLM_ERROR_CODES", "429,503") if error_codes is None else error_codes
+        self.error_codes = [int(c) for c in str(codes).split(",") if c.strip()]
+        self._rng = random.Random(int(env("FAKE_LLM_SEED", "0") if seed is None else seed))
+        self._rng_lock = threading.Lock()
+
+    def configure(self):
+        pass
+
+    def create_model(self, model_name: str, generation_config: dict = None):
+        return FakeModel(self, model_name)
+
+    def model_id(self, model_name: str) -> str:
+        # Fake reviews must never be served from the cache to real traffic.
+        return f"fake/{model_name}"
+
+    def draw_latency(self) -> float:
+        """Time to first token, in seconds."""
+        mean, jitter = self.latency_ms, self.jitter_ms
+        with self._rng_lock:
+            if self.latency_dist == "uniform":
+                ms = self._rng.uniform(mean - jitter, mean + jitter)
+            elif self.latency_dist == "exponential":
+                ms = self._rng.expovariate(1 / mean) if mean > 0 else 0.0
+            elif self.latency_dist == "lognormal":
+                # jitter_ms is the standard deviation of the resulting distribution.
+                if mean > 0 and jitter > 0:
+                    sigma2 = math.log(1 + (jitter / mean) ** 2)
+                    ms = self._rng.lognormvariate(math.log(mean) - sigma2 / 2, math.sqrt(sigma2))
+                else:
+                    ms = mean
+            else:
+                ms = mean
+        return max(0.0, ms) / 1000
+
+    def draw_error(self) -> bool:
+        if self.error_rate <= 0:
+            return False
+        with self._rng_lock:
+            return self._rng.random() < self.error_rate
+
+    def draw_error_code(self) -> int:
+        with self._rng_lock:
+            return self._rng.choice(self.error_codes or [503])
+
+
+BACKENDS = {"gemini": GeminiBackend, "fake": FakeBackend}
+
+_backend = None
+
+def get_backend():
+    """The process-wide backend, chosen by LLM_BACKEND on first use."""
+    global _backend
+    if _backend is None:
+        if LLM_BACKEND not in BACKENDS:
+            raise ValueError(f"Unknown LLM_BACKEND '{LLM_BACKEND}'. Choose from: {', '.join(BACKENDS)}")
+        _backend = BACKENDS[LLM_BACKEND]()
+    return _backend
+
+def set_backend(backend):
+    """Replaces the process-wide backend (used by benchmarks)."""
+    global _backend
+    _backend = backend
\ No newline at end of file
@@ -0,0 +1,371 @@
+"""
+End-to-end load tests for the API.
+
+Drives main.app in-process (through httpx's ASGI transport, with the
+fake LLM backend and scratch databases) or a running server (--url),
+sweeping concurrency levels and reporting throughput and latency
+percentiles per scenario.
+
+Usage (from the Backend folder):
+    python loadtest.py review --concurrency 1,8,32 --requests 200
+    python loadtest.py mixed --duration 10 --output results.json
+    python loadtest.py mixed --duration 10 --compare results.json
+    python loadtest.py review --workers 1,2,4 --concurrency 64 --duration 10 --model-latency-ms 0
+
+--workers starts a gunicorn server (gunicorn.conf.py, fake model,
+scratch databases) with each worker count in turn and reports how
+throughput scales, driving it from --client-processes processes.
+
+With --compare, the run exits with status 1 if any scenario/concurrency
+pair lost more than --tolerance of its throughput or gained more than
+--tolerance of p95 latency against the baseline file.
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import httpx
+
+SAMPLE_CODE = '''def fib(n):
+    if n < 2:
+        return n
+    return fib(n - 1) + fib(n - 2)
+'''
+
+LOADTEST_PASSWORD = "load-test-password"
+
+
+# --- Target ---
+
+def load_app_in_process(args):
+    """
+    Imports main with the fake LLM backend and databases in a scratch
+    directory. Must run before anything else imports main.
+    """
+    scratch = tempfile.mkdtemp(prefix="loadtest-")
+    os.environ.setdefault("LLM_BACKEND", "fake")
+    os.environ.setdefault("FAKE_LLM_LATENCY_MS", str(args.model_latency_ms))
+    os.environ.setdefault("REVIEW_CACHE_DB", os.path.join(scratch, "review_cache.db"))
+    # One load-test user would hit the per-user limits at once; --quotas keeps them on.
+    os.environ.setdefault("QUOTAS_ENABLED", "1" if args.quotas else "0")
+
+    import database
+    database.DATABASE_URL = os.path.join(scratch, "code_reviewer.db")
+    import main
+    return main.app
+
+@contextlib.asynccontextmanager
+async def make_client(args):
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout) as client:
+            yield client
+        return
+    app = load_app_in_process(args)
+    transport = httpx.ASGITransport(app=app)
+    # ASGITransport doesn't send lifespan events; run startup/shutdown here.
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=args.timeout) as client:
+            yield client
+
+
+# --- Scenarios ---
+
+class LoadContext:
+    """Shared state for one run: a logged-in user and a request counter."""
+
+    def __init__(self, run_id: str, repeat_code: bool):
+        self.run_id = run_id
+        self.repeat_code = repeat_code
+        self.username = f"loadtest-{run_id}"
+        self.headers = {}
+        self.counter = itertools.count()
+
+    def code(self, i: int) -> str:
+        # Unique code per request defeats the review cache and coalescing
+        # unless --repeat-code asks for them. (A comment would not: the
+        # cache key ignores comments.)
+        return SAMPLE_CODE if self.repeat_code else f"{SAMPLE_CODE}REQUEST_ID = '{self.run_id}-{i}'\n"
+
+async def setup_user(client, ctx: LoadContext):
+    await client.post("/register", json={"username": ctx.username, "password": LOADTEST_PASSWORD})
+    response = await client.post("/token", data={"username": ctx.username, "password": LOADTEST_PASSWORD})
+    response.raise_for_status()
+    ctx.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+async def scenario_review(client, ctx, i):
+    return await client.post(
+        "/review", json={"code": ctx.code(i), "review_type": "general"}, headers=ctx.headers
+    )
+
+async def scenario_chat(client, ctx, i):
+    return await client.post("/chat", json={"message": f"What is a closure? ({i})"}, headers=ctx.headers)
+
+async def scenario_token(client, ctx, i):
+    return await client.post("/token", data={"username": ctx.username, "password": LOADTEST_PASSWORD})
+
+async def scenario_register(client, ctx, i):
+    return await client.post(
+        "/register", json={"username": f"{ctx.username}-{i}", "password": LOADTEST_PASSWORD}
+    )
+
+async def scenario_auth(client, ctx, i):
+    return await client.get("/users/me", headers=ctx.headers)
+
+# Roughly what production sees: mostly reviews and chat, some logins.
+MIXED_WEIGHTS = [
+    (scenario_review, 50), (scenario_chat, 25), (scenario_auth, 15),
+    (scenario_token, 8), (scenario_register, 2),
+]
+
+async def scenario_mixed(client, ctx, i):
+    rng = random.Random(i)
+    scenario = rng.choices([s for s, _ in MIXED_WEIGHTS], weights=[w for _, w in MIXED_WEIGHTS])[0]
+    return await scenario(client, ctx, i)
+
+SCENARIOS = {
+    "review": scenario_review,
+    "chat": scenario_chat,
+    "token": scenario_token,
+    "register": scenario_register,
+    "auth": scenario_auth,
+    "mixed": scenario_mixed,
+}
+
+
+# --- Runner ---
+
+def percentile(sorted_values, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+async def run_level(client, ctx, scenario, concurrency: int, requests: int, duration: float) -> dict:
+    """
+    Closed loop: `concurrency` workers each send a request as soon as
+    their previous one finishes, until `requests` have been sent or
+    `duration` seconds have passed.
+    """
+    return summarize(concurrency, *await _drive(client, ctx, scenario, concurrency, requests, duration))
+
+async def _drive(client, ctx, scenario, concurrency: int, requests: int, duration: float) -> tuple:
+    """run_level's raw numbers: (latencies, status counts, elapsed seconds)."""
+    latencies = []
+    statuses = Counter()
+    sent = itertools.count()
+    start = time.perf_counter()
+    deadline = start + duration if duration else None
+
+    async def worker():
+        while True:
+            n = next(sent)
+            if (deadline is None and n >= requests) or (deadline is not None and time.perf_counter() >= deadline):
+                return
+            i = next(ctx.counter)
+            t0 = time.perf_counter()
+            try:
+                response = await scenario(client, ctx, i)
+                statuses[str(response.status_code)] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - t0)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, statuses, time.perf_counter() - start
+
+def summarize(concurrency: int, latencies: list, statuses: Counter, elapsed: float) -> dict:
+    latencies.sort()
+    errors = sum(count for status, count in statuses.items() if not status.startswith("2"))
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round((latencies[-1] if latencies else 0.0) * 1000, 2),
+        "errors": errors,
+        "status_counts": dict(statuses),
+    }
+
+async def run(args) -> dict:
+    scenario_names = list(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    levels = [int(c) for c in args.concurrency.split(",")]
+    results = {"target": args.url or "in-process", "scenarios": {}}
+
+    async with make_client(args) as client:
+        ctx = LoadContext(str(int(time.time() * 1000)), args.repeat_code)
+        await setup_user(client, ctx)
+        for name in scenario_names:
+            scenario = SCENARIOS[name]
+            if args.warmup:
+                await run_level(client, ctx, scenario, min(levels), args.warmup, 0)
+            results["scenarios"][name] = []
+            for concurrency in levels:
+                level = await run_level(client, ctx, scenario, concurrency, args.requests, args.duration)
+                results["scenarios"][name].append(level)
+                print(f"{name:9} c={concurrency:<4} {level['requests']:6} req  {level['rps']:9.1f} req/s  "
+                      f"p50 {level['p50_ms']:8.1f}  p95 {level['p95_ms']:8.1f}  p99 {level['p99_ms']:8.1f} ms  "
+                      f"errors {level['errors']}")
+    return results
+
+
+# --- Worker Scaling ---
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(workers: int, args):
+    """A gunicorn server with `workers` workers on scratch databases; returns (process, url)."""
+    scratch = tempfile.mkdtemp(prefix=f"loadtest-w{workers}-")
+    port = _free_port()
+    env = dict(
+        os.environ, WEB_CONCURRENCY=str(workers), LLM_BACKEND="fake",
+        FAKE_LLM_LATENCY_MS=str(args.model_latency_ms), QUOTAS_ENABLED="1" if args.quotas else "0",
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "main:app", "-c", os.path.join(BACKEND_DIR, "gunicorn.conf.py"),
+         "--chdir", scratch, "--pythonpath", BACKEND_DIR, "--bind", f"127.0.0.1:{port}",
+         "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if httpx.get(url + "/", timeout=1).status_code == 200:
+                return process, url
+        except httpx.HTTPError:
+            pass
+        if process.poll() is not None:
+            break
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"gunicorn with {workers} workers did not start")
+
+def _client_process(url: str, scenario_name: str, concurrency: int, requests: int, args) -> tuple:
+    """One load generator process with its own user; returns _drive's numbers."""
+    async def go():
+        async with httpx.AsyncClient(base_url=url, timeout=args.timeout) as client:
+            ctx = LoadContext(f"{int(time.time() * 1000)}-{os.getpid()}", args.repeat_code)
+            await setup_user(client, ctx)
+            scenario = SCENARIOS[scenario_name]
+            if args.warmup:
+                await _drive(client, ctx, scenario, concurrency, args.warmup, 0)
+            return await _drive(client, ctx, scenario, concurrency, requests, args.duration)
+    return asyncio.run(go())
+
+def run_scaling(args) -> dict:
+    """Each scenario at each concurrency level against each --workers count."""
+    scenario_names = list(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    levels = [int(c) for c in args.concurrency.split(",")]
+    worker_counts = [int(w) for w in args.workers.split(",")]
+    clients = args.client_processes
+    cpus = os.cpu_count() or 1
+    # Workers and load generators on more processes than cores take turns
+    # on them, which measures time-sharing rather than scaling.
+    oversubscribed = max(worker_counts) + clients > cpus
+    results = {"target": "gunicorn", "cpus": cpus, "client_processes": clients,
+               "oversubscribed": oversubscribed, "workers": {}}
+    print(f"{cpus} CPUs, {clients} client processes")
+    if oversubscribed:
+        print(f"Warning: {max(worker_counts)} workers plus {clients} client processes need more than "
+              f"{cpus} CPUs; these numbers don't show how throughput scales with cores.")
+    first = {}  # (scenario, concurrency) -> req/s with the first worker count
+    for workers in worker_counts:
+        process, url = start_server(workers, args)
+        scenarios = results["workers"][str(workers)] = {}
+        try:
+            with multiprocessing.Pool(clients) as pool:
+                for name in scenario_names:
+                    scenarios[name] = []
+                    for concurrency in levels:
+                        job = (url, name, max(1, concurrency // clients), max(1, args.requests // clients), args)
+                        latencies, statuses, elapsed = [], Counter(), 0.0
+                        for part_latencies, part_statuses, part_elapsed in pool.starmap(_client_process, [job] * clients):
+                            latencies.extend(part_latencies)
+                            statuses.update(part_statuses)
+                            elapsed = max(elapsed, part_elapsed)
+                        level = summarize(concurrency, latencies, statuses, elapsed)
+                        base = first.setdefault((name, concurrency), level["rps"])
+                        level["speedup"] = round(level["rps"] / base, 2) if base else 0.0
+                        # Share of the ideal speedup over the first worker count.
+                        level["scaling_efficiency"] = round(level["speedup"] * worker_counts[0] / workers, 2)
+                        scenarios[name].append(level)
+                        print(f"{name:9} w={workers:<3} c={concurrency:<4} {level['requests']:6} req  "
+                              f"{level['rps']:9.1f} req/s  x{level['speedup']:<5} "
+                              f"({level['scaling_efficiency']:.0%} of linear)  p50 {level['p50_ms']:8.1f}  "
+                              f"p99 {level['p99_ms']:8.1f} ms  errors {level['errors']}")
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+    return results
+
+
+# --- Regression Check ---
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Human-readable regressions of results against baseline."""
+    regressions = []
+    for name, levels in results.get("scenarios", {}).items():
+        base_levels = {l["concurrency"]: l for l in baseline.get("scenarios", {}).get(name, [])}
+        for level in levels:
+            base = base_levels.get(level["concurrency"])
+            if base is None:
+                continue
+            where = f"{name} c={level['concurrency']}"
+            if base["rps"] and level["rps"] < base["rps"] * (1 - tolerance):
+                regressions.append(f"{where}: throughput {base['rps']} -> {level['rps']} req/s")
+            if base["p95_ms"] and level["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{where}: p95 {base['p95_ms']} -> {level['p95_ms']} ms")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API load tests")
+    parser.add_argument("scenario", choices=sorted(SCENARIOS) + ["all"])
+    parser.add_argument("--url", help="Test a running server instead of the in-process app")
+    parser.add_argument("--workers", help="Comma-separated gunicorn worker counts to compare (starts its own servers)")
+    parser.add_argument("--client-processes", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="Load generator processes with --workers")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per level")
+    parser.add_argument("--duration", type=float, default=0, help="Seconds per level (overrides --requests)")
+    parser.add_argument("--warmup", type=int, default=10, help="Warm-up requests per scenario")
+    parser.add_argument("--timeout", type=float, default=60, help="Per-request timeout in seconds")
+    parser.add_argument("--model-latency-ms", type=int, default=300, help="Fake model latency (in-process or --workers)")
+    parser.add_argument("--quotas", action="store_true", help="Keep per-user rate limits on (in-process or --workers)")
+    parser.add_argument("--repeat-code", action="store_true", help="Send identical code so the review cache is hit")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Baseline JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    results = run_scaling(args) if args.workers else asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against baseline.")
\ No newline at end of file
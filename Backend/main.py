@@ -1,5 +1,11 @@
 import os
+import json
+import math
+import time
+import asyncio
+import contextlib
 from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from jose import JWTError, jwt
@@ -10,7 +16,24 @@ from typing import Annotated, Optional
 import database
 import models
 import gemini_client
+import review_cache
+import chunking
+import token_cache
+import metrics
+import resilience
+import quotas
+import jobs
+import history
+import incremental
+import compaction
+import chat_sessions
+import similarity
+import shared_state
 from models import User, UserCreate, CodeReviewRequest, CodeReviewResponse, ChatRequest, ChatResponse, Token
+from models import BatchReviewRequest, BatchReviewResponse, BatchReviewResult
+from models import ReviewJobRequest, ReviewJobCreated, ReviewJob
+from models import ReviewPage, ReviewSummary, ReviewRecord
+from models import ChatContext, ChatSession, ChatMessage
 
 from dotenv import load_dotenv
 
@@ -22,11 +45,31 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY", "a_very_insecure_default_key_replace_me")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "100"))
 
 # --- App & DB Initialization ---
-app = FastAPI(title="AI Code Reviewer API")
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Background work that needs the running event loop.
+    tasks = [asyncio.create_task(quotas.run_flusher())] + jobs.start_workers()
+    if shared_state.SHARED_STATE_ENABLED:
+        tasks.append(asyncio.create_task(shared_state.run_metrics_publisher(metrics.render)))
+    yield
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+app = FastAPI(title="AI Code Reviewer API", lifespan=lifespan)
 database.init_db()  # Create database and tables on startup
-gemini_client.configure_gemini() # Configure Gemini API on startup
+review_cache.init_cache()  # Create the review cache table if needed
+quotas.init_quotas()  # Create the per-user usage table if needed
+jobs.init_jobs()  # Create the review job queue table if needed
+history.init_history()  # Create the review history table and search index if needed
+similarity.init_similarity()  # Create the near-duplicate index tables if needed
+shared_state.init_shared_state()  # Create the cross-worker state tables if running several workers
+chat_sessions.init_chat_sessions()  # Create the chat session tables if needed
+gemini_client.configure_gemini() # Configure the LLM backend (Gemini unless LLM_BACKEND says otherwise)
 
 # --- CORS ---
 # This allows our Streamlit app (from a different URL) to talk to this API
@@ -37,6 +80,33 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Added last so it wraps everything else and times the whole request.
+app.add_middleware(metrics.MetricsMiddleware)
+
+# --- Error Handlers ---
+
+@app.exception_handler(database.PasswordHashingBusy)
+async def password_hashing_busy_handler(request, exc):
+    # Fast reject during a login/register burst; the client should retry shortly.
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Server is busy, please try again shortly."},
+        headers={"Retry-After": "1"},
+    )
+
+@app.exception_handler(quotas.QuotaExceeded)
+async def quota_exceeded_handler(request, exc):
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
+
+@app.exception_handler(resilience.UpstreamError)
+async def upstream_error_handler(request, exc):
+    # 502 upstream error, 503 unavailable / circuit open, 504 timed out.
+    headers = {"Retry-After": str(math.ceil(exc.retry_after))} if exc.retry_after else None
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail}, headers=headers)
 
 # --- Security & Auth ---
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -54,13 +124,21 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 
 async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]) -> User:
     """Decodes token and returns the current user."""
+    # Hot path: a token we've already validated (see token_cache).
+    cached_user = token_cache.get(token)
+    if cached_user is not None:
+        metrics.TOKEN_CACHE_LOOKUPS.labels("hit").inc()
+        return cached_user
+    metrics.TOKEN_CACHE_LOOKUPS.labels("miss").inc()
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with metrics.time_stage("jwt_decode"):
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
@@ -68,14 +146,21 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]) -> Use
     except JWTError:
         raise credentials_exception
     
-    user_data = database.get_user(username=token_data.username)
+    with metrics.time_stage("db_get_user"):
+        user_data = await database.get_user_async(token_data.username)
     if user_data is None:
         raise credentials_exception
     
     # Convert the sqlite3.Row object to our Pydantic User model
     user = User(id=user_data['id'], username=user_data['username'])
+    token_cache.put(token, user, user.username, payload.get("exp"))
     return user
 
+async def get_metered_user(current_user: Annotated[User, Depends(get_current_user)]) -> User:
+    """get_current_user for model-backed endpoints: also enforces the user's rate limit and daily budget."""
+    await quotas.admit(current_user.username)
+    return current_user
+
 # --- API Endpoints ---
 
 @app.get("/")
@@ -85,21 +170,30 @@ def read_root():
 @app.post("/register", response_model=User)
 async def register_user(user: UserCreate):
     """Registers a new user."""
-    db_user = database.get_user(user.username)
+    with metrics.time_stage("db_get_user"):
+        db_user = await database.get_user_async(user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
-    new_user = database.create_user(username=user.username, password=user.password)
+    with metrics.time_stage("create_user"):
+        new_user = await database.create_user_async(user.username, user.password)
     if not new_user:
         raise HTTPException(status_code=500, detail="Could not create user")
+    # Tokens cached for an earlier account with this name must not resolve to the new one.
+    token_cache.invalidate_user(user.username)
         
     return User(id=new_user['id'], username=new_user['username'])
 
 @app.post("/token", response_model=Token)
 async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]):
     """Provides a JWT token for a valid username and password."""
-    user = database.get_user(form_data.username)
-    if not user or not database.verify_password(form_data.password, user['hashed_password']):
+    with metrics.time_stage("db_get_user"):
+        user = await database.get_user_async(form_data.username)
+    password_ok = False
+    if user:
+        with metrics.time_stage("password_verify"):
+            password_ok = await database.verify_password_async(form_data.password, user['hashed_password'])
+    if not user or not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -119,30 +213,374 @@ async def read_users_me(current_user: Annotated[User, Depends(get_current_user)]
 @app.post("/review", response_model=CodeReviewResponse)
 async def get_review(
     request: CodeReviewRequest,
-    current_user: Annotated[User, Depends(get_current_user)]
+    current_user: Annotated[User, Depends(get_metered_user)]
 ):
     """(Protected) Endpoint to get a code review."""
-    review_content = gemini_client.get_code_review(request.code, request.review_type)
+    tally = history.track_tokens()
+    start = time.perf_counter()
+    plan = await _incremental_plan(current_user.username, request)
+    if plan is not None:
+        review_content = await incremental.review(plan, request.review_type)
+    else:
+        review_content = await gemini_client.get_code_review_async(
+            request.code, request.review_type, request.language, request.large_input
+        )
+    review_id = await _record_review(current_user.username, request, review_content, start, tally)
     return CodeReviewResponse(
         review_type=request.review_type,
-        review_content=review_content
+        review_content=review_content,
+        review_id=review_id,
+        incremental=plan is not None
+    )
+
+async def _incremental_plan(username: str, request: CodeReviewRequest):
+    """
+    The incremental review plan: on top of the user's previous review of
+    the file if the request asks for that and it applies, else on top of
+    their review of a near-duplicate if there is one. None for a full review.
+    """
+    plan = None
+    if request.incremental:
+        plan = await incremental.prepare(
+            username, request.code, request.review_type, request.path, request.language
+        )
+    if plan is None:
+        plan = await similarity.prepare(
+            username, request.code, request.review_type, request.language, gemini_client.current_model_id()
+        )
+    return plan
+
+async def _record_review(username: str, request: CodeReviewRequest, content: str, start: float, tally):
+    """Adds a finished review to the user's history; returns its id."""
+    return await history.record(
+        username, request.code, request.review_type, content,
+        language=request.language, path=request.path, model=gemini_client.current_model_id(),
+        latency_ms=(time.perf_counter() - start) * 1000, tally=tally,
+    )
+
+@app.post("/review/jobs", response_model=ReviewJobCreated, status_code=status.HTTP_202_ACCEPTED)
+async def create_review_job(
+    request: ReviewJobRequest,
+    current_user: Annotated[User, Depends(get_metered_user)]
+):
+    """(Protected) Queues a review and returns its job id at once. Poll GET /review/jobs/{job_id}."""
+    if request.callback_url and not request.callback_url.startswith(("http://", "https://")):
+        raise HTTPException(status_code=400, detail="callback_url must be an http(s) URL")
+    job_id = await jobs.submit(
+        current_user.username, request.code, request.review_type,
+        request.language, request.large_input, request.callback_url, request.path
+    )
+    return ReviewJobCreated(job_id=job_id, status="queued")
+
+@app.get("/review/jobs/{job_id}", response_model=ReviewJob)
+async def get_review_job(
+    job_id: str,
+    current_user: Annotated[User, Depends(get_current_user)]
+):
+    """(Protected) Status of a review job, with the review once it's done."""
+    job = await jobs.get(job_id, current_user.username)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return ReviewJob(
+        job_id=job["id"],
+        status=job["status"],
+        review_type=job["review_type"],
+        review_content=job["result"],
+        error=job["error"],
+        created_at=job["created_at"],
+        started_at=job["started_at"],
+        finished_at=job["finished_at"],
+    )
+
+@app.post("/review/batch", response_model=BatchReviewResponse)
+async def get_batch_review(
+    request: BatchReviewRequest,
+    current_user: Annotated[User, Depends(get_current_user)]
+):
+    """(Protected) Reviews many files in one call, concurrently."""
+    if not request.files:
+        raise HTTPException(status_code=400, detail="No files to review")
+    if len(request.files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=400, detail=f"A batch can contain at most {MAX_BATCH_FILES} files")
+    await quotas.admit(current_user.username, requests=len(request.files))
+
+    start = time.perf_counter()
+    review_types = [f.review_type or request.review_type for f in request.files]
+    outcomes = await gemini_client.get_code_reviews_batch([
+        (f.code, review_type, f.language or chunking.language_from_path(f.path))
+        for f, review_type in zip(request.files, review_types)
+    ])
+
+    results = [
+        BatchReviewResult(
+            path=f.path,
+            review_type=review_type,
+            review_content=content,
+            error=error,
+            latency_ms=round(latency_ms, 1),
+        )
+        for f, review_type, (content, error, latency_ms) in zip(request.files, review_types, outcomes)
+    ]
+    failed = sum(1 for r in results if r.error is not None)
+    model = gemini_client.current_model_id()
+    await history.record_many([
+        {"username": current_user.username, "code": f.code, "review_type": r.review_type,
+         "result": r.review_content, "language": f.language or chunking.language_from_path(f.path),
+         "path": f.path, "model": model, "latency_ms": r.latency_ms}
+        for f, r in zip(request.files, results) if r.error is None
+    ])
+    return BatchReviewResponse(
+        results=results,
+        succeeded=len(results) - failed,
+        failed=failed,
+        total_latency_ms=round((time.perf_counter() - start) * 1000, 1),
     )
 
 @app.post("/chat", response_model=ChatResponse)
 async def chat_with_bot(
     request: ChatRequest,
-    current_user: Annotated[User, Depends(get_current_user)]
+    current_user: Annotated[User, Depends(get_metered_user)]
 ):
-    """(Protected) Endpoint for the chatbot."""
-    reply = gemini_client.get_chat_response(request.message)
+    """(Protected) Endpoint for the chatbot. With a session_id, continues that chat session."""
+    if request.session_id is None:
+        reply = await gemini_client.get_chat_response_async(request.message)
+        return ChatResponse(reply=reply)
+    turn = await _start_chat_turn(request, current_user.username)
+    reply = await gemini_client.get_chat_response_async(request.message, turn.conversation)
+    await chat_sessions.finish_turn(turn, reply)
     return ChatResponse(reply=reply)
 
+# --- Chat Sessions ---
+
+def _chat_session(session: dict) -> ChatSession:
+    return ChatSession(
+        session_id=session["id"],
+        code_hash=session["code_hash"],
+        language=session["language"],
+        path=session["path"],
+        has_review=bool(session["review_context"]),
+        summary=session["summary"],
+        created_at=session["created_at"],
+        updated_at=session["updated_at"],
+        messages=[ChatMessage(**m) for m in session.get("messages", [])],
+    )
+
+async def _start_chat_turn(request: ChatRequest, username: str):
+    turn = await chat_sessions.start_turn(request.session_id, username, request.message)
+    if turn is None:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    return turn
+
+@app.post("/chat/sessions", response_model=ChatSession, status_code=status.HTTP_201_CREATED)
+async def create_chat_session(
+    context: ChatContext,
+    current_user: Annotated[User, Depends(get_current_user)]
+):
+    """(Protected) Starts a chat session about the given code (and review)."""
+    session = await chat_sessions.create(current_user.username, **context.model_dump())
+    if session is None:
+        raise HTTPException(status_code=404, detail="Review not found")
+    return _chat_session(session)
+
+@app.get("/chat/sessions/{session_id}", response_model=ChatSession)
+async def get_chat_session(
+    session_id: str,
+    current_user: Annotated[User, Depends(get_current_user)]
+):
+    """(Protected) A chat session with all of its messages."""
+    session = await chat_sessions.get(session_id, current_user.username, with_messages=True)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    return _chat_session(session)
+
+@app.put("/chat/sessions/{session_id}/context", response_model=ChatSession)
+async def replace_chat_context(
+    session_id: str,
+    context: ChatContext,
+    current_user: Annotated[User, Depends(get_current_user)]
+):
+    """(Protected) Replaces the code (and review) a chat session is about; the conversation is kept."""
+    session = await chat_sessions.replace_context(session_id, current_user.username, **context.model_dump())
+    if session is None:
+        raise HTTPException(status_code=404, detail="Chat session or review not found")
+    return _chat_session(session)
+
+# --- Streaming Endpoints ---
+#
+#  Server-Sent Events: each event is "event: <chunk|done|error>" followed
+#  by one "data:" line holding {"text": ...} as JSON (so newlines in the
+#  model output can't break the framing).
+#
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def _sse_event(event: str, text: str) -> str:
+    return f"event: {event}\ndata: {json.dumps({'text': text})}\n\n"
+
+async def _sse_response(events) -> StreamingResponse:
+    """
+    Starts streaming events. The first event is awaited before the
+    response starts, so an upstream failure up front is still answered
+    with an error status (see upstream_error_handler) instead of a 200.
+    """
+    try:
+        first = await events.__anext__()
+    except StopAsyncIteration:
+        first = None
+
+    async def body():
+        if first is not None:
+            yield _sse_event(*first)
+            async for event, text in events:
+                yield _sse_event(event, text)
+
+    return StreamingResponse(body(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.post("/review/stream")
+async def stream_review(
+    request: CodeReviewRequest,
+    current_user: Annotated[User, Depends(get_metered_user)]
+):
+    """(Protected) Streams a code review as Server-Sent Events."""
+    tally = history.track_tokens()
+    start = time.perf_counter()
+    plan = await _incremental_plan(current_user.username, request)
+    if plan is not None:
+        events = incremental.stream_review(plan, request.review_type)
+    else:
+        events = gemini_client.stream_code_review(
+            request.code, request.review_type, request.language, request.large_input
+        )
+    return await _sse_response(_record_when_done(events, current_user.username, request, start, tally))
+
+async def _record_when_done(events, username: str, request: CodeReviewRequest, start: float, tally):
+    """Passes review events through, saving the review to history on "done"."""
+    async for event, text in events:
+        if event == "done":
+            await _record_review(username, request, text, start, tally)
+        yield event, text
+
+@app.post("/chat/stream")
+async def stream_chat(
+    request: ChatRequest,
+    current_user: Annotated[User, Depends(get_metered_user)]
+):
+    """(Protected) Streams a chatbot reply as Server-Sent Events."""
+    if request.session_id is None:
+        return await _sse_response(gemini_client.stream_chat_response(request.message))
+    turn = await _start_chat_turn(request, current_user.username)
+    events = gemini_client.stream_chat_response(request.message, turn.conversation)
+    return await _sse_response(_finish_turn_when_done(events, turn))
+
+async def _finish_turn_when_done(events, turn):
+    """Passes chat events through, storing the turn in its session on "done"."""
+    async for event, text in events:
+        if event == "done":
+            await chat_sessions.finish_turn(turn, text)
+        yield event, text
+
+# --- Review History ---
+
+def _review_page(rows, limit: int) -> ReviewPage:
+    next_before = rows[-1]["id"] if len(rows) == limit else None
+    return ReviewPage(reviews=[ReviewSummary(**r) for r in rows], next_before=next_before)
+
+@app.get("/reviews", response_model=ReviewPage)
+async def list_reviews(
+    current_user: Annotated[User, Depends(get_current_user)],
+    limit: int = history.HISTORY_PAGE_SIZE,
+    before: Optional[int] = None,
+    code_hash: Optional[str] = None,
+):
+    """(Protected) The user's past reviews, newest first. Filter by code_hash to find earlier reviews of the same code."""
+    limit = max(1, min(limit, history.HISTORY_MAX_PAGE_SIZE))
+    rows = await history.list_page(current_user.username, limit, before, code_hash)
+    return _review_page(rows, limit)
+
+@app.get("/reviews/search", response_model=ReviewPage)
+async def search_reviews(
+    q: str,
+    current_user: Annotated[User, Depends(get_current_user)],
+    limit: int = history.HISTORY_PAGE_SIZE,
+    before: Optional[int] = None,
+):
+    """(Protected) Full-text search over the user's past reviews, newest first."""
+    limit = max(1, min(limit, history.HISTORY_MAX_PAGE_SIZE))
+    rows = await history.search(current_user.username, q, limit, before)
+    return _review_page(rows, limit)
+
+@app.get("/reviews/{review_id}", response_model=ReviewRecord)
+async def get_past_review(
+    review_id: int,
+    current_user: Annotated[User, Depends(get_current_user)]
+):
+    """(Protected) One past review with its code, without calling the model again."""
+    review = await history.get(review_id, current_user.username)
+    if review is None:
+        raise HTTPException(status_code=404, detail="Review not found")
+    review["review_content"] = review.pop("result")
+    return ReviewRecord(**review)
+
+@app.get("/usage")
+async def get_usage(current_user: Annotated[User, Depends(get_current_user)]):
+    """(Protected) The current user's usage today and their limits."""
+    return await quotas.get_usage(current_user.username)
+
+@app.get("/cache/stats")
+async def get_cache_stats(current_user: Annotated[User, Depends(get_current_user)]):
+    """(Protected) Review cache hit/miss counters, coalesced upstream calls and prompt compaction savings."""
+    stats = review_cache.get_stats()
+    stats["coalescing"] = gemini_client.get_coalescing_stats()
+    stats["compaction"] = compaction.get_stats()
+    return stats
+
+# --- Metrics ---
+#
+#  Prometheus text format. Unauthenticated so a scraper can read it;
+#  expose it only on an internal network. With several workers, whichever
+#  one answers reports every worker's values (labelled by pid) from
+#  shared_state, including its own as of now.
+#
+
+def _review_cache_metrics():
+    stats = review_cache.get_stats()
+    return {
+        ("memory", "hit"): stats["memory_hits"],
+        ("disk", "hit"): stats["disk_hits"],
+        ("any", "miss"): stats["misses"],
+    }
+
+def _coalescing_metrics():
+    stats = gemini_client.get_coalescing_stats()
+    return {("upstream",): stats["upstream_calls"], ("collapsed",): stats["collapsed"]}
+
+metrics.Collected(
+    "review_cache_lookups_total", "Review cache lookups by tier and result.", "counter",
+    ("tier", "result"), _review_cache_metrics,
+)
+metrics.Collected(
+    "review_cache_hit_ratio", "Share of review cache lookups that hit either tier.", "gauge",
+    (), lambda: {(): review_cache.get_stats()["hit_rate"]},
+)
+metrics.Collected(
+    "review_coalescing_total", "Review requests that made an upstream call vs. shared one.", "counter",
+    ("result",), _coalescing_metrics,
+)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    body = metrics.render()
+    if shared_state.SHARED_STATE_ENABLED:
+        shared_state.publish_metrics(body)
+        body = metrics.merge_workers(shared_state.worker_metrics())
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
 # --- Main entry point for uvicorn ---
 if __name__ == "__main__":
     import uvicorn
     if not os.getenv("SECRET_KEY"):
         print("Warning: SECRET_KEY not set. Using a default insecure key.")
-    if not os.getenv("GEMINI_API_KEY"):
+    if gemini_client.llm_backends.LLM_BACKEND == "gemini" and not os.getenv("GEMINI_API_KEY"):
         print("\n!!! WARNING: GEMINI_API_KEY environment variable is not set. !!!")
         print("The API will not work without it.\n")
         
@@ -0,0 +1,298 @@
+import threading
+import time
+from bisect import bisect_left
+
+# --- Metrics ---
+#
+#  A few Prometheus-style metric types, rendered in the text exposition
+#  format at GET /metrics. Each labelled series is a small object with
+#  its own lock, so recording a value costs a dict lookup and a few
+#  additions. Values are per worker process; with several workers, each
+#  one's samples are labelled worker="<pid>" (see merge_workers).
+#
+
+# Seconds; spans a token-cache hit (microseconds) to a slow generation.
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+_registry = []
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def labels(self, *values):
+        """The series for these label values (created on first use)."""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for values, child in list(self._children.items()):
+            yield from child.render(self.name, _format_labels(self.labelnames, values))
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+    def render(self, name, labels):
+        yield f"{name}{labels} {_format_value(self.value)}"
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        """Shortcut for an unlabelled counter."""
+        self.labels().inc(amount)
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self.labels().dec(amount)
+
+
+class _HistogramSeries:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf.
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def render(self, name, labels):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        base = labels[1:-1] + "," if labels else ""
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            yield f'{name}_bucket{{{base}le="{_format_value(bound)}"}} {cumulative}'
+        yield f"{name}_sum{labels} {_format_value(total)}"
+        yield f"{name}_count{labels} {cumulative}"
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self):
+        return _HistogramSeries(self.buckets)
+
+    def observe(self, value: float):
+        """Shortcut for an unlabelled histogram."""
+        self.labels().observe(value)
+
+
+class Collected(_Metric):
+    """
+    A metric read from elsewhere at scrape time: fn returns a dict of
+    {label values tuple: value}. Used for counters other modules already
+    keep (review cache, request coalescing).
+    """
+
+    def __init__(self, name: str, help: str, kind: str, labelnames, fn):
+        self.kind = kind
+        self._fn = fn
+        super().__init__(name, help, labelnames)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for values, value in self._fn().items():
+            yield f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}"
+
+
+def render() -> str:
+    """Every registered metric in the Prometheus text format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def _with_worker(sample: str, worker) -> str:
+    # A metric name can't contain "{", so the first one opens the labels.
+    if "{" in sample.split(" ", 1)[0]:
+        return sample.replace("{", f'{{worker="{worker}",', 1)
+    name, value = sample.split(" ", 1)
+    return f'{name}{{worker="{worker}"}} {value}'
+
+def merge_workers(snapshots) -> str:
+    """
+    One exposition from several workers' render() output, given as
+    (worker id, text) pairs: each sample gets a worker label, and each
+    metric's HELP and TYPE lines are written once.
+    """
+    families = {}  # name -> [HELP line, TYPE line, samples]
+    for worker, text in snapshots:
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# HELP "):
+                family = families.setdefault(line.split(" ", 3)[2], [line, None, []])
+            elif line.startswith("# TYPE "):
+                family[1] = line
+            elif line:
+                family[2].append(_with_worker(line, worker))
+    lines = []
+    for help_line, type_line, samples in families.values():
+        lines.append(help_line)
+        lines.append(type_line)
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+# --- Application Metrics ---
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests by route and status code.", ("method", "route", "status")
+)
+HTTP_DURATION = Histogram(
+    "http_request_duration_seconds", "Time from request to the end of the response body.", ("method", "route")
+)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being handled.")
+
+STAGE_DURATION = Histogram(
+    "stage_duration_seconds",
+    "Time spent in each stage of request handling (jwt_decode, db_get_user, "
+    "prompt_build, upstream, clean_refactored_code, ...).",
+    ("stage",),
+)
+
+TOKEN_CACHE_LOOKUPS = Counter("token_cache_lookups_total", "Bearer token cache lookups.", ("result",))
+
+UPSTREAM_REQUESTS = Counter("upstream_requests_total", "Model API calls by outcome.", ("kind", "outcome"))
+UPSTREAM_TOKENS = Counter("upstream_tokens_total", "Model API tokens reported by usage metadata.", ("direction",))
+UPSTREAM_IN_FLIGHT = Gauge("upstream_requests_in_flight", "Model API calls currently running.")
+UPSTREAM_RETRIES = Counter("upstream_retries_total", "Model API calls retried after a retriable failure.")
+BREAKER_OPENED = Counter("upstream_circuit_opened_total", "Times the upstream circuit breaker opened.")
+
+QUOTA_REJECTIONS = Counter("quota_rejections_total", "Requests refused with 429 by reason.", ("reason",))
+
+
+class _StageTimer:
+    __slots__ = ("series", "start")
+
+    def __init__(self, series):
+        self.series = series
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.series.observe(time.perf_counter() - self.start)
+        return False
+
+def time_stage(stage: str) -> _StageTimer:
+    """Context manager recording how long a block took under stage_duration_seconds."""
+    return _StageTimer(STAGE_DURATION.labels(stage))
+
+def record_usage(usage_metadata):
+    """Adds one response's token counts (SDK usage_metadata, may be None)."""
+    if usage_metadata is None:
+        return
+    prompt_tokens = getattr(usage_metadata, "prompt_token_count", 0) or 0
+    output_tokens = getattr(usage_metadata, "candidates_token_count", 0) or 0
+    if prompt_tokens:
+        UPSTREAM_TOKENS.labels("prompt").inc(prompt_tokens)
+    if output_tokens:
+        UPSTREAM_TOKENS.labels("output").inc(output_tokens)
+
+
+# --- Middleware ---
+
+class MetricsMiddleware:
+    """
+    Plain ASGI middleware (no per-request task or body buffering) that
+    counts and times every HTTP request. Requests are labelled with the
+    route's path template, e.g. "/review", never the raw URL.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            method = scope["method"]
+            HTTP_DURATION.labels(method, path).observe(time.perf_counter() - start)
+            HTTP_REQUESTS.labels(method, path, str(status_code)).inc()
\ No newline at end of file
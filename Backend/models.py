@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Literal, Optional
+from typing import List, Literal, Optional
 
 # --- User & Auth Models ---
 
@@ -30,14 +30,134 @@ ReviewType = Literal["general", "documentation", "competitive", "refactor", "exp
 class CodeReviewRequest(BaseModel):
     code: str
     review_type: ReviewType
+    # Editor language name (e.g. "python"); used to split large files.
+    language: Optional[str] = None
+    # Review in parts. None means decide from the file's length.
+    large_input: Optional[bool] = None
+    # File name, if any; kept with the review in the history.
+    path: Optional[str] = None
+    # Re-review only what changed since this user's last review of the same
+    # file (same path and review type). /review and /review/stream only;
+    # those also build on the user's review of a near-duplicate, if there
+    # is one, without being asked.
+    incremental: bool = False
 
 class CodeReviewResponse(BaseModel):
     review_content: str
+    # Id in the review history (GET /reviews/{id}); None if not recorded.
+    review_id: Optional[int] = None
+    # True if only the edits since the previous review, or the differences
+    # from a near-duplicate the user had reviewed before, were sent to the
+    # model.
+    incremental: bool = False
+
+# --- Review Job Models ---
+
+class ReviewJobRequest(CodeReviewRequest):
+    # Optional http(s) URL that receives the finished job as a JSON POST.
+    callback_url: Optional[str] = None
+
+class ReviewJobCreated(BaseModel):
+    job_id: str
+    status: str
+
+class ReviewJob(BaseModel):
+    job_id: str
+    status: Literal["queued", "running", "done", "failed"]
+    review_type: ReviewType
+    review_content: Optional[str] = None
+    error: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+# --- Review History Models ---
+
+class ReviewSummary(BaseModel):
+    id: int
+    created_at: float
+    review_type: ReviewType
+    language: Optional[str] = None
+    path: Optional[str] = None
+    model: Optional[str] = None
+    code_hash: str
+    latency_ms: Optional[float] = None
+    prompt_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+    # Start of the review, or the matching passage for a search.
+    preview: str
+
+class ReviewPage(BaseModel):
+    reviews: List[ReviewSummary]
+    # Pass as ?before= to get the next page; None on the last page.
+    next_before: Optional[int] = None
+
+class ReviewRecord(ReviewSummary):
+    preview: str = ""
+    code: str
+    review_content: str
+
+# --- Batch Review Models ---
+
+class BatchReviewFile(BaseModel):
+    path: str
+    code: str
+    # Falls back to the batch-level review_type when omitted.
+    review_type: Optional[ReviewType] = None
+    # Guessed from the path's extension when omitted.
+    language: Optional[str] = None
+
+class BatchReviewRequest(BaseModel):
+    files: List[BatchReviewFile]
+    review_type: ReviewType = "general"
+
+class BatchReviewResult(BaseModel):
+    path: str
+    review_type: ReviewType
+    review_content: Optional[str] = None
+    error: Optional[str] = None
+    latency_ms: float
+
+class BatchReviewResponse(BaseModel):
+    results: List[BatchReviewResult]
+    succeeded: int
+    failed: int
+    total_latency_ms: float
 
 # --- Chat Models ---
 
 class ChatRequest(BaseModel):
     message: str
+    # Continue a chat session (POST /chat/sessions) instead of a one-off question.
+    session_id: Optional[str] = None
     
 class ChatResponse(BaseModel):
-    reply: str
\ No newline at end of file
+    reply: str
+
+class ChatContext(BaseModel):
+    # The code the conversation is about, attached once per session.
+    code: Optional[str] = None
+    language: Optional[str] = None
+    path: Optional[str] = None
+    # A review of that code for the model to refer to: its text, or the
+    # id of a past review (whose code is used if code is omitted).
+    review: Optional[str] = None
+    review_id: Optional[int] = None
+
+class ChatMessage(BaseModel):
+    role: Literal["user", "assistant"]
+    content: str
+    created_at: float
+
+class ChatSession(BaseModel):
+    session_id: str
+    # sha256 of the attached code, so a client can tell when to replace it.
+    code_hash: Optional[str] = None
+    language: Optional[str] = None
+    path: Optional[str] = None
+    has_review: bool
+    # Rolling summary of the turns no longer sent to the model verbatim.
+    summary: str
+    created_at: float
+    updated_at: float
+    messages: List[ChatMessage] = []
\ No newline at end of file
@@ -0,0 +1,283 @@
+import asyncio
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import database
+import metrics
+import shared_state
+
+# --- Configuration ---
+#
+#  Two limits per user, checked before any model call:
+#
+#  - a token bucket: RATE_LIMIT_PER_MINUTE requests per minute on
+#    average, with bursts of up to RATE_LIMIT_BURST
+#  - daily budgets (UTC days) of model-backed requests and of model
+#    tokens (prompt + output, as reported by the API)
+#
+#  Counters live in memory and are written to the usage_daily table every
+#  QUOTA_FLUSH_SECONDS as deltas, so a restart loses at most one interval.
+#  A budget of 0 is unlimited.
+#
+#  With several worker processes (shared_state on), each would otherwise
+#  allow the full rate and budget: buckets are kept in shared_state and
+#  requests are counted in usage_daily as they are admitted. Model
+#  tokens are still flushed as deltas.
+#
+QUOTAS_ENABLED = os.getenv("QUOTAS_ENABLED", "1") != "0"
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "30"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "10"))
+DAILY_REQUEST_BUDGET = int(os.getenv("DAILY_REQUEST_BUDGET", "500"))
+DAILY_TOKEN_BUDGET = int(os.getenv("DAILY_TOKEN_BUDGET", "1000000"))
+QUOTA_FLUSH_SECONDS = float(os.getenv("QUOTA_FLUSH_SECONDS", "10"))
+
+_buckets = {}  # username -> [tokens, last refill (monotonic)]
+_usage = {}    # (username, day) -> [requests, tokens, unflushed requests, unflushed tokens]
+_lock = threading.Lock()
+
+# Who the model tokens of the current request are charged to. Set by
+# admit(); copied into any task the request starts.
+_charge_to = contextvars.ContextVar("quota_charge_to", default=None)
+
+
+class QuotaExceeded(Exception):
+    """A user is over a rate limit or daily budget."""
+
+    def __init__(self, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+# --- Storage ---
+
+def init_quotas():
+    """Creates the usage table if it doesn't exist."""
+    try:
+        conn = database.get_db_connection()
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS usage_daily (
+            username TEXT NOT NULL,
+            day TEXT NOT NULL,
+            requests INTEGER NOT NULL DEFAULT 0,
+            tokens INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (username, day)
+        );
+        """)
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Quota table initialization error: {e}")
+
+def _load_usage(username: str, day: str):
+    """(requests, tokens) already recorded for this user and day."""
+    try:
+        row = database.get_db_connection().execute(
+            "SELECT requests, tokens FROM usage_daily WHERE username = ? AND day = ?", (username, day)
+        ).fetchone()
+        return (row[0], row[1]) if row else (0, 0)
+    except sqlite3.Error as e:
+        print(f"Quota read error: {e}")
+        return 0, 0
+
+def flush():
+    """Writes unflushed usage to SQLite and drops entries from past days."""
+    today = _today()
+    with _lock:
+        pending = []
+        for key, entry in _usage.items():
+            if entry[2] or entry[3]:
+                pending.append((key, entry[2], entry[3]))
+                entry[2] = entry[3] = 0
+        for key in [k for k in _usage if k[1] != today]:
+            if not (_usage[key][2] or _usage[key][3]):
+                del _usage[key]
+        _prune_buckets()
+    if shared_state.SHARED_STATE_ENABLED and RATE_LIMIT_PER_MINUTE > 0:
+        try:
+            shared_state.prune_rate_buckets(_seconds_to_refill())
+        except sqlite3.Error as e:
+            print(f"Rate bucket prune error: {e}")
+    if not pending:
+        return
+    try:
+        conn = database.get_db_connection()
+        with conn:
+            conn.executemany(
+                "INSERT INTO usage_daily (username, day, requests, tokens) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (username, day) DO UPDATE SET "
+                "requests = requests + excluded.requests, tokens = tokens + excluded.tokens",
+                [(username, day, requests, tokens) for (username, day), requests, tokens in pending]
+            )
+    except sqlite3.Error as e:
+        print(f"Quota flush error: {e}")
+        # Put the deltas back for the next attempt.
+        with _lock:
+            for key, requests, tokens in pending:
+                entry = _usage.setdefault(key, [0, 0, 0, 0])
+                entry[2] += requests
+                entry[3] += tokens
+
+def _prune_buckets():
+    # Caller holds _lock. A bucket that has refilled completely is the
+    # same as no bucket.
+    if RATE_LIMIT_PER_MINUTE <= 0:
+        return
+    full_after = _seconds_to_refill()
+    now = time.monotonic()
+    for username in [u for u, b in _buckets.items() if now - b[1] >= full_after]:
+        del _buckets[username]
+
+def _seconds_to_refill() -> float:
+    return RATE_LIMIT_BURST * 60 / RATE_LIMIT_PER_MINUTE
+
+async def run_flusher():
+    """Flushes usage every QUOTA_FLUSH_SECONDS until cancelled, then once more."""
+    try:
+        while True:
+            await asyncio.sleep(QUOTA_FLUSH_SECONDS)
+            await database.run_db(flush)
+    finally:
+        await database.run_db(flush)
+
+
+# --- Enforcement ---
+
+def _today() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+def _seconds_until_tomorrow() -> float:
+    now = datetime.now(timezone.utc)
+    tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (tomorrow - now).total_seconds()
+
+def _take_rate_token(username: str):
+    # Caller holds _lock.
+    if RATE_LIMIT_PER_MINUTE <= 0:
+        return
+    rate = RATE_LIMIT_PER_MINUTE / 60
+    now = time.monotonic()
+    bucket = _buckets.get(username)
+    if bucket is None:
+        bucket = _buckets[username] = [RATE_LIMIT_BURST, now]
+    tokens = min(RATE_LIMIT_BURST, bucket[0] + (now - bucket[1]) * rate)
+    bucket[1] = now
+    if tokens < 1:
+        bucket[0] = tokens
+        metrics.QUOTA_REJECTIONS.labels("rate_limit").inc()
+        raise QuotaExceeded("Too many requests. Please slow down.", (1 - tokens) / rate)
+    bucket[0] = tokens - 1
+
+async def _usage_entry(username: str, day: str):
+    """This worker's counters for the user and day, loaded from SQLite on first use."""
+    key = (username, day)
+    entry = _usage.get(key)
+    if entry is None:
+        loaded = await database.run_db(_load_usage, username, day)
+        with _lock:
+            entry = _usage.setdefault(key, [loaded[0], loaded[1], 0, 0])
+    return entry
+
+async def admit(username: str, requests: int = 1):
+    """
+    Admits one model-backed API call costing `requests` daily requests
+    (a batch costs one per file) and charges later model tokens to this
+    user. Raises QuotaExceeded otherwise.
+    """
+    if not QUOTAS_ENABLED:
+        return
+    day = _today()
+    if shared_state.SHARED_STATE_ENABLED:
+        await database.run_db(_admit_shared, username, day, requests)
+        _charge_to.set((username, day))
+        return
+    entry = await _usage_entry(username, day)
+    with _lock:
+        if DAILY_REQUEST_BUDGET and entry[0] + requests > DAILY_REQUEST_BUDGET:
+            metrics.QUOTA_REJECTIONS.labels("daily_requests").inc()
+            raise QuotaExceeded("Daily request budget used up.", _seconds_until_tomorrow())
+        if DAILY_TOKEN_BUDGET and entry[1] >= DAILY_TOKEN_BUDGET:
+            metrics.QUOTA_REJECTIONS.labels("daily_tokens").inc()
+            raise QuotaExceeded("Daily token budget used up.", _seconds_until_tomorrow())
+        _take_rate_token(username)
+        entry[0] += requests
+        entry[2] += requests
+    _charge_to.set((username, day))
+
+def _admit_shared(username: str, day: str, requests: int):
+    """admit against the bucket and counts every worker process shares."""
+    if DAILY_REQUEST_BUDGET and requests > DAILY_REQUEST_BUDGET:
+        metrics.QUOTA_REJECTIONS.labels("daily_requests").inc()
+        raise QuotaExceeded("Daily request budget used up.", _seconds_until_tomorrow())
+    try:
+        if RATE_LIMIT_PER_MINUTE > 0:
+            retry_after = shared_state.take_rate_token(
+                f"user:{username}", RATE_LIMIT_PER_MINUTE / 60, RATE_LIMIT_BURST
+            )
+            if retry_after:
+                metrics.QUOTA_REJECTIONS.labels("rate_limit").inc()
+                raise QuotaExceeded("Too many requests. Please slow down.", retry_after)
+        # Counted only if it fits both budgets, in one statement.
+        conn = database.get_db_connection()
+        with conn:
+            admitted = conn.execute(
+                "INSERT INTO usage_daily (username, day, requests, tokens) VALUES (:user, :day, :n, 0) "
+                "ON CONFLICT (username, day) DO UPDATE SET requests = requests + :n "
+                "WHERE (:request_budget = 0 OR requests + :n <= :request_budget) "
+                "AND (:token_budget = 0 OR tokens < :token_budget) "
+                "RETURNING requests",
+                {"user": username, "day": day, "n": requests,
+                 "request_budget": DAILY_REQUEST_BUDGET, "token_budget": DAILY_TOKEN_BUDGET}
+            ).fetchall()
+    except sqlite3.Error as e:
+        # Like a failed usage read: let the request through.
+        print(f"Quota check error: {e}")
+        return
+    if admitted:
+        return
+    used_requests, used_tokens = _load_usage(username, day)
+    if DAILY_TOKEN_BUDGET and used_tokens >= DAILY_TOKEN_BUDGET:
+        metrics.QUOTA_REJECTIONS.labels("daily_tokens").inc()
+        raise QuotaExceeded("Daily token budget used up.", _seconds_until_tomorrow())
+    metrics.QUOTA_REJECTIONS.labels("daily_requests").inc()
+    raise QuotaExceeded("Daily request budget used up.", _seconds_until_tomorrow())
+
+def charge_to(username: str):
+    """Charges model tokens used from here on (in this context) to username."""
+    _charge_to.set((username, _today()))
+
+def charge_usage(usage_metadata):
+    """Adds a model response's tokens to the budget of the user being served."""
+    key = _charge_to.get()
+    if key is None or usage_metadata is None:
+        return
+    tokens = getattr(usage_metadata, "total_token_count", 0) or 0
+    if not tokens:
+        return
+    with _lock:
+        entry = _usage.setdefault(key, [0, 0, 0, 0])
+        entry[1] += tokens
+        entry[3] += tokens
+
+async def get_usage(username: str) -> dict:
+    """Today's usage and limits for a user (as far as this worker knows)."""
+    day = _today()
+    if shared_state.SHARED_STATE_ENABLED:
+        requests, tokens = await database.run_db(_load_usage, username, day)
+        with _lock:
+            unflushed = _usage.get((username, day))
+            tokens += unflushed[3] if unflushed else 0
+    else:
+        entry = await _usage_entry(username, day)
+        requests, tokens = entry[0], entry[1]
+    return {
+        "day": day,
+        "requests": requests,
+        "request_budget": DAILY_REQUEST_BUDGET,
+        "tokens": tokens,
+        "token_budget": DAILY_TOKEN_BUDGET,
+        "rate_limit_per_minute": RATE_LIMIT_PER_MINUTE,
+    }
\ No newline at end of file
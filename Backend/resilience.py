@@ -0,0 +1,200 @@
+import asyncio
+import os
+import random
+import time
+
+import metrics
+
+# --- Configuration ---
+#
+#  Every upstream model call gets a deadline, retriable failures (rate
+#  limits, 5xx, dropped connections) are retried with jittered
+#  exponential backoff, and a circuit breaker fails calls fast once the
+#  API looks down, so requests don't sit on worker capacity waiting for
+#  an upstream that isn't answering.
+#
+UPSTREAM_TIMEOUT_SECONDS = float(os.getenv("UPSTREAM_TIMEOUT_SECONDS", "60"))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "2"))
+UPSTREAM_RETRY_BASE_SECONDS = float(os.getenv("UPSTREAM_RETRY_BASE_SECONDS", "0.5"))
+UPSTREAM_RETRY_MAX_SECONDS = float(os.getenv("UPSTREAM_RETRY_MAX_SECONDS", "8"))
+# Consecutive failed calls that open the breaker, and how long it stays
+# open before one probe call is let through.
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+# HTTP statuses from the model API worth another try. Both
+# google.api_core errors and llm_backends.UpstreamAPIError carry one in .code.
+RETRIABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+# --- Errors ---
+
+class UpstreamError(Exception):
+    """An upstream failure, with the HTTP status our API answers with."""
+
+    status_code = 502
+    detail = "The AI model returned an error. Please try again."
+    retriable = False
+
+    def __init__(self, message: str = None, retry_after: float = None):
+        super().__init__(message or self.detail)
+        self.retry_after = retry_after
+
+class UpstreamTimeout(UpstreamError):
+    status_code = 504
+    detail = "The AI model took too long to respond. Please try again."
+
+class UpstreamUnavailable(UpstreamError):
+    status_code = 503
+    detail = "The AI model is temporarily unavailable. Please try again shortly."
+    retriable = True
+
+class UpstreamFailed(UpstreamError):
+    pass
+
+class CircuitOpen(UpstreamUnavailable):
+    """Raised without calling upstream while the breaker is open."""
+
+
+def classify(exc: Exception) -> UpstreamError:
+    """Maps an exception from a model call to one of the errors above."""
+    if isinstance(exc, UpstreamError):
+        return exc
+    if isinstance(exc, TimeoutError):
+        return UpstreamTimeout(f"No response within {UPSTREAM_TIMEOUT_SECONDS:g}s")
+    if isinstance(exc, ConnectionError):
+        return UpstreamUnavailable(str(exc) or type(exc).__name__)
+    code = getattr(exc, "code", None)
+    if isinstance(code, int) and code in RETRIABLE_STATUS_CODES:
+        return UpstreamUnavailable(f"{code}: {exc}", retry_after=1)
+    return UpstreamFailed(f"{type(exc).__name__}: {exc}")
+
+
+# --- Circuit Breaker ---
+
+class CircuitBreaker:
+    """
+    closed: calls go through; BREAKER_FAILURE_THRESHOLD failures in a row
+            open the breaker.
+    open:   calls fail at once with CircuitOpen until BREAKER_RESET_SECONDS
+            have passed, then one probe call is let through (half-open).
+    half-open: the probe's outcome closes or re-opens the breaker. If the
+            probe never reports back (e.g. it was cancelled), another is
+            allowed after BREAKER_RESET_SECONDS.
+
+    State is per worker process and only touched from the event loop.
+    """
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = 0.0
+
+    def before_call(self):
+        """Raises CircuitOpen if the call must not go upstream."""
+        if self.state == "closed":
+            return
+        now = time.monotonic()
+        if self.state == "open" and now - self.opened_at >= self.reset_seconds:
+            self.state = "half_open"
+            self.probe_started = now
+            return
+        if self.state == "half_open" and now - self.probe_started >= self.reset_seconds:
+            self.probe_started = now
+            return
+        retry_after = max(1.0, self.reset_seconds - (now - self.opened_at))
+        raise CircuitOpen("Circuit breaker open: upstream is failing", retry_after=retry_after)
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+
+    def record_failure(self):
+        if self.state == "half_open":
+            self._open()
+            return
+        self.failures += 1
+        if self.state == "closed" and self.failures >= self.failure_threshold:
+            self._open()
+
+    def _open(self):
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        metrics.BREAKER_OPENED.inc()
+
+breaker = CircuitBreaker()
+
+metrics.Collected(
+    "upstream_circuit_open", "1 while the upstream circuit breaker is open or half-open.", "gauge",
+    (), lambda: {(): 0 if breaker.state == "closed" else 1},
+)
+
+
+# --- Calls ---
+
+def record_outcome(error: UpstreamError = None):
+    """Feeds one call's outcome to the breaker (None means success)."""
+    if error is None or (not error.retriable and not isinstance(error, UpstreamTimeout)):
+        # A non-retriable error (e.g. a rejected prompt) still shows that
+        # upstream is up.
+        breaker.record_success()
+    else:
+        breaker.record_failure()
+
+def retry_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff before retry number `attempt` (1-based)."""
+    ceiling = min(UPSTREAM_RETRY_MAX_SECONDS, UPSTREAM_RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+    return random.uniform(0, ceiling)
+
+def should_retry(error: UpstreamError, attempt: int) -> bool:
+    """
+    Whether to make retry number `attempt` (1-based) after error. Timeouts
+    aren't retried: the call already used its whole deadline.
+    """
+    return (error.retriable and attempt <= UPSTREAM_MAX_RETRIES
+            and not isinstance(error, CircuitOpen) and breaker.state == "closed")
+
+async def after_failure(exc: Exception, attempt: int, can_retry: bool = True):
+    """
+    Handles failed attempt number `attempt` (1-based): feeds the breaker,
+    then either raises the failure as an UpstreamError or sleeps until the
+    next attempt is due.
+    """
+    error = classify(exc)
+    record_outcome(error)
+    if not can_retry or not should_retry(error, attempt):
+        if error is exc:
+            raise error
+        raise error from exc
+    metrics.UPSTREAM_RETRIES.inc()
+    await asyncio.sleep(retry_delay(attempt))
+
+async def call_with_retries(make_call):
+    """
+    Awaits make_call() (a fresh coroutine per attempt) through the breaker,
+    retrying retriable failures. Raises an UpstreamError when out of tries.
+    The per-call deadline is up to make_call (see with_deadline), so that
+    time spent queueing for a call slot doesn't count against it.
+    """
+    attempt = 0
+    while True:
+        breaker.before_call()
+        try:
+            result = await make_call()
+        except Exception as e:
+            attempt += 1
+            await after_failure(e, attempt)
+            continue
+        record_outcome()
+        return result
+
+async def with_deadline(awaitable, timeout: float = None):
+    """Awaits with the upstream deadline; a timeout raises UpstreamTimeout."""
+    try:
+        return await asyncio.wait_for(awaitable, UPSTREAM_TIMEOUT_SECONDS if timeout is None else timeout)
+    except TimeoutError as e:
+        raise classify(e) from e
\ No newline at end of file
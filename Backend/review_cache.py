@@ -0,0 +1,261 @@
+import hashlib
+import io
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import tokenize
+from collections import OrderedDict
+
+import database
+
+# --- Configuration ---
+#
+#  Two tiers: a small in-process LRU in front of a SQLite table that
+#  survives restarts. The SQLite file lives next to code_reviewer.db.
+#
+CACHE_DATABASE_URL = os.getenv("REVIEW_CACHE_DB", "review_cache.db")
+CACHE_ENABLED = os.getenv("REVIEW_CACHE_ENABLED", "1") != "0"
+CACHE_TTL_SECONDS = int(os.getenv("REVIEW_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+MEMORY_MAX_ENTRIES = int(os.getenv("REVIEW_CACHE_MEMORY_ENTRIES", "512"))
+DISK_MAX_ENTRIES = int(os.getenv("REVIEW_CACHE_DISK_ENTRIES", "20000"))
+
+# Review types whose output does not depend on comments, so comment-only
+# edits may share a cache entry. "documentation" and "refactor" are
+# excluded: the first reviews the comments, the second echoes them back.
+COMMENT_INSENSITIVE_TYPES = {"general", "competitive", "explain"}
+
+# Full-line comments are found per editor language: with the tokenizer
+# for Python (so "// 2" continuing an expression, or "#" inside a string,
+# stays), "// ..." lines for the C family (where "# define" is code). In
+# any other language, or none, comments are kept: a wrong guess would let
+# two different programs share a key.
+_C_FAMILY_LANGUAGES = {"javascript", "typescript", "java", "c_cpp", "csharp", "go", "swift"}
+_C_COMMENT_LINE = re.compile(r"^\s*//")
+_PYTHON_NON_CODE = {tokenize.COMMENT, tokenize.NL, tokenize.NEWLINE, tokenize.INDENT,
+                    tokenize.DEDENT, tokenize.ENDMARKER}
+
+_memory = OrderedDict()
+_lock = threading.Lock()
+_stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+
+# --- Keys ---
+
+def _python_comment_lines(code: str) -> set:
+    """1-based numbers of the lines holding only a comment; none if the code doesn't tokenize."""
+    if "#" not in code:
+        return set()
+    comments, code_rows = set(), set()
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(code).readline):
+            if token.type == tokenize.COMMENT:
+                comments.add(token.start[0])
+            elif token.type not in _PYTHON_NON_CODE:
+                code_rows.update(range(token.start[0], token.end[0] + 1))
+    except (tokenize.TokenError, SyntaxError):
+        return set()
+    return comments - code_rows
+
+def _comment_lines(code: str, lines, language) -> set:
+    if language == "python":
+        return _python_comment_lines(code)
+    if language in _C_FAMILY_LANGUAGES:
+        return {i + 1 for i, line in enumerate(lines) if _C_COMMENT_LINE.match(line)}
+    return set()
+
+def normalize_code(code: str, review_type: str, language=None) -> str:
+    """
+    Reduces code to the parts that affect the review: trailing whitespace
+    and blank lines are dropped, and for comment-insensitive review types
+    so are full-line comments, if the language is known.
+    """
+    code = code.replace("\r\n", "\n")
+    lines = code.split("\n")
+    comments = _comment_lines(code, lines, language) if review_type in COMMENT_INSENSITIVE_TYPES else set()
+    kept = []
+    for number, line in enumerate(lines, 1):
+        line = line.rstrip()
+        if line and number not in comments:
+            kept.append(line)
+    return "\n".join(kept)
+
+def make_key(code: str, review_type: str, prompt_version: str, model_name: str, language=None) -> str:
+    """Content-addressed key for a review request."""
+    material = json.dumps(
+        [prompt_version, model_name, review_type, language, normalize_code(code, review_type, language)]
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+# --- Persistent Tier ---
+
+def _connect():
+    # Pooled per thread, like the main database; never closed here.
+    return database.get_db_connection(CACHE_DATABASE_URL)
+
+def init_cache():
+    """Creates the cache table if it doesn't exist."""
+    if not CACHE_ENABLED:
+        return
+    try:
+        conn = _connect()
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS review_cache (
+            key TEXT PRIMARY KEY,
+            review_type TEXT NOT NULL,
+            content TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        );
+        """)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_review_cache_last_access ON review_cache (last_access)"
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Review cache initialization error: {e}")
+
+def _disk_get(key: str, now: float):
+    try:
+        conn = _connect()
+        row = conn.execute(
+            "SELECT content, expires_at FROM review_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        content, expires_at = row
+        with conn:
+            if expires_at <= now:
+                conn.execute("DELETE FROM review_cache WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE review_cache SET last_access = ? WHERE key = ?", (now, key))
+        return content, expires_at
+    except sqlite3.Error as e:
+        print(f"Review cache read error: {e}")
+        return None
+
+def _disk_put(key: str, review_type: str, content: str, expires_at: float, now: float):
+    try:
+        conn = _connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO review_cache (key, review_type, content, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, review_type, content, expires_at, now)
+            )
+            # Expired rows first, then the least recently used beyond the cap.
+            evicted = conn.execute("DELETE FROM review_cache WHERE expires_at <= ?", (now,)).rowcount
+            evicted += conn.execute(
+                "DELETE FROM review_cache WHERE key IN ("
+                "SELECT key FROM review_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (DISK_MAX_ENTRIES,)
+            ).rowcount
+        return evicted
+    except sqlite3.Error as e:
+        print(f"Review cache write error: {e}")
+        return 0
+
+
+# --- Public API ---
+#
+#  get and put touch SQLite on the calling thread, for sync callers.
+#  Async code uses get_async and put_async, which do the SQLite part on
+#  a DB thread (database.run_db) so the event loop never waits on it.
+#
+
+def get(key: str):
+    """Returns the cached review for key, or None on a miss."""
+    if not CACHE_ENABLED:
+        return None
+    now = time.time()
+    content = _memory_get(key, now)
+    if content is not None:
+        return content
+    return _disk_result(key, _disk_get(key, now))
+
+async def get_async(key: str):
+    """Async version of get."""
+    if not CACHE_ENABLED:
+        return None
+    now = time.time()
+    content = _memory_get(key, now)
+    if content is not None:
+        return content
+    return _disk_result(key, await database.run_db(_disk_get, key, now))
+
+def put(key: str, review_type: str, content: str):
+    """Stores a successful review in both tiers."""
+    if not CACHE_ENABLED:
+        return
+    now = time.time()
+    expires_at = _memory_store(key, content, now)
+    _count_evictions(_disk_put(key, review_type, content, expires_at, now))
+
+async def put_async(key: str, review_type: str, content: str):
+    """Async version of put."""
+    if not CACHE_ENABLED:
+        return
+    now = time.time()
+    expires_at = _memory_store(key, content, now)
+    _count_evictions(await database.run_db(_disk_put, key, review_type, content, expires_at, now))
+
+def _memory_get(key: str, now: float):
+    with _lock:
+        entry = _memory.get(key)
+        if entry is None:
+            return None
+        content, expires_at = entry
+        if expires_at > now:
+            _memory.move_to_end(key)
+            _stats["memory_hits"] += 1
+            return content
+        del _memory[key]
+        return None
+
+def _disk_result(key: str, entry):
+    # Counts a disk lookup and promotes a hit to the memory tier.
+    with _lock:
+        if entry is None:
+            _stats["misses"] += 1
+            return None
+        _stats["disk_hits"] += 1
+        _memory_put(key, entry)
+    return entry[0]
+
+def _memory_store(key: str, content: str, now: float) -> float:
+    # Returns the entry's expiry, for the disk tier.
+    expires_at = now + CACHE_TTL_SECONDS
+    with _lock:
+        _memory_put(key, (content, expires_at))
+        _stats["writes"] += 1
+    return expires_at
+
+def _count_evictions(evicted: int):
+    if evicted:
+        with _lock:
+            _stats["evictions"] += evicted
+
+def _memory_put(key: str, entry):
+    # Caller holds _lock.
+    _memory[key] = entry
+    _memory.move_to_end(key)
+    while len(_memory) > MEMORY_MAX_ENTRIES:
+        _memory.popitem(last=False)
+        _stats["evictions"] += 1
+
+def get_stats() -> dict:
+    """Hit/miss counters plus the current in-memory size."""
+    with _lock:
+        stats = dict(_stats)
+        stats["memory_entries"] = len(_memory)
+    lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+    stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+    return stats
+
+def clear_memory():
+    """Drops the in-process tier (the SQLite tier is left intact)."""
+    with _lock:
+        _memory.clear()
\ No newline at end of file
@@ -0,0 +1,119 @@
+import asyncio
+import os
+import sqlite3
+import time
+
+import database
+
+# --- Configuration ---
+#
+#  State that has to agree across worker processes when the API runs
+#  under gunicorn with several workers (see gunicorn.conf.py, which turns
+#  this on). It lives in a SQLite file in WAL mode next to
+#  code_reviewer.db, so readers never wait and each update is one
+#  statement on a pooled connection.
+#
+#  Kept here: per-user rate limit buckets and each worker's metrics
+#  (for GET /metrics). Daily usage counts go straight to usage_daily in
+#  this mode (see quotas), review results are already shared through
+#  the review cache's SQLite tier, and review jobs through their table.
+#
+#  With one process none of this is needed, and the in-memory versions
+#  are used.
+#
+SHARED_STATE_ENABLED = os.getenv("SHARED_STATE", "0") != "0"
+SHARED_STATE_DB = os.getenv("SHARED_STATE_DB", "shared_state.db")
+# How often each worker publishes its metrics. A worker that hasn't for
+# three intervals is taken to be gone.
+SHARED_METRICS_SECONDS = float(os.getenv("SHARED_METRICS_SECONDS", "5"))
+
+
+# --- Storage ---
+
+def _connect():
+    # Pooled per thread, like the main database; never closed here.
+    return database.get_db_connection(SHARED_STATE_DB)
+
+def init_shared_state():
+    """Creates the shared state tables if shared state is on and they don't exist."""
+    if not SHARED_STATE_ENABLED:
+        return
+    try:
+        conn = _connect()
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS rate_buckets (
+            key TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            admitted INTEGER NOT NULL
+        );
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS worker_metrics (
+            pid INTEGER PRIMARY KEY,
+            updated_at REAL NOT NULL,
+            body TEXT NOT NULL
+        );
+        """)
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Shared state initialization error: {e}")
+
+
+# --- Rate Limits ---
+
+def take_rate_token(key: str, rate: float, burst: float) -> float:
+    """
+    Takes one token from the bucket `key` (refilling at `rate` per second
+    up to `burst`). Returns 0 if it was taken, else the seconds until one
+    is available. One upsert, so workers can't both take the last token.
+    """
+    now = time.time()
+    conn = _connect()
+    with conn:
+        tokens, admitted = conn.execute(
+            "INSERT INTO rate_buckets (key, tokens, updated_at, admitted) VALUES (:key, :burst - 1, :now, 1) "
+            "ON CONFLICT (key) DO UPDATE SET "
+            "tokens = min(:burst, tokens + (:now - updated_at) * :rate) "
+            "         - (min(:burst, tokens + (:now - updated_at) * :rate) >= 1), "
+            "admitted = min(:burst, tokens + (:now - updated_at) * :rate) >= 1, "
+            "updated_at = :now "
+            "RETURNING tokens, admitted",
+            {"key": key, "burst": burst, "now": now, "rate": rate}
+        ).fetchone()
+    return 0.0 if admitted else (1 - tokens) / rate
+
+def prune_rate_buckets(idle_seconds: float):
+    """Drops buckets untouched for idle_seconds; by then they're full again."""
+    conn = _connect()
+    with conn:
+        conn.execute("DELETE FROM rate_buckets WHERE updated_at < ?", (time.time() - idle_seconds,))
+
+
+# --- Metrics ---
+
+def publish_metrics(body: str):
+    """Stores this worker's current metrics."""
+    conn = _connect()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO worker_metrics (pid, updated_at, body) VALUES (?, ?, ?)",
+            (os.getpid(), time.time(), body)
+        )
+
+def worker_metrics() -> list:
+    """(pid, metrics text) of every live worker, dropping those that stopped publishing."""
+    stale = time.time() - 3 * SHARED_METRICS_SECONDS
+    conn = _connect()
+    with conn:
+        conn.execute("DELETE FROM worker_metrics WHERE updated_at < ?", (stale,))
+    return [tuple(row) for row in conn.execute("SELECT pid, body FROM worker_metrics ORDER BY pid")]
+
+async def run_metrics_publisher(render):
+    """Publishes render() every SHARED_METRICS_SECONDS until cancelled."""
+    while True:
+        try:
+            await database.run_db(publish_metrics, render())
+        except sqlite3.Error as e:
+            print(f"Shared metrics write error: {e}")
+        await asyncio.sleep(SHARED_METRICS_SECONDS)
\ No newline at end of file
@@ -0,0 +1,437 @@
+import ast
+import asyncio
+import difflib
+import hashlib
+import os
+import re
+import sqlite3
+import struct
+import zlib
+from typing import List, NamedTuple, Optional
+
+import analysis
+import compaction
+import database
+import incremental
+import metrics
+
+# --- Configuration ---
+#
+#  Near-duplicate detection over a user's own review history. Many
+#  submissions are near-copies of code the same user had reviewed before
+#  (renamed variables, reformatted, a line changed), which the review
+#  cache's exact hash can't match. Reviews are never matched across users:
+#  a review quotes its code, and that code is the other user's.
+#
+#  Each reviewed file gets a MinHash signature of its token shingles, with
+#  identifiers normalized, and the signature is split into LSH bands. A
+#  band's hash is a bucket; files sharing a bucket are candidates, and the
+#  one whose signature agrees most is the match. The signatures and
+#  buckets are kept in code_reviewer.db next to the reviews they point to,
+#  so a lookup is a few primary key reads however large the history grows.
+#
+#  A match seeds an incremental review of any /review request, whether
+#  or not it asked for one: only the lines that differ go to the model,
+#  and the earlier review of the rest is carried over with its line
+#  numbers and (in code spans) its names updated. The signature ignores
+#  all names, but the lines are compared more strictly: only names the
+#  code binds itself (parameters, assignment targets, loop variables)
+#  may be renamed, and only one-to-one. A line that calls, imports or
+#  reads an attribute under another name has changed. If nothing differs
+#  but such renames and the spacing within lines, the earlier review is
+#  reused as it is. Indentation counts as a difference (see line_shape).
+#
+SIMILARITY_ENABLED = os.getenv("SIMILARITY_ENABLED", "1") != "0"
+# Estimated share of shingles two files must have in common to match.
+SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", "0.8"))
+# Past this share of differing lines, a seeded review is no cheaper to
+# read than a full one (stricter than for a user's own earlier version).
+SIMILARITY_MAX_CHANGED_FRACTION = float(os.getenv("SIMILARITY_MAX_CHANGED_FRACTION", "0.2"))
+# Shorter files look alike whatever they do; they're not indexed.
+SIMILARITY_MIN_TOKENS = int(os.getenv("SIMILARITY_MIN_TOKENS", "40"))
+
+SHINGLE_TOKENS = 5
+# 64 one-permutation MinHash values in 8 bands of 8: files that share 80%
+# of their shingles are candidates 97% of the time, files that share 50%
+# about 3% of the time.
+SIGNATURE_SIZE = 64
+BANDS = 8
+ROWS = SIGNATURE_SIZE // BANDS
+# Newest entries read per bucket; a bucket full of copies of the same
+# boilerplate doesn't make a lookup slower.
+BUCKET_READ_LIMIT = 8
+
+# Reused outright when nothing but names and layout differ. Refactors are
+# never reused: the answer is a full copy of someone else's code.
+SIMILARITY_TYPES = {"general", "documentation", "competitive", "explain"}
+# Also seeded when a few lines differ.
+SEED_TYPES = incremental.INCREMENTAL_TYPES
+
+# Strings never run past the end of a line, so a stray quote (a Rust
+# lifetime, a docstring's opening) can't swallow the rest of the file.
+_TOKEN = re.compile(r"[A-Za-z_$][\w$]*|\d[\w.]*|\"(?:\\.|[^\"\\\n])*\"|'(?:\\.|[^'\\\n])*'|\S")
+_IDENTIFIER = re.compile(r"[A-Za-z_$][\w$]*")
+
+# Kept as they are when identifiers are normalized: they carry the
+# structure that renaming variables doesn't change.
+_KEYWORDS = frozenset("""
+    and as assert async await break case catch class const continue def default del do elif else
+    enum except export extends false final finally fn for from func function global if impl import
+    in instanceof int interface is lambda let long match new nil none not null or package pass
+    private protected public raise return self static struct super switch this throw throws true
+    try type typeof use var void while with yield
+    True False None print len range str float bool list dict set tuple char double string
+""".split())
+
+_MASK = (1 << 64) - 1
+_BASE = 1000003
+_BASE_POW = pow(_BASE, SHINGLE_TOKENS - 1, 1 << 64)
+_SIGNATURE = struct.Struct(f"<{SIGNATURE_SIZE}I")
+_BAND = struct.Struct(f"<{ROWS}I")
+
+LOOKUPS = metrics.Counter(
+    "similarity_lookups_total", "Near-duplicate lookups by outcome.", ("outcome",)
+)
+
+
+class Match(NamedTuple):
+    review_id: int
+    code: str
+    result: str
+    similarity: float  # Estimated share of shingles in common.
+
+
+# --- Signatures ---
+
+def _normalize(token: str) -> str:
+    return "_" if _IDENTIFIER.fullmatch(token) and token not in _KEYWORDS else token
+
+def _token_hashes(code: str, language: Optional[str]) -> List[int]:
+    """A hash of each of the code's tokens, without comments and with identifiers normalized."""
+    lines = code.replace("\r\n", "\n").split("\n")
+    tokens = _TOKEN.findall("\n".join(line for _, line in compaction.compact_lines(lines, {"comments"}, language)))
+    # Each distinct token is normalized and hashed once.
+    hashes = {t: zlib.crc32(_normalize(t).encode("utf-8")) for t in set(tokens)}
+    return [hashes[t] for t in tokens]
+
+def signature(code: str, language: Optional[str] = None) -> Optional[tuple]:
+    """
+    The MinHash signature of the code's token shingles, or None if it's
+    too short to compare. One hash per shingle picks the slot (its low
+    bits) and the value (its high bits), so signing costs one pass.
+    """
+    token_hashes = _token_hashes(code, language)
+    if len(token_hashes) < max(SIMILARITY_MIN_TOKENS, SHINGLE_TOKENS):
+        return None
+    slots = [None] * SIGNATURE_SIZE
+    mask, base, base_pow, k = _MASK, _BASE, _BASE_POW, SHINGLE_TOKENS
+    h = 0
+    for i, t in enumerate(token_hashes):
+        # Rolling polynomial hash of the last k tokens.
+        if i >= k:
+            h -= token_hashes[i - k] * base_pow
+        h = (h * base + t) & mask
+        if i >= k - 1:
+            # splitmix64's finalizer spreads it over all 64 bits.
+            x = ((h ^ (h >> 30)) * 0xBF58476D1CE4E5B9) & mask
+            x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & mask
+            x ^= x >> 31
+            slot, value = x % SIGNATURE_SIZE, x >> 32
+            current = slots[slot]
+            if current is None or value < current:
+                slots[slot] = value
+    # Empty slots borrow from the next filled one, so short files still
+    # have a full signature (densified one-permutation hashing).
+    for i in range(SIGNATURE_SIZE):
+        if slots[i] is None:
+            j = 1
+            while slots[(i + j) % SIGNATURE_SIZE] is None:
+                j += 1
+            slots[i] = (slots[(i + j) % SIGNATURE_SIZE] + j * 0x9E3779B1) & 0xFFFFFFFF
+    return tuple(slots)
+
+def estimate(a: tuple, b: tuple) -> float:
+    """Estimated share of shingles two signatures' files have in common."""
+    return sum(x == y for x, y in zip(a, b)) / SIGNATURE_SIZE
+
+def buckets(sig: tuple, username: str, review_type: str, model: Optional[str]) -> List[int]:
+    """The LSH bucket of each band. Reviews by another user, or of another type or model, never share one."""
+    prefix = f"{username}\0{model}\0{review_type}\0".encode("utf-8")
+    keys = []
+    for band in range(BANDS):
+        material = prefix + bytes([band]) + _BAND.pack(*sig[band * ROWS:(band + 1) * ROWS])
+        digest = hashlib.blake2b(material, digest_size=8).digest()
+        keys.append(int.from_bytes(digest, "little", signed=True))
+    return keys
+
+
+# --- Storage ---
+
+def init_similarity():
+    """Creates the signature and bucket tables if they don't exist."""
+    try:
+        conn = database.get_db_connection()
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS similarity_signatures (
+            review_id INTEGER PRIMARY KEY,
+            signature BLOB NOT NULL
+        );
+        """)
+        # The primary key is the lookup index: one range read per band.
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS similarity_buckets (
+            bucket INTEGER NOT NULL,
+            review_id INTEGER NOT NULL,
+            PRIMARY KEY (bucket, review_id)
+        ) WITHOUT ROWID;
+        """)
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Similarity index initialization error: {e}")
+
+def _candidates(conn, keys) -> dict:
+    """review id -> signature for the newest entries of each bucket."""
+    ids = set()
+    for key in keys:
+        ids.update(row[0] for row in conn.execute(
+            "SELECT review_id FROM similarity_buckets WHERE bucket = ? ORDER BY review_id DESC LIMIT ?",
+            (key, BUCKET_READ_LIMIT)
+        ))
+    if not ids:
+        return {}
+    rows = conn.execute(
+        f"SELECT review_id, signature FROM similarity_signatures WHERE review_id IN ({','.join('?' * len(ids))})",
+        tuple(ids)
+    ).fetchall()
+    return {review_id: _SIGNATURE.unpack(blob) for review_id, blob in rows}
+
+def review_signature(code: str, review_type: str, language=None) -> Optional[tuple]:
+    """The signature to index a review of code under, or None if it isn't indexed."""
+    if not SIMILARITY_ENABLED or review_type not in SIMILARITY_TYPES:
+        return None
+    return signature(code, language)
+
+def index_review(conn, review_id: int, sig: Optional[tuple], username: str, review_type: str, model=None):
+    """
+    Adds a stored review to the index, in the caller's transaction. Skips
+    it if the same signature is already indexed: the earlier review
+    serves for it.
+    """
+    if sig is None:
+        return
+    keys = buckets(sig, username, review_type, model)
+    if sig in _candidates(conn, keys[:1]).values():
+        return
+    conn.execute(
+        "INSERT OR REPLACE INTO similarity_signatures (review_id, signature) VALUES (?, ?)",
+        (review_id, _SIGNATURE.pack(*sig))
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO similarity_buckets (bucket, review_id) VALUES (?, ?)",
+        [(key, review_id) for key in keys]
+    )
+
+def nearest(sig: tuple, username: str, review_type: str, model=None):
+    """(review id, estimated similarity) of the user's closest indexed review, or None below the threshold."""
+    candidates = _candidates(database.get_db_connection(), buckets(sig, username, review_type, model))
+    if not candidates:
+        return None
+    # Most similar first, then newest.
+    best, best_id = max((estimate(sig, other), review_id) for review_id, other in candidates.items())
+    return (best_id, best) if best >= SIMILARITY_THRESHOLD else None
+
+def find_similar(code: str, username: str, review_type: str, language=None, model=None) -> Optional[Match]:
+    """The user's most similar indexed review of the same type and model, if any is similar enough."""
+    sig = signature(code, language)
+    return None if sig is None else find_match(sig, username, review_type, model)
+
+def find_match(sig: tuple, username: str, review_type: str, model=None) -> Optional[Match]:
+    """find_similar for code that's already signed."""
+    with metrics.time_stage("similarity_lookup"):
+        found = nearest(sig, username, review_type, model)
+        if found is None:
+            return None
+        # The buckets are per user already; checked again so an index
+        # entry can never hand out another user's review.
+        row = database.get_db_connection().execute(
+            "SELECT code, result FROM reviews WHERE id = ? AND username = ?", (found[0], username)
+        ).fetchone()
+    if row is None:
+        return None
+    return Match(found[0], row["code"], row["result"], found[1])
+
+
+# --- Seeding ---
+
+# Words before a name that declare it, outside Python: "let x", "int x".
+_DECLARING = frozenset("let const var for auto final int long char double float bool string".split())
+
+def _python_local_names(tree) -> set:
+    bound, fixed = set(), set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+            bound.add(node.id)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            bound.add(node.name)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            fixed.update((alias.asname or alias.name).split(".")[0] for alias in node.names)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            fixed.add(node.name)  # Called or subclassed elsewhere under that name.
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            fixed.update(node.names)
+    return bound - fixed
+
+def _declared_names(code: str) -> set:
+    # Names assigned ("x = ") or declared ("let x", "int x,", "for x in")
+    # in other languages. Misses some, which only means fewer renames are accepted.
+    tokens = _TOKEN.findall(code)
+    bound = set()
+    for i, token in enumerate(tokens):
+        if not _IDENTIFIER.fullmatch(token) or token in _KEYWORDS or (i and tokens[i - 1] == "."):
+            continue
+        following = tokens[i + 1:i + 3]
+        if following[:1] == ["="] and following[1:] not in (["="], [">"]):
+            bound.add(token)
+        elif i and tokens[i - 1] in _DECLARING and following[:1] in ([","], [")"], [";"], ["="], [":"], ["in"], ["of"]):
+            bound.add(token)
+    return bound
+
+def local_names(code: str, language: Optional[str] = None) -> frozenset:
+    """
+    Names the code binds itself: parameters, assignment targets, loop and
+    exception variables. Imported names, functions and classes it defines
+    and names it only uses are not included.
+    """
+    names = None
+    if language in (None, "python"):
+        try:
+            names = _python_local_names(ast.parse(code.replace("\r\n", "\n")))
+        except (SyntaxError, ValueError):
+            pass
+    if names is None:
+        names = _declared_names(code)
+    return frozenset(names - _KEYWORDS)
+
+def _line_tokens(line: str, local=frozenset()):
+    """(token, is a local name) for each token of a line. Attribute names never are."""
+    tokens = _TOKEN.findall(line)
+    return [(t, t in local and (i == 0 or tokens[i - 1] != ".")) for i, t in enumerate(tokens)]
+
+def line_shape(line: str, local=frozenset()) -> str:
+    """
+    A line with the spacing between its tokens, and the names in local,
+    normalized away. Indentation is kept: in Python it decides which
+    block a line belongs to, so a re-indented line counts as changed.
+    """
+    tokens = _line_tokens(line, local)
+    if not tokens:
+        return ""
+    indent = line[:len(line) - len(line.lstrip())]
+    return indent + " ".join("_" if is_local else t for t, is_local in tokens)
+
+def _renames(old_code: str, new_code: str, old_local=frozenset(), new_local=frozenset()) -> dict:
+    """
+    Local names renamed one-to-one between lines that only differ by
+    local names. A name renamed inconsistently, or to a name that
+    something else already has, isn't a rename.
+    """
+    old = old_code.replace("\r\n", "\n").split("\n")
+    new = new_code.replace("\r\n", "\n").split("\n")
+    local = old_local | new_local
+    matcher = difflib.SequenceMatcher(None, [line_shape(l, local) for l in old], [line_shape(l, local) for l in new])
+    forward, backward = {}, {}
+    for a, b, size in matcher.get_matching_blocks():
+        for i in range(size):
+            pairs = zip(_line_tokens(old[a + i], local), _line_tokens(new[b + i], local))
+            for (x, is_local), (y, _) in pairs:
+                if is_local:
+                    forward.setdefault(x, set()).add(y)
+                    backward.setdefault(y, set()).add(x)
+    return {
+        x: y for x, (y,) in ((x, ys) for x, ys in forward.items() if len(ys) == 1)
+        if x != y and backward[y] == {x} and x in old_local and y in new_local
+    }
+
+def _rename_code(code: str, renames: dict) -> str:
+    """The code with renamed local names replaced (outside strings and attributes)."""
+    if not renames:
+        return code
+    lines = []
+    for line in code.replace("\r\n", "\n").split("\n"):
+        parts, end, previous = [], 0, ""
+        for match in _TOKEN.finditer(line):
+            token = match.group(0)
+            if token in renames and previous != ".":
+                parts.append(line[end:match.start()] + renames[token])
+                end = match.end()
+            previous = token
+        lines.append("".join(parts) + line[end:])
+    return "\n".join(lines)
+
+# Inline code spans and fenced blocks: names are only replaced in there,
+# so a variable called "a" doesn't rename the article.
+_CODE_SPAN = re.compile(r"(```.*?```|`[^`\n]+`)", re.DOTALL)
+
+def apply_renames(review: str, renames: dict) -> str:
+    """The review with renamed identifiers updated in its code spans."""
+    if not renames:
+        return review
+    names = re.compile(r"(?<![\w$])(" + "|".join(map(re.escape, sorted(renames, key=len, reverse=True))) + r")(?![\w$])")
+    parts = _CODE_SPAN.split(review)
+    for i in range(1, len(parts), 2):
+        parts[i] = names.sub(lambda m: renames[m.group(1)], parts[i])
+    return "".join(parts)
+
+def plan_from_match(match: Match, code: str, language=None) -> Optional[incremental.EditPlan]:
+    """
+    An incremental review plan for code, built on the review of a similar
+    file. Lines are compared after the renames; any other difference in
+    names is a changed line for the model to review.
+    """
+    renames = _renames(match.code, code, local_names(match.code, language), local_names(code, language))
+    plan = incremental.plan_edits(
+        _rename_code(match.code, renames), code, match.result, SIMILARITY_MAX_CHANGED_FRACTION,
+        normalize=line_shape
+    )
+    if plan is None:
+        return None
+    return plan._replace(previous=apply_renames(plan.previous, renames), similar=True)
+
+
+# --- API ---
+
+async def prepare(username: str, code: str, review_type: str, language=None,
+                  model=None) -> Optional[incremental.EditPlan]:
+    """
+    A plan for reviewing code on top of the user's review of a
+    near-duplicate, or None if there's none or too much differs.
+    """
+    if not SIMILARITY_ENABLED or review_type not in SIMILARITY_TYPES:
+        return None
+    if (await analysis.analyze_async(code, review_type, language)).answer is not None:
+        return None
+    # Signing and diffing a long file take milliseconds of CPU; keep them
+    # off the event loop. Short code is signed inline, and most snippets are
+    # too short to be indexed at all.
+    loop = asyncio.get_running_loop()
+    if len(code) < analysis.ANALYSIS_INLINE_CHARS:
+        sig = signature(code, language)
+    else:
+        sig = await loop.run_in_executor(None, signature, code, language)
+    if sig is None:
+        return None
+    match = await database.run_db(find_match, sig, username, review_type, model)
+    if match is None:
+        LOOKUPS.labels("miss").inc()
+        return None
+    if (await analysis.analyze_async(match.code, review_type, language)).answer is not None:
+        LOOKUPS.labels("miss").inc()
+        return None
+    plan = await loop.run_in_executor(None, plan_from_match, match, code, language)
+    if plan is None or (plan.changes and review_type not in SEED_TYPES):
+        LOOKUPS.labels("too_different").inc()
+        return None
+    LOOKUPS.labels("reused" if not plan.changes else "seeded").inc()
+    return plan
\ No newline at end of file
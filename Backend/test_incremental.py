@@ -0,0 +1,36 @@
+import gemini_client  # noqa: F401  (imported first: incremental and similarity import each other through it)
+import incremental
+
+BASE = "\n".join(f"value_{i} = compute({i})" for i in range(40))
+
+
+def edit(code, line, text):
+    lines = code.split("\n")
+    lines[line - 1] = text
+    return "\n".join(lines)
+
+
+def test_three_edits_in_a_row_keep_every_review():
+    full_review = "Line 30 repeats the call on line 31."
+    first = edit(BASE, 5, "value_4 = compute(4) + 1")
+    plan = incremental.plan_edits(BASE, first, full_review)
+    assert plan is not None and plan.regions == [(5, 5)]
+    first_review = incremental.merge(plan, "First edit looks fine.")
+
+    second = edit(first, 20, "value_19 = compute(19) * 2")
+    plan = incremental.plan_edits(first, second, first_review)
+    assert plan is not None and plan.regions == [(20, 20)]
+    second_review = incremental.merge(plan, "Second edit doubles the value.")
+    # Nothing reviewed so far is dropped.
+    for text in (full_review, "First edit looks fine.", "Second edit doubles the value."):
+        assert text in second_review
+
+    # A third level would have to drop the first edit's review: full review instead.
+    third = edit(second, 35, "value_34 = compute(34) - 1")
+    assert incremental.plan_edits(second, third, second_review) is None
+
+
+def test_full_review_resets_the_nesting():
+    first = edit(BASE, 5, "value_4 = compute(4) + 1")
+    merged = incremental.merge(incremental.plan_edits(BASE, first, "Full review."), "Edit review.")
+    assert incremental.plan_edits(first, edit(first, 9, "pass"), merged) is not None
\ No newline at end of file
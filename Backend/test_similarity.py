@@ -0,0 +1,47 @@
+import gemini_client  # noqa: F401  (imported first: incremental and similarity import each other through it)
+import similarity
+
+CODE = """import math
+
+
+def summarize(data, scale):
+    ordered = sorted(data)
+    total = 0
+    for value in ordered:
+        total += value * scale
+    return total / math.sqrt(len(ordered))
+"""
+REVIEW = "Line 5 sorts a copy: `ordered = sorted(data)`. Line 8 accumulates into `total`."
+
+
+def plan(code):
+    return similarity.plan_from_match(similarity.Match(1, CODE, REVIEW, 1.0), code, "python")
+
+
+def test_local_names():
+    assert similarity.local_names(CODE, "python") == {"data", "scale", "ordered", "total", "value"}
+
+
+def test_renamed_locals_reuse_the_review():
+    renamed = CODE.replace("total", "acc").replace("ordered", "items")
+    result = plan(renamed)
+    assert result is not None and result.changes == ""
+    assert "`items = sorted(data)`" in result.previous and "`acc`" in result.previous
+
+
+def test_changed_callee_goes_to_the_model():
+    result = plan(CODE.replace("sorted(data)", "reversed(data)"))
+    assert result is not None and result.regions == [(5, 5)]
+    assert "reversed(data)" in result.changes
+
+
+def test_changed_attribute_goes_to_the_model():
+    result = plan(CODE.replace("math.sqrt", "math.log"))
+    assert result is not None and "math.log" in result.changes
+
+
+def test_merged_locals_are_not_a_rename():
+    # scale becomes data, which is already a name: not one-to-one.
+    result = plan(CODE.replace("scale", "data"))
+    assert result is not None
+    assert "+ | def summarize(data, data):" in result.changes and "+ |         total += value * data" in result.changes
\ No newline at end of file
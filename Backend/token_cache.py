@@ -0,0 +1,70 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# --- Configuration ---
+#
+#  Maps a raw bearer token to the User it was validated as, so repeat
+#  requests skip both the JWT decode and the database lookup. An entry
+#  never outlives the token's own "exp" claim, if it has one.
+#
+TOKEN_CACHE_ENABLED = os.getenv("TOKEN_CACHE_ENABLED", "1") != "0"
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "10000"))
+TOKEN_CACHE_TTL_SECONDS = int(os.getenv("TOKEN_CACHE_TTL_SECONDS", "300"))
+
+_entries = OrderedDict()   # token -> (user, username, expires_at)
+_tokens_by_user = {}       # username -> set of cached tokens
+_lock = threading.Lock()
+
+
+def get(token: str):
+    """Returns the cached User for token, or None."""
+    if not TOKEN_CACHE_ENABLED:
+        return None
+    with _lock:
+        entry = _entries.get(token)
+        if entry is None:
+            return None
+        user, username, expires_at = entry
+        if expires_at <= time.time():
+            _remove(token)
+            return None
+        _entries.move_to_end(token)
+        return user
+
+def put(token: str, user, username: str, token_exp=None):
+    """Caches a validated token until min(now + TTL, token_exp); token_exp is None for a token without one."""
+    if not TOKEN_CACHE_ENABLED:
+        return
+    expires_at = time.time() + TOKEN_CACHE_TTL_SECONDS
+    if token_exp is not None:
+        expires_at = min(expires_at, token_exp)
+    with _lock:
+        _entries[token] = (user, username, expires_at)
+        _entries.move_to_end(token)
+        _tokens_by_user.setdefault(username, set()).add(token)
+        while len(_entries) > TOKEN_CACHE_MAX_ENTRIES:
+            _remove(next(iter(_entries)))
+
+def invalidate_user(username: str):
+    """Drops every cached token for a user whose record changed."""
+    with _lock:
+        for token in list(_tokens_by_user.get(username, ())):
+            _remove(token)
+
+def clear():
+    with _lock:
+        _entries.clear()
+        _tokens_by_user.clear()
+
+def _remove(token: str):
+    # Caller holds _lock.
+    entry = _entries.pop(token, None)
+    if entry is None:
+        return
+    tokens = _tokens_by_user.get(entry[1])
+    if tokens is not None:
+        tokens.discard(token)
+        if not tokens:
+            del _tokens_by_user[entry[1]]
\ No newline at end of file
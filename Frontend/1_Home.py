@@ -10,11 +10,15 @@ st.set_page_config(
 )
 
 # --- CSS Loader ---
+@st.cache_data(show_spinner=False)
+def read_css(css_path):
+    with open(css_path) as f:
+        return f.read()
+
 def load_css(file_name):
     try:
         css_path = Path(__file__).parent / file_name
-        with open(css_path) as f:
-            st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+        st.markdown(f"<style>{read_css(str(css_path))}</style>", unsafe_allow_html=True)
     except FileNotFoundError:
         pass
 
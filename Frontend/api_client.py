@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# --- Configuration ---
+#
+#  One pooled requests.Session per Streamlit server process, shared by
+#  every page and user session (st.cache_resource), so calls reuse
+#  keep-alive connections instead of a new TCP+TLS handshake each time.
+#  The bearer token is passed per call, never stored on the session.
+#
+API_BASE_URL = os.getenv("API_URL", "https://codesense-ai-your-ai-powered-code.onrender.com")
+API_CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", "5"))
+# Longest wait for the next bytes of a response. Streams send the first
+# chunk only once the model answers, so this is generous.
+API_READ_TIMEOUT = float(os.getenv("API_READ_TIMEOUT", "120"))
+API_RETRIES = int(os.getenv("API_RETRIES", "3"))
+API_POOL_SIZE = 20
+
+# Finished reviews kept per browser session, by code hash + review type.
+RESULT_CACHE_SIZE = 32
+# A Gist fetched this recently is used as is; after that it is
+# revalidated with its ETag.
+GIST_FRESH_SECONDS = 60
+GIST_CACHE_SIZE = 64
+
+
+class StreamError(Exception):
+    """Raised when a backend endpoint rejects the request."""
+    def __init__(self, status_code, text):
+        super().__init__(text)
+        self.status_code = status_code
+
+
+# --- Session ---
+
+@st.cache_resource(show_spinner=False)
+def get_session() -> requests.Session:
+    """The shared HTTP session, created on first use."""
+    session = requests.Session()
+    # Connection failures are retried for every method (nothing was sent
+    # yet); 502/503/504 answers only for requests that are safe to repeat,
+    # so a review is never run or charged twice.
+    retry = Retry(
+        total=API_RETRIES,
+        connect=API_RETRIES,
+        read=0,
+        status=API_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD", "PUT"}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=API_POOL_SIZE, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def _headers(token=None, extra=None) -> dict:
+    headers = dict(extra or {})
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    return headers
+
+def request(method: str, path: str, token=None, headers=None, **kwargs) -> requests.Response:
+    """A call to the backend through the shared session, with timeouts."""
+    kwargs.setdefault("timeout", (API_CONNECT_TIMEOUT, API_READ_TIMEOUT))
+    return get_session().request(method, f"{API_BASE_URL}{path}", headers=_headers(token, headers), **kwargs)
+
+def error_detail(response) -> str:
+    """The "detail" message of an error response, or its raw text."""
+    try:
+        return response.json().get("detail", response.text)
+    except ValueError:
+        return response.text
+
+def stream_events(path: str, payload: dict, token: str):
+    """Yields (event, text) pairs from one of the backend's /stream endpoints."""
+    with request("POST", path, token, {"Accept": "text/event-stream"}, json=payload, stream=True) as response:
+        if response.status_code != 200:
+            raise StreamError(response.status_code, error_detail(response))
+        event = "message"
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                yield event, json.loads(line[len("data:"):])["text"]
+
+
+# --- Review Results ---
+#
+#  Kept in st.session_state, so they never leak between users. Asking
+#  again for a review of the same code shows it without a request.
+#
+
+def _result_key(code: str, review_type: str, language) -> str:
+    return f"{hashlib.sha256(code.encode('utf-8')).hexdigest()}:{review_type}:{language}"
+
+def cached_review(code: str, review_type: str, language=None):
+    """This browser session's earlier review of exactly this code, or None."""
+    results = st.session_state.get("review_results")
+    if not results:
+        return None
+    key = _result_key(code, review_type, language)
+    if key not in results:
+        return None
+    results.move_to_end(key)
+    return results[key]
+
+def remember_review(code: str, review_type: str, language, content: str):
+    results = st.session_state.setdefault("review_results", OrderedDict())
+    results[_result_key(code, review_type, language)] = content
+    while len(results) > RESULT_CACHE_SIZE:
+        results.popitem(last=False)
+
+
+# --- Gists ---
+
+@st.cache_resource(show_spinner=False)
+def _gist_cache():
+    # raw URL -> (fetched at, ETag, text). Gists are public, so one cache
+    # serves everyone.
+    return OrderedDict(), threading.Lock()
+
+def fetch_gist_text(raw_url: str):
+    """(text, error) for a Gist's raw URL, revalidated with its ETag when cached."""
+    cache, lock = _gist_cache()
+    with lock:
+        entry = cache.get(raw_url)
+    if entry is not None and time.time() - entry[0] < GIST_FRESH_SECONDS:
+        return entry[2], None
+    headers = {"If-None-Match": entry[1]} if entry is not None and entry[1] else {}
+    response = get_session().get(raw_url, headers=headers, timeout=(API_CONNECT_TIMEOUT, 30))
+    if response.status_code == 304 and entry is not None:
+        text, etag = entry[2], entry[1]
+    elif response.status_code == 200:
+        text, etag = response.text, response.headers.get("ETag")
+    else:
+        return None, f"Failed to fetch. Status: {response.status_code}"
+    with lock:
+        cache[raw_url] = (time.time(), etag, text)
+        cache.move_to_end(raw_url)
+        while len(cache) > GIST_CACHE_SIZE:
+            cache.popitem(last=False)
+    return text, None
\ No newline at end of file
@@ -1,7 +1,7 @@
 import streamlit as st
 import requests
-import os
 from pathlib import Path
+import api_client
 
 # --- Page Configuration ---
 st.set_page_config(
@@ -10,15 +10,16 @@ st.set_page_config(
     layout="centered"
 )
 
-# --- API Base URL ---
-API_BASE_URL = os.getenv("API_URL", "https://codesense-ai-your-ai-powered-code.onrender.com")
-
 # --- CSS Loader ---
+@st.cache_data(show_spinner=False)
+def read_css(css_path):
+    with open(css_path) as f:
+        return f.read()
+
 def load_css(file_name):
     try:
         css_path = Path(__file__).parent.parent / file_name
-        with open(css_path) as f:
-            st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+        st.markdown(f"<style>{read_css(str(css_path))}</style>", unsafe_allow_html=True)
     except FileNotFoundError:
         pass
 
@@ -33,8 +34,8 @@ st.markdown("Welcome back to **CodeSense-AI**.")
 def handle_login(username, password):
     """Attempts to log in via the API and redirects on success."""
     try:
-        response = requests.post(
-            f"{API_BASE_URL}/token",
+        response = api_client.request(
+            "POST", "/token",
             data={"username": username, "password": password}
         )
         
@@ -70,8 +71,8 @@ def handle_register(username, password, confirm_password):
         return
         
     try:
-        response = requests.post(
-            f"{API_BASE_URL}/register",
+        response = api_client.request(
+            "POST", "/register",
             json={"username": username, "password": password}
         )
         if response.status_code == 200:
@@ -1,7 +1,12 @@
 import streamlit as st
 import requests
+import json
+import hashlib
 from streamlit_ace import st_ace
+import api_client
+from api_client import StreamError, error_detail
 import os
+import time
 from pathlib import Path
 
 # --- Handle Optional Dependency ---
@@ -18,15 +23,21 @@ st.set_page_config(
     layout="wide"
 )
 
-# --- API Base URL ---
-API_BASE_URL = os.getenv("API_URL", "https://codesense-ai-your-ai-powered-code.onrender.com")
+# Files longer than this are reviewed as a background job (polled) rather
+# than over one long streaming connection. Matches the backend's default.
+LARGE_INPUT_LINES = int(os.getenv("LARGE_INPUT_LINES", "400"))
+JOB_POLL_SECONDS = 1.5
 
 # --- CSS Loader ---
+@st.cache_data(show_spinner=False)
+def read_css(css_path):
+    with open(css_path) as f:
+        return f.read()
+
 def load_css(file_name):
     try:
         css_path = Path(__file__).parent.parent / file_name
-        with open(css_path) as f:
-            st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+        st.markdown(f"<style>{read_css(str(css_path))}</style>", unsafe_allow_html=True)
     except FileNotFoundError:
         pass
 
@@ -53,27 +64,122 @@ def fetch_gist(gist_url):
         raw_url = gist_url
         
     try:
-        response = requests.get(raw_url)
-        if response.status_code == 200:
-            return response.text, None
-        else:
-            return None, f"Failed to fetch. Status: {response.status_code}"
+        return api_client.fetch_gist_text(raw_url)
     except Exception as e:
         return None, f"Error: {e}"
 
+# --- Helper: Server-Sent Events ---
+def stream_text(path, payload, result):
+    """
+    Feeds "chunk" text to st.write_stream. The final assembled text (from
+    the "done" event) is stored in result["content"]; an "error" event is
+    stored in result["error"].
+    """
+    for event, text in api_client.stream_events(path, payload, st.session_state["token"]):
+        if event == "chunk":
+            yield text
+        elif event == "done":
+            result["content"] = text
+        elif event == "error":
+            result["error"] = text
+
+# --- Helper: Review Jobs ---
+def run_review_job(payload):
+    """
+    Queues a review job and polls it until it finishes, showing progress.
+    Returns (content, error).
+    """
+    token = st.session_state["token"]
+    response = api_client.request("POST", "/review/jobs", token, json=payload)
+    if response.status_code != 202:
+        raise StreamError(response.status_code, error_detail(response))
+    job_id = response.json()["job_id"]
+
+    started = time.time()
+    with st.status("Reviewing a large file in parts...") as status_box:
+        while True:
+            time.sleep(JOB_POLL_SECONDS)
+            response = api_client.request("GET", f"/review/jobs/{job_id}", token)
+            if response.status_code != 200:
+                raise StreamError(response.status_code, error_detail(response))
+            job = response.json()
+            if job["status"] == "done":
+                status_box.update(label="Review complete", state="complete")
+                return job["review_content"], None
+            if job["status"] == "failed":
+                status_box.update(label="Review failed", state="error")
+                return None, job["error"]
+            status_box.update(label=f"Reviewing a large file in parts... ({job['status']}, {int(time.time() - started)}s)")
+
+# --- Helper: Review History ---
+@st.cache_data(ttl=60, show_spinner=False)
+def fetch_history(token, query=""):
+    """The user's recent reviews (newest first), or those matching a search."""
+    if query:
+        response = api_client.request("GET", "/reviews/search", token, params={"q": query})
+    else:
+        response = api_client.request("GET", "/reviews", token)
+    if response.status_code != 200:
+        raise StreamError(response.status_code, error_detail(response))
+    return response.json()["reviews"]
+
+def load_past_review(review_id):
+    """Puts a past review and its code back on screen, without a new model call."""
+    response = api_client.request("GET", f"/reviews/{review_id}", st.session_state["token"])
+    if response.status_code != 200:
+        raise StreamError(response.status_code, error_detail(response))
+    review = response.json()
+    api_client.remember_review(review["code"], review["review_type"], review["language"], review["review_content"])
+    st.session_state.editor_code = review["code"]
+    st.session_state.editor_path = review["path"]
+    st.session_state.review_result = review["review_content"]
+    st.session_state.last_review_type = review["review_type"]
+
+# --- Helper: Chat Session ---
+def chat_context(language):
+    """What the chat is about: the code in the editor and its latest review."""
+    return {
+        "code": st.session_state.editor_code or None,
+        "language": language,
+        "path": st.session_state.get("editor_path"),
+        "review": st.session_state.get("review_result"),
+    }
+
+def chat_session_id(context):
+    """
+    This page's server-side chat session, started on first use. The code
+    and review are only sent again when they've changed since.
+    """
+    token = st.session_state["token"]
+    fingerprint = hashlib.sha256(json.dumps(context, sort_keys=True).encode("utf-8")).hexdigest()
+    session = st.session_state.get("chat_session")
+    if session is not None and session["context"] == fingerprint:
+        return session["id"]
+    if session is not None:
+        response = api_client.request("PUT", f"/chat/sessions/{session['id']}/context", token, json=context)
+        if response.status_code == 404:
+            # Expired on the server: start over with a new one.
+            del st.session_state["chat_session"]
+            return chat_session_id(context)
+    else:
+        response = api_client.request("POST", "/chat/sessions", token, json=context)
+    if response.status_code not in (200, 201):
+        raise StreamError(response.status_code, error_detail(response))
+    st.session_state.chat_session = {"id": response.json()["session_id"], "context": fingerprint}
+    return st.session_state.chat_session["id"]
+
 # --- Page Title ---
 st.title("🤖 AI Code Reviewer")
 st.markdown("Paste your code, upload a file, or import from GitHub Gist.")
 
-# --- UI Layout (2 Columns) ---
-col1, col2 = st.columns([1, 1])
-
-with col1:
-    st.subheader("Input Code")
-
+# --- Import Panel ---
+# A fragment: picking a file or typing a URL reruns only this panel. Loading
+# code into the editor reruns the page.
+@st.fragment
+def import_panel():
     with st.expander("📂 Import Code (File or Gist)", expanded=False):
         tab_file, tab_gist = st.tabs(["📄 Upload File", "🔗 GitHub Gist"])
-        
+
         with tab_file:
             uploaded_file = st.file_uploader("Choose a code file", type=["py", "js", "java", "cpp", "c", "html", "css", "sql", "md", "txt"])
             if uploaded_file is not None:
@@ -81,6 +187,7 @@ with col1:
                     try:
                         string_data = uploaded_file.getvalue().decode("utf-8")
                         st.session_state.editor_code = string_data
+                        st.session_state.editor_path = uploaded_file.name
                         st.success("File loaded into editor!")
                         st.rerun()
                     except Exception as e:
@@ -93,6 +200,7 @@ with col1:
                     content, error = fetch_gist(gist_url)
                     if content:
                         st.session_state.editor_code = content
+                        st.session_state.editor_path = None
                         st.success("Gist loaded into editor!")
                         st.rerun()
                     else:
@@ -100,138 +208,222 @@ with col1:
                 else:
                     st.warning("Please enter a URL.")
 
-    languages = [
-        "python", "javascript", "java", "c_cpp", "csharp", "go", "ruby", "swift",
-        "typescript", "php", "sql", "html", "css", "json", "yaml", "markdown"
-    ]
+# --- Reviewer ---
+# A fragment: editing, choosing options and reviewing rerun only the editor
+# and the output, not the sidebar or the chat.
+@st.fragment(key="reviewer")
+def reviewer():
+    # --- UI Layout (2 Columns) ---
+    col1, col2 = st.columns([1, 1])
+
+    with col1:
+        st.subheader("Input Code")
+
+        import_panel()
+
+        languages = [
+            "python", "javascript", "java", "c_cpp", "csharp", "go", "ruby", "swift",
+            "typescript", "php", "sql", "html", "css", "json", "yaml", "markdown"
+        ]
     
-    selected_language = st.selectbox("Language", options=languages, index=languages.index("python"))
+        selected_language = st.selectbox("Language", options=languages, index=languages.index("python"), key="language")
     
-    code = st_ace(
-        value=st.session_state.editor_code, 
-        language=selected_language,
-        theme="tomorrow_night_blue",
-        keybinding="vscode",
-        font_size=14,
-        height=400,
-        show_gutter=True,
-        show_print_margin=False,
-        wrap=True,
-    )
+        code = st_ace(
+            value=st.session_state.editor_code, 
+            language=selected_language,
+            theme="tomorrow_night_blue",
+            keybinding="vscode",
+            font_size=14,
+            height=400,
+            show_gutter=True,
+            show_print_margin=False,
+            wrap=True,
+        )
     
-    if code != st.session_state.editor_code:
-        st.session_state.editor_code = code
-
-    # MODIFICATION: Added "Explain This Code" to the list
-    review_type = st.selectbox(
-        "Review Type",
-        options=[
-            ("General Purpose Review", "general"),
-            ("Code Documentation Review", "documentation"),
-            ("Competitive Programming (Time/Space)", "competitive"),
-            ("Explain This Code", "explain")
-        ],
-        format_func=lambda x: x[0]
-    )
+        if code != st.session_state.editor_code:
+            st.session_state.editor_code = code
+
+        # MODIFICATION: Added "Explain This Code" to the list
+        review_type = st.selectbox(
+            "Review Type",
+            options=[
+                ("General Purpose Review", "general"),
+                ("Code Documentation Review", "documentation"),
+                ("Competitive Programming (Time/Space)", "competitive"),
+                ("Explain This Code", "explain")
+            ],
+            format_func=lambda x: x[0]
+        )
     
-    submit_button = st.button("🚀 Get AI Review")
-
-# --- API Call and Review Display ---
-with col2:
-    if submit_button:
-        if not code:
-            st.warning("Please paste or import some code first.")
-        else:
-            with st.spinner("AI is analyzing your code..."):
+        # Only for a named file (uploaded, or reopened from a past review):
+        # unnamed code would be diffed against whatever was reviewed last.
+        editor_path = st.session_state.get("editor_path")
+        only_edits = st.checkbox(
+            "Only re-review my edits",
+            value=bool(editor_path),
+            disabled=not editor_path,
+            help="If you've had this file reviewed before, send just the changed lines and keep the rest of the earlier review. "
+                 "Available for uploaded files and reopened reviews.",
+        )
+
+        # Reruns the history sidebar too, after the review, so a new review is listed.
+        submit_button = st.button("🚀 Get AI Review", on_click=st.rerun, args=(["reviewer", "past_reviews"],))
+
+    # --- API Call and Review Display ---
+    with col2:
+        output_rendered = False
+        if submit_button:
+            if not code:
+                st.warning("Please paste or import some code first.")
+            else:
+                selected_type_key = review_type[1]
+                payload = {
+                    "code": code,
+                    "review_type": selected_type_key,
+                    "language": selected_language,
+                    "path": st.session_state.get("editor_path"),
+                    "incremental": only_edits,
+                }
+                result = {}
+
+                st.subheader("🤖 AI Output")
+                output_rendered = True
                 try:
-                    headers = {"Authorization": f"Bearer {st.session_state['token']}"}
-                    selected_type_key = review_type[1]
-                    
-                    payload = {
-                        "code": code,
-                        "review_type": selected_type_key
-                    }
-                    
-                    response = requests.post(
-                        f"{API_BASE_URL}/review",
-                        json=payload,
-                        headers=headers
-                    )
-                    
-                    if response.status_code == 200:
-                        review_data = response.json()
-                        st.session_state.review_result = review_data.get("review_content")
+                    cached = api_client.cached_review(code, selected_type_key, selected_language)
+                    if cached is not None:
+                        # Already reviewed in this session: show it without asking the backend again.
+                        result["content"] = streamed = cached
+                        with st.container(height=725, border=True):
+                            st.markdown(cached)
+                    elif code.count("\n") + 1 > LARGE_INPUT_LINES:
+                        # Big files go through the job queue instead of one long-held connection.
+                        content, error = run_review_job(payload)
+                        if error:
+                            result["error"] = error
+                        else:
+                            result["content"] = streamed = content
+                            with st.container(height=725, border=True):
+                                st.markdown(content)
+                    else:
+                        # Render tokens as they arrive instead of waiting on the full review.
+                        with st.container(height=725, border=True):
+                            streamed = st.write_stream(stream_text("/review/stream", payload, result))
+
+                    if "error" in result:
+                        st.error(result["error"])
+                    else:
+                        st.session_state.review_result = result.get("content", streamed)
                         st.session_state.last_review_type = selected_type_key
-                    elif response.status_code == 401:
+                        if cached is None:
+                            api_client.remember_review(code, selected_type_key, selected_language, st.session_state.review_result)
+                            fetch_history.clear()  # The new review belongs at the top of the history.
+                        # The diff view needs the complete, cleaned refactor output.
+                        if selected_type_key == "refactor":
+                            st.rerun(scope="fragment")
+
+                except StreamError as e:
+                    if e.status_code == 401:
                         st.error("Authentication failed.")
                         st.page_link("pages/2_Login.py", label="Go to Login", icon="🔑")
                     else:
-                        st.error(f"An error occurred: {response.text}")
-                        
+                        st.error(f"An error occurred: {e}")
                 except Exception as e:
                     st.error(f"An unexpected error occurred: {e}")
 
-    # --- Display Logic ---
-    if "review_result" in st.session_state:
-        st.subheader("🤖 AI Output")
+        # --- Display Logic ---
+        if "review_result" in st.session_state and not output_rendered:
+            st.subheader("🤖 AI Output")
         
-        if st.session_state.get("last_review_type") == "refactor":
-            st.markdown("#### Code Diff View")
-            if DIFF_VIEWER_AVAILABLE:
-                st.caption("Left: Original | Right: AI Refactored")
-                diff_viewer(old_text=code, new_text=st.session_state.review_result, lang=selected_language)
-            else:
-                st.warning("`streamlit-diff-viewer` not found.")
-                st.code(st.session_state.review_result, language=selected_language)
-        else:
-            with st.container(height=725, border=True):
-                st.markdown(st.session_state.review_result)
-
-# --- Chatbot Popover (Existing Code) ---
-
-with st.popover("💬 Chat with AI", use_container_width=True):
-    if "popover_messages" not in st.session_state:
-        st.session_state.popover_messages = [{"role": "assistant", "content": "How can I help you with your code?"}]
-
-    with st.container(height=300):
-        for msg in st.session_state.popover_messages:
-            if msg["role"] == "user":
-                st.markdown(f"""
-                <div class="chat-message user">
-                    <div class="message-content">{msg["content"]}</div>
-                </div>
-                """, unsafe_allow_html=True)
+            if st.session_state.get("last_review_type") == "refactor":
+                st.markdown("#### Code Diff View")
+                if DIFF_VIEWER_AVAILABLE:
+                    st.caption("Left: Original | Right: AI Refactored")
+                    diff_viewer(old_text=code, new_text=st.session_state.review_result, lang=selected_language)
+                else:
+                    st.warning("`streamlit-diff-viewer` not found.")
+                    st.code(st.session_state.review_result, language=selected_language)
             else:
-                st.markdown(f"""
-                <div class="chat-message assistant">
-                    <div class="message-content">{msg["content"]}</div>
-                </div>
-                """, unsafe_allow_html=True)
-
-    if prompt := st.chat_input("Ask a coding question..."):
-        st.session_state.popover_messages.append({"role": "user", "content": prompt})
-        st.rerun()
-
-    if st.session_state.popover_messages[-1]["role"] == "user":
-        with st.spinner("AI is thinking..."):
+                with st.container(height=725, border=True):
+                    st.markdown(st.session_state.review_result)
+
+reviewer()
+
+# --- Review History Sidebar ---
+# Rendered after the review so a review made in this run is listed. A
+# fragment, so searching reruns only the sidebar; the review button reruns
+# it together with the reviewer.
+@st.fragment(key="past_reviews")
+def past_reviews_panel():
+    st.subheader("🕘 Past Reviews")
+    history_query = st.text_input("Search past reviews", placeholder="e.g. recursion")
+    try:
+        past_reviews = fetch_history(st.session_state["token"], history_query.strip())
+    except (StreamError, requests.RequestException):
+        past_reviews = None
+        st.caption("History is unavailable right now.")
+    if past_reviews == []:
+        st.caption("No matching reviews." if history_query else "Your reviews will appear here.")
+    for item in past_reviews or []:
+        when = time.strftime("%b %d, %H:%M", time.localtime(item["created_at"]))
+        label = f"{item['path'] or item['review_type'].title()} · {when}"
+        if st.button(label, key=f"past_review_{item['id']}", help=item["preview"], use_container_width=True):
             try:
-                headers = {"Authorization": f"Bearer {st.session_state['token']}"}
-                payload = {"message": st.session_state.popover_messages[-1]["content"]}
-                
-                response = requests.post(
-                    f"{API_BASE_URL}/chat",
-                    json=payload,
-                    headers=headers
-                )
-                
-                if response.status_code == 200:
-                    chat_response = response.json().get("reply")
-                    st.session_state.popover_messages.append({"role": "assistant", "content": chat_response})
-                else:
-                    st.session_state.popover_messages.append({"role": "assistant", "content": "Connection error."})
+                load_past_review(item["id"])
+                st.rerun()
+            except (StreamError, requests.RequestException) as e:
+                st.error(f"Could not load that review: {e}")
 
-            except Exception as e:
-                st.session_state.popover_messages.append({"role": "assistant", "content": f"Error: {e}"})
-        
+with st.sidebar:
+    past_reviews_panel()
+
+# --- Chatbot Popover ---
+# A fragment: a chat turn reruns only the popover, without reruns of its
+# own. Past messages are drawn as one element, so a long conversation
+# doesn't mean one element per message.
+def bubble_html(role, content):
+    return f'<div class="chat-message {role}">\n<div class="message-content">{content}</div>\n</div>'
+
+def chat_reply(message):
+    """Streams the reply to message into the current container and returns it."""
+    # Only the new question goes out; the server keeps the code and the conversation.
+    context = chat_context(st.session_state.get("language", "python"))
+    payload = {"message": message, "session_id": chat_session_id(context)}
+    result = {}
+    try:
+        streamed = st.write_stream(stream_text("/chat/stream", payload, result))
+    except StreamError as e:
+        if e.status_code != 404:
+            raise
+        # The session expired between turns.
+        st.session_state.pop("chat_session", None)
+        payload["session_id"] = chat_session_id(context)
+        streamed = st.write_stream(stream_text("/chat/stream", payload, result))
+    return result.get("error") or result.get("content", streamed)
+
+@st.fragment
+def chat_panel():
+    with st.popover("💬 Chat with AI", use_container_width=True):
+        if "popover_messages" not in st.session_state:
+            st.session_state.popover_messages = [{"role": "assistant", "content": "How can I help you with your code?"}]
+
+        history = st.container(height=300)
+        with history:
+            st.markdown(
+                "\n\n".join(bubble_html(m["role"], m["content"]) for m in st.session_state.popover_messages),
+                unsafe_allow_html=True,
+            )
+
+        if prompt := st.chat_input("Ask a coding question..."):
+            st.session_state.popover_messages.append({"role": "user", "content": prompt})
+            with history:
+                st.markdown(bubble_html("user", prompt), unsafe_allow_html=True)
+                reply_slot = st.empty()
+                try:
+                    with reply_slot:
+                        chat_response = chat_reply(prompt)
+                except Exception as e:
+                    chat_response = f"Error: {e}"
+                reply_slot.markdown(bubble_html("assistant", chat_response), unsafe_allow_html=True)
+            st.session_state.popover_messages.append({"role": "assistant", "content": chat_response})
 
-        st.rerun()
+chat_panel()